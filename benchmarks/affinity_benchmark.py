@@ -0,0 +1,97 @@
+"""Benchmark pinned against unpinned collection pool workers.
+
+Runs the feature extraction of synthetic songs through a multiprocessing pool, once with free floating workers and
+once with workers pinned to cpus spread across NUMA nodes with capped BLAS threads, and reports the speedup.
+
+Usage (from the repository root):
+    python -m benchmarks.affinity_benchmark --cores 16 --songs 64
+"""
+
+import argparse
+import multiprocessing
+import time
+from functools import partial
+
+import numpy as np
+
+from stepcovnet import affinity, parameters, sample_collection_helper
+
+
+def extract_features(config: dict, song_seconds: int, seed: int) -> float:
+    rng = np.random.default_rng(seed)
+    audio_data = rng.uniform(-1, 1, (config["SAMPLE_RATE"] * song_seconds, 2))
+    log_mels = sample_collection_helper.get_log_mels(
+        audio_data=audio_data,
+        audio_data_sample_rate=config["SAMPLE_RATE"],
+        config=config,
+    )
+    # Scaler fitting and training code paths are BLAS heavy. Mimic them so BLAS thread oversubscription shows up.
+    flat_log_mels = log_mels.reshape(len(log_mels), -1)[:, :1024].astype(np.float64)
+    return float(np.trace(flat_log_mels.T @ flat_log_mels))
+
+
+def run(cores: int, num_songs: int, song_seconds: int, pool_kwargs: dict) -> float:
+    config = dict(
+        parameters.CONFIG, NUM_CHANNELS=parameters.CONFIG["NUM_MULTI_CHANNELS"]
+    )
+    func = partial(extract_features, config, song_seconds)
+    start_time = time.perf_counter()
+    with multiprocessing.Pool(cores, **pool_kwargs) as pool:
+        pool.map(func, range(num_songs))
+    return time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark pinned against unpinned pool workers"
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="Number of pool workers",
+    )
+    parser.add_argument(
+        "--songs", type=int, default=32, help="Number of synthetic songs"
+    )
+    parser.add_argument(
+        "--seconds",
+        type=int,
+        default=60,
+        help="Length of each synthetic song in seconds",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of runs of each mode; the best is kept",
+    )
+    args = parser.parse_args()
+
+    print("NUMA nodes: %s" % affinity.get_numa_nodes())
+    print("Worker cpus: %s" % affinity.plan_worker_cpus(args.cores))
+    unpinned_seconds = min(
+        run(args.cores, args.songs, args.seconds, {}) for _ in range(args.repeats)
+    )
+    pinned_seconds = min(
+        run(
+            args.cores,
+            args.songs,
+            args.seconds,
+            affinity.get_pool_kwargs(args.cores, pin_workers=True),
+        )
+        for _ in range(args.repeats)
+    )
+    print(
+        "Unpinned: %.2f seconds (%.2f songs/s)"
+        % (unpinned_seconds, args.songs / unpinned_seconds)
+    )
+    print(
+        "Pinned:   %.2f seconds (%.2f songs/s)"
+        % (pinned_seconds, args.songs / pinned_seconds)
+    )
+    print("Speedup:  %.2fx" % (unpinned_seconds / pinned_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Benchmark the chunk layouts and compressions of ModelDataset.
+
+Writes the same songs to a dataset with each layout and reports the write throughput, the file size and the read
+throughput of TrainingFeatureGenerator, which reads contiguous slices of about batch_size rows of each song. Pass the
+chosen layout to training_data_collection.py with --compression, --compression-level, --shuffle, --chunk-rows,
+--label-layout and --feature-encoding.
+
+Usage (from the repository root):
+    python -m benchmarks.dataset_layout_benchmark --songs 16 --seconds 60
+    python -m benchmarks.dataset_layout_benchmark --dataset <path to dataset without extension> --songs 16
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from stepcovnet import (
+    constants,
+    dataset,
+    parameters,
+    sample_collection_helper,
+    training,
+)
+
+DEFAULT_LAYOUTS = [
+    {"compression": "lzf"},
+    {"compression": "lzf", "shuffle": True},
+    {"compression": "gzip", "compression_level": 1},
+    {"compression": "gzip", "compression_level": 4},
+    {"compression": "gzip", "compression_level": 4, "shuffle": True},
+    {"compression": "gzip", "compression_level": 9, "shuffle": True},
+    {"compression": "none"},
+    {"compression": "lzf", "chunk_rows": 32},
+    {"compression": "lzf", "chunk_rows": 256},
+    {"compression": "lzf", "chunk_rows": 1024},
+    {"compression": "gzip", "compression_level": 4, "chunk_rows": 256},
+    {"compression": "none", "chunk_rows": 256},
+    {"compression": "lzf", "label_layout": "sparse"},
+    {"compression": "gzip", "compression_level": 4, "label_layout": "sparse"},
+    {"compression": "lzf", "label_layout": "compact"},
+    {"compression": "lzf", "chunk_rows": 256, "label_layout": "compact"},
+    {"compression": "lzf", "label_layout": "compact", "feature_encoding": "uint8"},
+    {
+        "compression": "gzip",
+        "compression_level": 4,
+        "label_layout": "compact",
+        "feature_encoding": "uint8",
+    },
+]
+
+
+def build_synthetic_song(config: dict, song_seconds: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    # Tones with noise so the features compress like music instead of like random data
+    time_steps = np.arange(config["SAMPLE_RATE"] * song_seconds) / config["SAMPLE_RATE"]
+    audio_data = sum(
+        np.sin(2 * np.pi * frequency * time_steps) * rng.uniform(0.1, 0.5)
+        for frequency in rng.uniform(50, 4000, 8)
+    ) + rng.normal(0, 0.05, len(time_steps))
+    features = sample_collection_helper.get_log_mels(
+        audio_data=audio_data.reshape(-1, 1),
+        audio_data_sample_rate=config["SAMPLE_RATE"],
+        config=config,
+    ).astype("float16")
+    num_frames = len(features)
+    song_data = {"features": features, "file_names": "song_%d" % seed}
+    codes = np.where(
+        rng.random(num_frames) < 0.1,
+        rng.integers(1, constants.NUM_ARROW_COMBS, num_frames),
+        0,
+    )
+    string_arrows = constants.ALL_ARROW_COMBS[codes]
+    arrows = np.array([list(arrow) for arrow in string_arrows], dtype="int8")
+    binary_encoded_arrows = np.zeros(
+        (num_frames, constants.NUM_ARROWS * config["NUM_ARROW_TYPES"]), dtype="int8"
+    )
+    for i in range(constants.NUM_ARROWS):
+        binary_encoded_arrows[
+            np.arange(num_frames), i * config["NUM_ARROW_TYPES"] + arrows[:, i]
+        ] = 1
+    labels = {
+        "labels": (codes > 0).astype("int8"),
+        "sample_weights": np.ones(num_frames, dtype="float16"),
+        "arrows": arrows,
+        "label_encoded_arrows": codes.astype("int16"),
+        "binary_encoded_arrows": binary_encoded_arrows,
+        "string_arrows": string_arrows.astype("S4"),
+        "onehot_encoded_arrows": np.eye(constants.NUM_ARROW_COMBS, dtype="int8")[codes],
+    }
+    for dataset_name, data in labels.items():
+        song_data[dataset_name] = {"challenge": data}
+    return song_data
+
+
+def load_songs(dataset_path: str, num_songs: int) -> list[dict]:
+    with dataset.ModelDataset(dataset_path) as model_dataset:
+        return [
+            model_dataset.read_song(song_index)
+            for song_index in range(
+                min(num_songs, len(model_dataset.song_index_ranges))
+            )
+        ]
+
+
+def get_song_bytes(song_data: dict) -> int:
+    return sum(
+        (
+            sum(value.nbytes for value in data.values())
+            if isinstance(data, dict)
+            else getattr(data, "nbytes", 0)
+        )
+        for data in song_data.values()
+    )
+
+
+def write_dataset(dataset_path: str, songs: list[dict], layout: dict) -> float:
+    start_time = time.perf_counter()
+    with dataset.ModelDataset(dataset_path, overwrite=True, **layout) as model_dataset:
+        for song_data in songs:
+            model_dataset.dump(**song_data)
+    return time.perf_counter() - start_time
+
+
+def read_dataset(dataset_path: str, batch_size: int, lookback: int) -> float:
+    with dataset.ModelDataset(dataset_path) as model_dataset:
+        num_songs = len(model_dataset.song_index_ranges)
+        num_samples = len(model_dataset)
+    feature_generator = training.TrainingFeatureGenerator(
+        dataset_path=dataset_path,
+        dataset_type=dataset.ModelDataset,
+        batch_size=batch_size,
+        indexes=np.arange(num_songs),
+        num_samples=num_samples,
+        lookback=lookback,
+    )
+    batches = feature_generator()
+    start_time = time.perf_counter()
+    for _ in range(len(feature_generator)):
+        next(batches)
+    batches.close()
+    return num_samples / (time.perf_counter() - start_time)
+
+
+def format_layout(layout: dict) -> str:
+    layout = dict(
+        {
+            "compression_level": None,
+            "shuffle": False,
+            "chunk_rows": None,
+            "label_layout": "dense",
+            "feature_encoding": "float16",
+        },
+        **layout,
+    )
+    return "%s%s%s, chunk rows: %s, %s labels, %s features" % (
+        layout["compression"],
+        (
+            ""
+            if layout["compression_level"] is None
+            else "-%d" % layout["compression_level"]
+        ),
+        " + shuffle" if layout["shuffle"] else "",
+        "auto" if layout["chunk_rows"] is None else layout["chunk_rows"],
+        layout["label_layout"],
+        layout["feature_encoding"],
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the chunk layouts and compressions of ModelDataset"
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        default=None,
+        help="Dataset to copy songs from, without the file extension: defaults to synthetic songs",
+    )
+    parser.add_argument("--songs", type=int, default=8, help="Number of songs")
+    parser.add_argument(
+        "--seconds",
+        type=int,
+        default=60,
+        help="Length of each synthetic song in seconds",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=training.TrainingHyperparameters.DEFAULT_BATCH_SIZE,
+        help="Batch size of the training reads",
+    )
+    parser.add_argument(
+        "--lookback", type=int, default=3, help="Lookback of the training reads"
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Path to save the results as json"
+    )
+    args = parser.parse_args()
+
+    if args.dataset is not None:
+        songs = load_songs(args.dataset, args.songs)
+    else:
+        config = dict(parameters.CONFIG, NUM_CHANNELS=1)
+        songs = [
+            build_synthetic_song(config, args.seconds, seed)
+            for seed in range(args.songs)
+        ]
+    song_bytes = sum(get_song_bytes(song_data) for song_data in songs)
+    print(
+        "%d songs, %d frames, %.1f MB uncompressed"
+        % (
+            len(songs),
+            sum(len(song_data["features"]) for song_data in songs),
+            song_bytes / 1024**2,
+        )
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for layout_index, layout in enumerate(DEFAULT_LAYOUTS):
+            dataset_path = os.path.join(temp_dir, "layout_%d" % layout_index)
+            write_seconds = write_dataset(dataset_path, songs, layout)
+            file_size = os.path.getsize(
+                dataset.ModelDataset.append_file_type(dataset_path)
+            )
+            read_samples_per_second = read_dataset(
+                dataset_path, args.batch_size, args.lookback
+            )
+            os.remove(dataset.ModelDataset.append_file_type(dataset_path))
+            results.append(
+                {
+                    "layout": layout,
+                    "write_mb_per_second": song_bytes / 1024**2 / write_seconds,
+                    "file_size_mb": file_size / 1024**2,
+                    "read_samples_per_second": read_samples_per_second,
+                }
+            )
+            print(
+                "%-68s write: %7.1f MB/s  size: %7.1f MB  read: %9.0f samples/s"
+                % (
+                    format_layout(layout),
+                    results[-1]["write_mb_per_second"],
+                    results[-1]["file_size_mb"],
+                    results[-1]["read_samples_per_second"],
+                )
+            )
+
+    fastest_read = max(results, key=lambda result: result["read_samples_per_second"])
+    smallest = min(results, key=lambda result: result["file_size_mb"])
+    print("Fastest training reads: %s" % format_layout(fastest_read["layout"]))
+    print("Smallest file: %s" % format_layout(smallest["layout"]))
+    if args.output is not None:
+        with open(args.output, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Report the error of storing the features of a dataset as uint8 instead of float16.
+
+Quantizes the features of each song with the per song and per band transform used by ModelDataset when created with
+feature_encoding="uint8", and compares the dequantized features to the float16 features of the dataset. Errors are
+reported in feature units and in standard deviations of each band, the units the model sees after scaling. Pass
+--feature-encoding uint8 to training_data_collection.py to store quantized features.
+
+Usage (from the repository root):
+    python -m benchmarks.feature_quantization_report --dataset <path to dataset without extension> --songs 16
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+from stepcovnet import dataset
+
+
+def get_song_errors(features: np.ndarray) -> dict:
+    features = features.astype(np.float64)
+    dequantized = dataset.dequantize_features(*dataset.quantize_features(features))
+    errors = dequantized - features
+    band_stds = features.std(axis=(0, 1))
+    band_stds[band_stds == 0] = 1
+    signal_power = np.mean(features**2)
+    noise_power = np.mean(errors**2)
+    return {
+        "num_frames": len(features),
+        "max_abs_error": float(np.abs(errors).max()),
+        "rmse": float(np.sqrt(noise_power)),
+        "scaled_max_abs_error": float(np.abs(errors / band_stds).max()),
+        "scaled_rmse": float(np.sqrt(np.mean((errors / band_stds) ** 2))),
+        "snr_db": (
+            float("inf")
+            if noise_power == 0
+            else float(10 * np.log10(signal_power / noise_power))
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the error of storing the features of a dataset as uint8"
+    )
+    parser.add_argument(
+        "--dataset",
+        type=str,
+        required=True,
+        help="Dataset with float16 features, without the file extension",
+    )
+    parser.add_argument(
+        "--songs", type=int, default=-1, help="Number of songs: -1 uses all the songs"
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="Path to save the results as json"
+    )
+    args = parser.parse_args()
+
+    results = []
+    with dataset.ModelDataset(args.dataset) as model_dataset:
+        if model_dataset.feature_encoding != "float16":
+            raise ValueError("Features of %s are already quantized" % args.dataset)
+        file_names = model_dataset.file_names
+        num_songs = len(file_names) if args.songs < 0 else args.songs
+        for song_index, (song_start_index, song_end_index) in enumerate(
+            model_dataset.song_index_ranges[:num_songs]
+        ):
+            song_errors = get_song_errors(
+                model_dataset.read_features(song_start_index, song_end_index)
+            )
+            results.append(dict(file_name=file_names[song_index], **song_errors))
+            print(
+                "%-40s max error: %.4f  rmse: %.4f  rmse (stds): %.4f  snr: %.1f dB"
+                % (
+                    file_names[song_index][:40],
+                    song_errors["max_abs_error"],
+                    song_errors["rmse"],
+                    song_errors["scaled_rmse"],
+                    song_errors["snr_db"],
+                )
+            )
+
+    num_frames = np.array([result["num_frames"] for result in results])
+    print(
+        "%d songs, %d frames; max error: %.4f  rmse: %.4f  rmse (stds): %.4f  worst snr: %.1f dB"
+        % (
+            len(results),
+            num_frames.sum(),
+            max(result["max_abs_error"] for result in results),
+            np.sqrt(
+                np.average(
+                    [result["rmse"] ** 2 for result in results], weights=num_frames
+                )
+            ),
+            np.sqrt(
+                np.average(
+                    [result["scaled_rmse"] ** 2 for result in results],
+                    weights=num_frames,
+                )
+            ),
+            min(result["snr_db"] for result in results),
+        )
+    )
+    if args.output is not None:
+        with open(args.output, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Benchmark the time from building an online dataset to its first training batch.
+
+Builds an online dataset from excerpts of the test song, reading the frame counts from the audio headers, then times the
+training stats and the first batch twice: with the scalers fitted on the features of a subsample of the songs, like
+training with --scaler-songs, and on the features of every song. The bias comes from the positive samples saved in the
+manifest both times.
+
+Usage (from the repository root):
+    python -m benchmarks.online_dataset_benchmark --songs 32 --seconds 20 --scaler-songs 4
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from stepcovnet import dataset, parameters, utils
+from stepcovnet.online_dataset import OnlineModelDataset
+
+TEST_DATA_PATH = os.path.join("tests", "data")
+
+
+def write_songs(
+    tmp_path: str, num_songs: int, song_seconds: int
+) -> tuple[str, str, list[str]]:
+    wavs_path = os.path.join(tmp_path, "wavs")
+    timings_path = os.path.join(tmp_path, "timings")
+    os.makedirs(wavs_path)
+    os.makedirs(timings_path)
+    audio_data, sample_rate = sf.read(os.path.join(TEST_DATA_PATH, "tide.ogg"))
+    with open(os.path.join(TEST_DATA_PATH, "tide.txt")) as timings_file:
+        timing_lines = timings_file.read().splitlines()
+    song_length = len(audio_data) / sample_rate
+    file_names = []
+    for song_index in range(num_songs):
+        start = (song_index * song_seconds) % max(song_length - song_seconds, 1)
+        file_name = "song_%d" % song_index
+        sf.write(
+            os.path.join(wavs_path, file_name + ".wav"),
+            audio_data[
+                int(start * sample_rate) : int((start + song_seconds) * sample_rate)
+            ],
+            sample_rate,
+        )
+        # Only the notes of the excerpt are kept, shifted to its start
+        timings = []
+        for line in timing_lines:
+            if line[:1].isdigit():
+                arrows, timing = line.split(" ")[0:2]
+                if start <= float(timing) < start + song_seconds:
+                    timings.append("%s %f" % (arrows, float(timing) - start))
+            else:
+                timings.append(line)
+        with open(os.path.join(timings_path, file_name + ".txt"), "w") as f:
+            f.write("\n".join(timings) + "\n")
+        file_names.append(file_name)
+    return wavs_path, timings_path, file_names
+
+
+def first_batch(
+    dataset_path: str, cores: int, batch_size: int, scaler_songs: int | None
+):
+    start_time = time.perf_counter()
+    with OnlineModelDataset(dataset_path, mode="r", cores=cores) as model_dataset:
+        song_index_ranges = model_dataset.song_index_ranges
+        indexes = np.arange(len(song_index_ranges))
+        if scaler_songs is not None and scaler_songs < len(indexes):
+            # Spread over the songs like TrainingConfig.get_scaler_indexes
+            indexes = indexes[
+                np.linspace(0, len(indexes) - 1, scaler_songs).astype(int)
+            ]
+        model_dataset.set_read_order(indexes)
+        num_pos = model_dataset.get_song_stats()["song_pos_samples"][
+            :, dataset.DIFFICULTIES.index(model_dataset.difficulty)
+        ].sum()
+        scalers = None
+        for song_start_index, song_end_index in song_index_ranges[indexes]:
+            scalers = utils.get_channel_scalers(
+                model_dataset.features[song_start_index:song_end_index],
+                existing_scalers=scalers,
+            )
+        stats_seconds = time.perf_counter() - start_time
+        features = model_dataset.features[0:batch_size]
+        utils.apply_scalers(features.astype(np.float64), scalers)
+        model_dataset.labels[0:batch_size]
+    return stats_seconds, time.perf_counter() - start_time, num_pos
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark building an online dataset up to its first batch"
+    )
+    parser.add_argument("--songs", type=int, default=8, help="Number of songs")
+    parser.add_argument(
+        "--seconds", type=int, default=20, help="Length of each song in seconds"
+    )
+    parser.add_argument(
+        "--cores", type=int, default=1, help="Number of worker processes"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=32, help="Frames of the first batch"
+    )
+    parser.add_argument(
+        "--scaler-songs",
+        type=int,
+        default=16,
+        help="Number of songs the subsampled scalers are fitted on",
+    )
+    args = parser.parse_args()
+
+    config = dict(parameters.CONFIG, NUM_CHANNELS=1)
+    with tempfile.TemporaryDirectory() as tmp_path:
+        wavs_path, timings_path, file_names = write_songs(
+            tmp_path, args.songs, args.seconds
+        )
+        dataset_path = os.path.join(tmp_path, "dataset")
+        start_time = time.perf_counter()
+        with OnlineModelDataset(
+            dataset_path, overwrite=True, cores=args.cores
+        ) as model_dataset:
+            model_dataset.build(wavs_path, timings_path, config, file_names)
+            num_samples = model_dataset.num_samples
+        build_seconds = time.perf_counter() - start_time
+        print(
+            "Build:   %.2f seconds for %d songs and %d frames"
+            % (build_seconds, args.songs, num_samples)
+        )
+        for name, scaler_songs in [("Subsample", args.scaler_songs), ("All", None)]:
+            stats_seconds, batch_seconds, num_pos = first_batch(
+                dataset_path, args.cores, args.batch_size, scaler_songs
+            )
+            print(
+                "%-10s stats in %.2f seconds, first batch after %.2f seconds (%d positive samples)"
+                % (name + ":", stats_seconds, batch_seconds, num_pos)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import json
+import os
+import shutil
+import time
+from os.path import join
+
+import psutil
+
+from stepcovnet import conversion, data, dataset, utils
+
+TARGET_DATASET_TYPES = [
+    data.ModelDatasetTypes.SINGULAR_DATASET.name,
+    data.ModelDatasetTypes.DISTRIBUTED_DATASET.name,
+    data.ModelDatasetTypes.MEMMAP_DATASET.name,
+    data.ModelDatasetTypes.SHARDED_DATASET.name,
+]
+
+
+def dataset_converter(
+    input_path: str,
+    output_path: str,
+    type_name: str = data.ModelDatasetTypes.MEMMAP_DATASET.name,
+    cores: int = 1,
+    compression: str | None = None,
+    compression_level: int | None = None,
+    shuffle_int: int | None = None,
+    chunk_rows: int | None = None,
+    label_layout: str | None = None,
+    feature_encoding: str | None = None,
+):
+    if not os.path.isfile(join(input_path, "metadata.json")):
+        raise FileNotFoundError(
+            "Training data path %s has no metadata.json" % os.path.abspath(input_path)
+        )
+    if type_name not in TARGET_DATASET_TYPES:
+        raise ValueError(
+            "Cannot convert to %s. Choose one of: %s"
+            % (type_name, TARGET_DATASET_TYPES)
+        )
+    if cores > os.cpu_count() or cores == 0:
+        raise ValueError(
+            "Number of cores selected must not be 0 and must be less than the number cpu cores (%d)"
+            % os.cpu_count()
+        )
+    cores = psutil.cpu_count(logical=False) if cores < 0 else cores
+
+    with open(join(input_path, "metadata.json"), "r") as json_file:
+        metadata = json.load(json_file)
+    dataset_name = metadata["dataset_name"]
+    source_type = data.ModelDatasetTypes[metadata["dataset_type"]]
+    target_type = data.ModelDatasetTypes[type_name]
+    source_path = utils.get_dataset_path(input_path, metadata)
+    target_path = join(output_path, utils.get_dataset_name(dataset_name, type_name))
+    # Checked before the target is created, so a missing source does not leave an empty target behind
+    if not os.path.exists(source_type.value.append_file_type(source_path)):
+        raise FileNotFoundError("Dataset %s not found" % os.path.abspath(source_path))
+    if os.path.abspath(
+        source_type.value.append_file_type(source_path)
+    ) == os.path.abspath(target_type.value.append_file_type(target_path)):
+        raise ValueError("Dataset %s cannot be converted in place" % source_path)
+
+    # Layout options not given are kept from the source dataset
+    layout_options = {
+        "compression": compression,
+        "compression_level": compression_level,
+        "shuffle": None if shuffle_int is None else shuffle_int == 1,
+        "chunk_rows": chunk_rows,
+        "label_layout": label_layout,
+        "feature_encoding": feature_encoding,
+    }
+    layout_options = {
+        option: value for option, value in layout_options.items() if value is not None
+    }
+    if target_type == data.ModelDatasetTypes.MEMMAP_DATASET:
+        if layout_options:
+            raise ValueError("Layout options only apply to HDF5 datasets")
+        layout = {}
+    else:
+        layout = dict(metadata.get("layout", {}), **layout_options)
+        # Compression levels only apply to gzip, so the level of another compression is not kept
+        if (
+            "compression" in layout_options
+            and "compression_level" not in layout_options
+        ):
+            layout.pop("compression_level", None)
+
+    os.makedirs(output_path, exist_ok=True)
+    start_time = time.time()
+    with target_type.value(target_path, overwrite=True, **layout) as target_dataset:
+        conversion.convert_dataset(
+            source_type.value, source_path, target_dataset, cores=cores
+        )
+        if layout:
+            layout = target_dataset.layout
+
+    scaler_path = join(input_path, dataset_name + "_scaler.pkl")
+    if os.path.isfile(scaler_path) and not os.path.samefile(input_path, output_path):
+        shutil.copyfile(scaler_path, join(output_path, dataset_name + "_scaler.pkl"))
+    # The HDF5 layout does not apply to memory-mapped datasets
+    metadata.pop("layout", None)
+    if layout:
+        metadata["layout"] = layout
+    metadata["dataset_type"] = target_type.name
+    metadata["converted_from"] = source_type.name
+    with open(join(output_path, "metadata.json"), "w") as json_file:
+        json_file.write(json.dumps(metadata))
+
+    print("\nElapsed time was %g seconds" % (time.time() - start_time))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Convert a training dataset to another dataset type or layout"
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        type=str,
+        required=True,
+        help="Input training data path with the dataset and metadata.json",
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, required=True, help="Output converted data path"
+    )
+    parser.add_argument(
+        "--type",
+        type=str,
+        default=data.ModelDatasetTypes.MEMMAP_DATASET.name,
+        choices=TARGET_DATASET_TYPES,
+        help="Type of the converted dataset",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=1,
+        help="Number of processes reading the input dataset: -1 max number of physical cores",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default=None,
+        choices=dataset.COMPRESSION_TYPES,
+        help="Compression of the datasets: defaults to the input dataset compression",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=None,
+        choices=range(10),
+        help="Compression level of gzip: defaults to the input dataset compression level",
+    )
+    parser.add_argument(
+        "--shuffle",
+        type=int,
+        default=None,
+        choices=[0, 1],
+        help="Whether to apply the shuffle filter before compression: 0 - no shuffle, 1 - shuffle",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=None,
+        help="Number of rows per chunk: defaults to the input dataset chunk rows",
+    )
+    parser.add_argument(
+        "--label-layout",
+        type=str,
+        default=None,
+        choices=dataset.LABEL_LAYOUTS,
+        help="How labels are stored: defaults to the input dataset label layout",
+    )
+    parser.add_argument(
+        "--feature-encoding",
+        type=str,
+        default=None,
+        choices=dataset.FEATURE_ENCODINGS,
+        help="How features are stored: defaults to the input dataset feature encoding",
+    )
+    args = parser.parse_args()
+
+    dataset_converter(
+        input_path=args.input,
+        output_path=args.output,
+        type_name=args.type,
+        cores=args.cores,
+        compression=args.compression,
+        compression_level=args.compression_level,
+        shuffle_int=args.shuffle,
+        chunk_rows=args.chunk_rows,
+        label_layout=args.label_layout,
+        feature_encoding=args.feature_encoding,
+    )
@@ -0,0 +1,94 @@
+import json
+import os
+from os.path import join
+
+import joblib
+
+from stepcovnet import union_dataset, utils
+
+
+def dataset_union(input_paths: list[str], output_path: str, name: str):
+    all_metadata = []
+    for input_path in input_paths:
+        if not os.path.isfile(join(input_path, "metadata.json")):
+            raise FileNotFoundError(
+                "Training data path %s has no metadata.json"
+                % os.path.abspath(input_path)
+            )
+        with open(join(input_path, "metadata.json"), "r") as json_file:
+            all_metadata.append(json.load(json_file))
+    if not all_metadata:
+        raise ValueError("At least one training data path is required")
+    if any(
+        metadata["config"] != all_metadata[0]["config"] for metadata in all_metadata
+    ):
+        raise ValueError("Training data was collected with different configs")
+
+    os.makedirs(output_path, exist_ok=True)
+    union_dataset.create_union(
+        join(output_path, name + "_dataset"),
+        [
+            (
+                metadata["dataset_type"],
+                utils.get_dataset_path(input_path, metadata),
+            )
+            for input_path, metadata in zip(input_paths, all_metadata)
+        ],
+    )
+
+    # Scalers of the union are merged from the moments kept by the scalers of each input, without reading features
+    all_scalers = []
+    for input_path, metadata in zip(input_paths, all_metadata):
+        scaler_path = join(input_path, metadata["dataset_name"] + "_scaler.pkl")
+        all_scalers.append(
+            joblib.load(open(scaler_path, "rb"))
+            if os.path.isfile(scaler_path)
+            else None
+        )
+    if all(scalers is not None for scalers in all_scalers):
+        print("Saving merged scalers")
+        joblib.dump(
+            utils.merge_channel_scalers(all_scalers),
+            open(join(output_path, name + "_scaler.pkl"), "wb"),
+        )
+    else:
+        print("Training data without scalers found. Scalers are computed when training")
+
+    metadata = {
+        "dataset_name": name,
+        "dataset_type": "UNION_DATASET",
+        "config": all_metadata[0]["config"],
+        "file_name": [
+            file_name
+            for metadata in all_metadata
+            for file_name in metadata.get("file_name", [])
+        ],
+        "union_of": [os.path.abspath(input_path) for input_path in input_paths],
+    }
+    with open(join(output_path, "metadata.json"), "w") as json_file:
+        json_file.write(json.dumps(metadata))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Train on several training datasets as one without copying them"
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Input training data paths with the dataset and metadata.json",
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, required=True, help="Output union data path"
+    )
+    parser.add_argument(
+        "--name", type=str, required=True, help="Name of the union dataset"
+    )
+    args = parser.parse_args()
+
+    dataset_union(input_paths=args.input, output_path=args.output, name=args.name)
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import glob
+import multiprocessing
+import os
+import re
+import sys
+
+import psutil
+
+BLAS_THREADS_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMBA_NUM_THREADS",
+]
+
+
+def parse_cpu_list(cpu_list: str) -> list[int]:
+    """
+    Parse a Linux cpu list such as 0-3,8-11
+    :param cpu_list: str - comma separated cpu ids and cpu id ranges
+    :return: list[int] - cpu ids
+    """
+    cpus = []
+    for cpu_range in filter(None, cpu_list.strip().split(",")):
+        if "-" in cpu_range:
+            first_cpu, last_cpu = cpu_range.split("-")
+            cpus.extend(range(int(first_cpu), int(last_cpu) + 1))
+        else:
+            cpus.append(int(cpu_range))
+    return cpus
+
+
+def supports_cpu_affinity() -> bool:
+    return hasattr(psutil.Process, "cpu_affinity")
+
+
+def get_numa_nodes() -> list[list[int]]:
+    """Return the cpus this process may run on, grouped by NUMA node. Falls back to a single node when the NUMA
+    topology is not exposed (non-Linux platforms, containers without sysfs)."""
+    allowed_cpus = (
+        psutil.Process().cpu_affinity()
+        if supports_cpu_affinity()
+        else list(range(os.cpu_count()))
+    )
+    numa_nodes = []
+    for node_path in sorted(
+        glob.glob("/sys/devices/system/node/node[0-9]*"),
+        key=lambda path: int(re.sub(r"\D", "", os.path.basename(path))),
+    ):
+        try:
+            with open(os.path.join(node_path, "cpulist")) as cpu_list_file:
+                node_cpus = parse_cpu_list(cpu_list_file.read())
+        except (OSError, ValueError):
+            continue
+        node_cpus = [cpu for cpu in node_cpus if cpu in allowed_cpus]
+        if node_cpus:
+            numa_nodes.append(node_cpus)
+    return numa_nodes if numa_nodes else [allowed_cpus]
+
+
+def plan_worker_cpus(
+    num_workers: int, numa_nodes: list[list[int]] | None = None
+) -> list[list[int]]:
+    """
+    Assign each worker a set of cpus. Workers are spread round-robin across NUMA nodes and the cpus of each node are
+    split evenly between the workers placed on it, so workers never share cpus unless there are more workers than cpus.
+    :param num_workers: int - number of pool workers
+    :param numa_nodes: list[list[int]] - cpus of each NUMA node; defaults to the NUMA nodes of this machine
+    :return: list[list[int]] - cpus of each worker
+    """
+    numa_nodes = numa_nodes if numa_nodes is not None else get_numa_nodes()
+    node_workers = [[] for _ in numa_nodes]
+    for worker_index in range(num_workers):
+        node_workers[worker_index % len(numa_nodes)].append(worker_index)
+    worker_cpus = [[] for _ in range(num_workers)]
+    for node_cpus, workers in zip(numa_nodes, node_workers):
+        for i, worker_index in enumerate(workers):
+            if len(workers) <= len(node_cpus):
+                first_cpu = i * len(node_cpus) // len(workers)
+                last_cpu = (i + 1) * len(node_cpus) // len(workers)
+                worker_cpus[worker_index] = node_cpus[first_cpu:last_cpu]
+            else:
+                worker_cpus[worker_index] = [node_cpus[i % len(node_cpus)]]
+    return worker_cpus
+
+
+def limit_blas_threads(num_threads: int):
+    """Cap the threads used by BLAS/OpenMP/numba in this process and the processes it starts"""
+    for env_var in BLAS_THREADS_ENV_VARS:
+        os.environ[env_var] = str(num_threads)
+    # Thread pools of libraries already loaded by the parent before forking ignore the environment
+    try:
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(limits=num_threads)
+    except ImportError:
+        pass
+    if "numba" in sys.modules:
+        numba = sys.modules["numba"]
+        numba.set_num_threads(min(num_threads, numba.config.NUMBA_NUM_THREADS))
+
+
+def pin_worker(
+    worker_cpus: list[list[int]],
+    worker_counter: multiprocessing.Value,
+    blas_threads: int | None,
+):
+    with worker_counter.get_lock():
+        worker_index = worker_counter.value
+        worker_counter.value += 1
+    cpus = worker_cpus[worker_index % len(worker_cpus)]
+    if supports_cpu_affinity():
+        psutil.Process().cpu_affinity(cpus)
+    limit_blas_threads(blas_threads if blas_threads is not None else len(cpus))
+
+
+def get_pool_kwargs(
+    cores: int, pin_workers: bool = False, blas_threads: int | None = None
+) -> dict:
+    """
+    Build the keyword arguments of multiprocessing.Pool to pin each worker to its own cpus
+    :param cores: int - number of pool workers
+    :param pin_workers: bool - whether to pin workers to cpus spread across NUMA nodes
+    :param blas_threads: int - maximum BLAS threads per worker; defaults to the number of cpus of the worker when
+                         pinning, and is left unlimited otherwise
+    :return: dict - initializer and initargs for multiprocessing.Pool
+    """
+    if not pin_workers:
+        if blas_threads is None:
+            return {}
+        return {"initializer": limit_blas_threads, "initargs": (blas_threads,)}
+    if not supports_cpu_affinity():
+        print(
+            "[WARN] CPU affinity is not supported on this platform. Workers are not pinned."
+        )
+    return {
+        "initializer": pin_worker,
+        "initargs": (
+            plan_worker_cpus(cores),
+            multiprocessing.Value("i", 0),
+            blas_threads,
+        ),
+    }
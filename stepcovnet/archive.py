@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import io
+import os
+import struct
+import tarfile
+import zipfile
+import zlib
+from typing import BinaryIO
+
+from stepcovnet import utils
+
+ZIP_LOCAL_HEADER_SIZE = 30
+ZIP_LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+
+class ArchiveMemberReader(io.RawIOBase):
+    """Seekable read-only view over a byte range of an archive file"""
+
+    def __init__(self, archive_path: str, offset: int, size: int):
+        super(ArchiveMemberReader, self).__init__()
+        self.file = open(archive_path, "rb")
+        self.offset = offset
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        num_bytes = min(len(buffer), self.size - self.position)
+        if num_bytes <= 0:
+            return 0
+        self.file.seek(self.offset + self.position)
+        num_bytes = self.file.readinto(memoryview(buffer)[:num_bytes])
+        self.position += num_bytes
+        return num_bytes
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence (%r)" % whence)
+        if position < 0:
+            raise ValueError("Negative seek position %d" % position)
+        self.position = position
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def close(self):
+        self.file.close()
+        super(ArchiveMemberReader, self).close()
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and (
+        zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+    )
+
+
+class SongArchive:
+    """Read-only access to the songs of a zip or tar archive without extracting it.
+
+    The archive is scanned once to build an index from member file name to the location of its data. The index is
+    small and picklable, so it can be shipped to pool workers, which then open members by seeking straight to their
+    data instead of scanning the archive again. Only members of compressed tar archives (.tar.gz, .tar.bz2, ...)
+    cannot be seeked to and are read by streaming the archive up to the member.
+    """
+
+    def __init__(self, archive_path: str):
+        if not is_archive(archive_path):
+            raise ValueError(
+                "%s is not a zip or tar archive" % os.path.abspath(archive_path)
+            )
+        self.archive_path = archive_path
+        self.is_zip = zipfile.is_zipfile(archive_path)
+        self.member_index = (
+            self.build_zip_index() if self.is_zip else self.build_tar_index()
+        )
+
+    def build_zip_index(self) -> dict[str, tuple]:
+        member_index = {}
+        with zipfile.ZipFile(self.archive_path) as zip_file, open(
+            self.archive_path, "rb"
+        ) as raw_file:
+            for member in zip_file.infolist():
+                file_name = self.get_member_file_name(member.filename)
+                if member.is_dir() or file_name is None or file_name in member_index:
+                    continue
+                raw_file.seek(member.header_offset)
+                local_header = raw_file.read(ZIP_LOCAL_HEADER_SIZE)
+                if local_header[:4] != ZIP_LOCAL_HEADER_SIGNATURE:
+                    raise ValueError(
+                        "Corrupted zip member %s in %s"
+                        % (member.filename, self.archive_path)
+                    )
+                name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+                data_offset = (
+                    member.header_offset
+                    + ZIP_LOCAL_HEADER_SIZE
+                    + name_length
+                    + extra_length
+                )
+                member_index[file_name] = (
+                    member.filename,
+                    data_offset,
+                    member.compress_size,
+                    member.file_size,
+                    member.compress_type,
+                )
+        return member_index
+
+    def build_tar_index(self) -> dict[str, tuple]:
+        member_index = {}
+        with tarfile.open(self.archive_path) as tar_file:
+            # Only plain tar archives are read straight from the file; compressed ones go through a decompressor
+            seekable = isinstance(tar_file.fileobj, io.BufferedReader)
+            for member in tar_file:
+                file_name = self.get_member_file_name(member.name)
+                if (
+                    not member.isfile()
+                    or file_name is None
+                    or file_name in member_index
+                ):
+                    continue
+                member_index[file_name] = (
+                    member.name,
+                    member.offset_data if seekable else None,
+                    member.size,
+                )
+        return member_index
+
+    @staticmethod
+    def get_member_file_name(member_name: str) -> str | None:
+        file_name = os.path.basename(member_name.rstrip("/"))
+        if (
+            not file_name
+            or "__MACOSX" in member_name.split("/")
+            or os.path.splitext(file_name)[0] in {".DS_Store", "_DS_Store"}
+        ):
+            return None
+        return file_name
+
+    def get_filenames(self) -> list[str]:
+        return list(self.member_index)
+
+    def open(self, file_name: str) -> BinaryIO:
+        """
+        Open an archive member for reading
+        :param file_name: str - file name of the member without its directories in the archive
+        :return: BinaryIO - seekable file-like object containing the member data
+        """
+        if file_name not in self.member_index:
+            raise FileNotFoundError(
+                "%s not found in archive %s" % (file_name, self.archive_path)
+            )
+        if self.is_zip:
+            return self.open_zip_member(*self.member_index[file_name])
+        return self.open_tar_member(*self.member_index[file_name])
+
+    def open_zip_member(
+        self,
+        member_name: str,
+        data_offset: int,
+        compress_size: int,
+        file_size: int,
+        compress_type: int,
+    ) -> BinaryIO:
+        if compress_type == zipfile.ZIP_STORED:
+            return io.BufferedReader(
+                ArchiveMemberReader(self.archive_path, data_offset, file_size)
+            )
+        if compress_type == zipfile.ZIP_DEFLATED:
+            with ArchiveMemberReader(
+                self.archive_path, data_offset, compress_size
+            ) as reader:
+                return io.BytesIO(zlib.decompress(reader.read(), wbits=-zlib.MAX_WBITS))
+        # Other compression methods are rare in song packs; let zipfile handle them.
+        with zipfile.ZipFile(self.archive_path) as zip_file:
+            return io.BytesIO(zip_file.read(member_name))
+
+    def open_tar_member(
+        self, member_name: str, data_offset: int | None, size: int
+    ) -> BinaryIO:
+        if data_offset is not None:
+            return io.BufferedReader(
+                ArchiveMemberReader(self.archive_path, data_offset, size)
+            )
+        with tarfile.open(self.archive_path) as tar_file:
+            return io.BytesIO(tar_file.extractfile(member_name).read())
+
+
+def get_song_path(path: str) -> str | SongArchive:
+    return SongArchive(path) if is_archive(path) else path
+
+
+def get_filenames(song_path: str | SongArchive) -> list[str]:
+    if isinstance(song_path, SongArchive):
+        return song_path.get_filenames()
+    return utils.get_filenames_from_folder(song_path)
+
+
+def open_song_file(song_path: str | SongArchive, file_name: str) -> str | BinaryIO:
+    if isinstance(song_path, SongArchive):
+        return song_path.open(file_name)
+    return os.path.join(song_path, file_name)
@@ -1,11 +1,15 @@
+import copy
+import hashlib
+import json
+import os
 from abc import ABC
-from typing import Type
+from typing import ContextManager, Type
 
 import numpy as np
 from sklearn import preprocessing
 from sklearn.model_selection import train_test_split
 
-from stepcovnet import dataset, training, constants, utils
+from stepcovnet import dataset, dataset_pool, training, constants, utils
 
 
 class AbstractConfig(ABC):
@@ -68,6 +72,8 @@ class TrainingConfig(AbstractConfig):
         lookback: int = 1,
         difficulty: str = "challenge",
         tokenizer_name: str = None,
+        dataset_kwargs: dict | None = None,
+        scaler_songs: int | None = None,
     ):
         super(TrainingConfig, self).__init__(
             dataset_config=dataset_config, lookback=lookback, difficulty=difficulty
@@ -78,8 +84,18 @@ class TrainingConfig(AbstractConfig):
         self.all_scalers = all_scalers
         self.limit = limit
         self.tokenizer_name = tokenizer_name
+        # Extra arguments to open the dataset with, like the read cache sizes of ModelDataset
+        self.dataset_kwargs = {} if dataset_kwargs is None else dataset_kwargs
+        # Songs the scalers are fitted on when the dataset has no feature moments, None for every song
+        self.scaler_songs = scaler_songs
 
-        # Combine some of these to reduce the number of loops and save I/O reads
+        # Song ranges and the stats recorded when songs were dumped replace reading labels and features
+        with self.enter_dataset as model_dataset:
+            self.song_index_ranges = np.asarray(model_dataset.song_index_ranges[:])
+            self.song_stats = model_dataset.get_song_stats()
+            self.songs_digest = self.get_songs_digest(
+                model_dataset.file_names, self.song_index_ranges
+            )
         (
             self.all_indexes,
             self.train_indexes,
@@ -93,27 +109,89 @@ class TrainingConfig(AbstractConfig):
         self.all_class_weights = None  # self.get_class_weights(self.all_indexes)
         self.init_bias_correction = self.get_init_bias_correction()
         self.train_scalers = self.get_train_scalers()
+        if self.all_scalers is None:
+            # Datasets computing features on demand have no scalers saved at collection time
+            self.all_scalers = self.get_all_scalers()
 
     def get_train_val_split(
         self,
     ) -> tuple[np.ndarray[int], np.ndarray[int], np.ndarray[int]]:
+        split = self.load_train_val_split()
+        if split is not None:
+            return split
         all_indexes = []
         with self.enter_dataset as model_dataset:
+            model_dataset.set_read_order(range(len(model_dataset.song_index_ranges)))
             total_samples = 0
-            index = 0
-            for song_start_index, song_end_index in model_dataset.song_index_ranges:
-                if not any(model_dataset.labels[song_start_index:song_end_index] < 0):
+            for index, (song_start_index, song_end_index) in enumerate(
+                model_dataset.song_index_ranges
+            ):
+                if self.difficulty in model_dataset.get_available_difficulties(index):
                     all_indexes.append(index)
                     total_samples += song_end_index - song_start_index
                     if 0 < self.limit < total_samples:
                         break
-                index += 1
         all_indexes = np.array(all_indexes)
         train_indexes, val_indexes, _, _ = train_test_split(
             all_indexes, all_indexes, test_size=0.1, shuffle=True, random_state=42
         )
+        self.save_train_val_split(all_indexes, train_indexes, val_indexes)
         return all_indexes, train_indexes, val_indexes
 
+    @staticmethod
+    def get_songs_digest(file_names: list[str], song_index_ranges: np.ndarray) -> str:
+        # Datasets collected again can hold the same number of songs in another order
+        songs_hash = hashlib.sha256()
+        songs_hash.update("\n".join(file_names).encode("utf-8"))
+        songs_hash.update(
+            np.ascontiguousarray(song_index_ranges, dtype=np.int64).tobytes()
+        )
+        return songs_hash.hexdigest()
+
+    @property
+    def split_path(self) -> str:
+        return "%s_%s_split.json" % (self.dataset_path, self.difficulty)
+
+    def load_train_val_split(
+        self,
+    ) -> tuple[np.ndarray[int], np.ndarray[int], np.ndarray[int]] | None:
+        if not os.path.isfile(self.split_path):
+            return None
+        with open(self.split_path, "r") as json_file:
+            split = json.load(json_file)
+        # Splits of a dataset with other songs or another limit are not reused
+        if (
+            split["num_songs"] != len(self.song_index_ranges)
+            or split.get("songs_digest") != self.songs_digest
+            or split["limit"] != self.limit
+        ):
+            return None
+        return (
+            np.array(split["all_indexes"], dtype=int),
+            np.array(split["train_indexes"], dtype=int),
+            np.array(split["val_indexes"], dtype=int),
+        )
+
+    def save_train_val_split(
+        self,
+        all_indexes: np.ndarray[int],
+        train_indexes: np.ndarray[int],
+        val_indexes: np.ndarray[int],
+    ):
+        split = {
+            "num_songs": len(self.song_index_ranges),
+            "songs_digest": self.songs_digest,
+            "limit": self.limit,
+            "all_indexes": all_indexes.tolist(),
+            "train_indexes": train_indexes.tolist(),
+            "val_indexes": val_indexes.tolist(),
+        }
+        try:
+            with open(self.split_path, "w") as json_file:
+                json.dump(split, json_file)
+        except OSError:
+            print("Could not save the train/val split to %s" % self.split_path)
+
     def get_class_weights(self, indexes: np.ndarray[int]) -> dict:
         labels = None
         with self.enter_dataset as model_dataset:
@@ -137,9 +215,11 @@ class TrainingConfig(AbstractConfig):
             zip(
                 list(range(len(class_counts))),
                 list(
-                    0
-                    if class_count == 0
-                    else (len(labels) / class_count) / len(class_counts)
+                    (
+                        0
+                        if class_count == 0
+                        else (len(labels) / class_count) / len(class_counts)
+                    )
                     for class_count in class_counts
                 ),
             )
@@ -153,7 +233,13 @@ class TrainingConfig(AbstractConfig):
         # Not completely correct but works for now
         num_all = self.num_train_samples
         num_pos = 0
+        if self.song_stats is not None:
+            num_pos = self.song_stats["song_pos_samples"][
+                self.train_indexes, dataset.DIFFICULTIES.index(self.difficulty)
+            ].sum()
+            return np.log(num_pos / (num_all - num_pos))
         with self.enter_dataset as model_dataset:
+            model_dataset.set_read_order(self.train_indexes)
             for index in self.train_indexes:
                 song_start_index, song_end_index = model_dataset.song_index_ranges[
                     index
@@ -163,30 +249,63 @@ class TrainingConfig(AbstractConfig):
         return np.log(num_pos / num_neg)
 
     def get_train_scalers(self) -> list | None:
-        training_scalers = None
+        return self.get_scalers(self.train_indexes)
+
+    def get_all_scalers(self) -> list | None:
+        if self.has_feature_moments:
+            return self.get_scalers(self.all_indexes)
+        return self.get_scalers(
+            self.val_indexes, existing_scalers=copy.deepcopy(self.train_scalers)
+        )
+
+    def get_scalers(
+        self, indexes: np.ndarray[int], existing_scalers: list | None = None
+    ) -> list | None:
+        if self.has_feature_moments and existing_scalers is None:
+            return utils.get_channel_scalers_from_moments(
+                self.song_index_ranges[indexes, 1] - self.song_index_ranges[indexes, 0],
+                self.song_stats["feature_means"][indexes],
+                self.song_stats["feature_variances"][indexes],
+            )
+        indexes = self.get_scaler_indexes(indexes)
+        scalers = existing_scalers
         with self.enter_dataset as model_dataset:
-            for index in self.train_indexes:
+            model_dataset.set_read_order(indexes)
+            for index in indexes:
                 song_start_index, song_end_index = model_dataset.song_index_ranges[
                     index
                 ]
                 features = model_dataset.features[song_start_index:song_end_index]
-                training_scalers = utils.get_channel_scalers(
-                    features, existing_scalers=training_scalers
-                )
-        return training_scalers
+                scalers = utils.get_channel_scalers(features, existing_scalers=scalers)
+        return scalers
+
+    @property
+    def has_feature_moments(self) -> bool:
+        # Online datasets only record the positive samples, since the moments need the features of every song
+        return self.song_stats is not None and "feature_means" in self.song_stats
+
+    def get_scaler_indexes(self, indexes: np.ndarray[int]) -> np.ndarray[int]:
+        if self.scaler_songs is None or len(indexes) <= self.scaler_songs:
+            return indexes
+        # Spread over all the songs, so the subsample is not only the songs read first
+        return np.asarray(indexes)[
+            np.linspace(0, len(indexes) - 1, self.scaler_songs).astype(int)
+        ]
 
     def get_num_samples(self, indexes: np.ndarray[int]) -> int:
-        num_all = 0
-        with self.enter_dataset as model_dataset:
-            for index in indexes:
-                song_start_index, song_end_index = model_dataset.song_index_ranges[
-                    index
-                ]
-                num_all += song_end_index - song_start_index
-        return num_all
+        if len(indexes) == 0:
+            return 0
+        return int(
+            np.sum(
+                self.song_index_ranges[indexes, 1] - self.song_index_ranges[indexes, 0]
+            )
+        )
 
     @property
-    def enter_dataset(self) -> dataset.ModelDataset:
-        return self.dataset_type(
-            self.dataset_path, difficulty=self.difficulty
-        ).__enter__()
+    def enter_dataset(self) -> ContextManager[dataset.ModelDataset]:
+        return dataset_pool.DATASET_POOL.open(
+            self.dataset_type,
+            self.dataset_path,
+            difficulty=self.difficulty,
+            **self.dataset_kwargs,
+        )
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import collections
+import multiprocessing
+from collections.abc import Iterator
+
+import numpy as np
+
+from stepcovnet import dataset
+
+# Source dataset opened by each worker process reading songs to convert
+WORKER_SOURCE_DATASET: dataset.ModelDataset | None = None
+
+
+def init_source_worker(dataset_type: type[dataset.ModelDataset], dataset_name: str):
+    global WORKER_SOURCE_DATASET
+    WORKER_SOURCE_DATASET = dataset_type(dataset_name).__enter__()
+
+
+def read_source_song(song_index: int) -> dict:
+    return WORKER_SOURCE_DATASET.read_song(song_index)
+
+
+def read_songs(
+    dataset_type: type[dataset.ModelDataset],
+    dataset_name: str,
+    num_songs: int,
+    cores: int = 1,
+) -> Iterator[dict]:
+    """
+    Read the songs of a dataset in order, decoding them in a pool of worker processes that each open the dataset
+    :param dataset_type: type[ModelDataset] - type of the dataset
+    :param dataset_name: str - dataset name without the file extension
+    :param num_songs: int - number of songs to read from the start of the dataset
+    :param cores: int - number of worker processes; 1 reads the songs in this process
+    :return: Iterator[dict] - data of each song in the format accepted by dump
+    """
+    if cores <= 1:
+        with dataset_type(dataset_name) as source_dataset:
+            for song_index in range(num_songs):
+                yield source_dataset.read_song(song_index)
+        return
+    with multiprocessing.get_context("spawn").Pool(
+        cores,
+        initializer=init_source_worker,
+        initargs=(dataset_type, dataset_name),
+    ) as pool:
+        # Songs are read at most two per worker ahead of the writer so memory stays bounded
+        pending_results = collections.deque()
+        for song_index in range(num_songs):
+            pending_results.append(pool.apply_async(read_source_song, (song_index,)))
+            if len(pending_results) >= 2 * cores:
+                yield pending_results.popleft().get()
+        while pending_results:
+            yield pending_results.popleft().get()
+
+
+def convert_dataset(
+    dataset_type: type[dataset.ModelDataset],
+    dataset_name: str,
+    target_dataset: dataset.ModelDataset,
+    cores: int = 1,
+):
+    """
+    Copy every song of a dataset to an opened dataset of any type and layout, then verify the copy
+    :param dataset_type: type[ModelDataset] - type of the source dataset
+    :param dataset_name: str - source dataset name without the file extension
+    :param target_dataset: ModelDataset - opened dataset to copy to
+    :param cores: int - number of worker processes reading the source dataset
+    """
+    with dataset_type(dataset_name) as source_dataset:
+        num_songs = len(source_dataset.song_index_ranges)
+    file_names = []
+    for song_index, song_data in enumerate(
+        read_songs(dataset_type, dataset_name, num_songs, cores)
+    ):
+        print(
+            "[%d/%d] Converting: %s"
+            % (song_index + 1, num_songs, song_data["file_names"])
+        )
+        target_dataset.dump(**song_data)
+        file_names.append(song_data["file_names"])
+    with dataset_type(dataset_name) as source_dataset:
+        verify_conversion(source_dataset, target_dataset, file_names)
+
+
+def verify_conversion(
+    source_dataset: dataset.ModelDataset,
+    target_dataset: dataset.ModelDataset,
+    file_names: list[str],
+):
+    """
+    Check a converted dataset has the rows, songs and label stats of its source
+    :param source_dataset: ModelDataset - opened source dataset
+    :param target_dataset: ModelDataset - opened converted dataset
+    :param file_names: list[str] - names of the songs dumped to the converted dataset, in order
+    """
+    if len(target_dataset) != len(source_dataset):
+        raise ValueError(
+            "Converted dataset has %d rows instead of %d"
+            % (len(target_dataset), len(source_dataset))
+        )
+    if not np.array_equal(
+        target_dataset.song_index_ranges[:], source_dataset.song_index_ranges[:]
+    ):
+        raise ValueError("Song index ranges of the converted dataset do not match")
+    for song_index, file_name in enumerate(file_names):
+        if target_dataset.get_song_index(file_name) != song_index:
+            raise ValueError("Song %s is not at index %d" % (file_name, song_index))
+    for difficulty in dataset.DIFFICULTIES:
+        source_dataset.set_difficulty(difficulty)
+        target_dataset.set_difficulty(difficulty)
+        for stat in ["num_valid_samples", "pos_samples", "neg_samples"]:
+            if getattr(target_dataset, stat) != getattr(source_dataset, stat):
+                raise ValueError(
+                    "Converted dataset has %s %s of %d instead of %d"
+                    % (
+                        difficulty,
+                        stat,
+                        getattr(target_dataset, stat),
+                        getattr(source_dataset, stat),
+                    )
+                )
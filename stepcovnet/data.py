@@ -2,7 +2,13 @@ from enum import Enum
 
 from transformers import GPT2Tokenizer
 
-from stepcovnet import dataset
+from stepcovnet import (
+    dataset,
+    memmap_dataset,
+    online_dataset,
+    sharded_dataset,
+    union_dataset,
+)
 
 
 class Tokenizers(Enum):
@@ -12,3 +18,7 @@ class Tokenizers(Enum):
 class ModelDatasetTypes(Enum):
     SINGULAR_DATASET = dataset.ModelDataset
     DISTRIBUTED_DATASET = dataset.DistributedModelDataset
+    ONLINE_DATASET = online_dataset.OnlineModelDataset
+    MEMMAP_DATASET = memmap_dataset.MemmapModelDataset
+    SHARDED_DATASET = sharded_dataset.ShardedModelDataset
+    UNION_DATASET = union_dataset.UnionModelDataset
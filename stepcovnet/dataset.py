@@ -1,11 +1,304 @@
 from __future__ import annotations
 
 import os
-from collections import defaultdict
+import threading
+import time
+from collections import OrderedDict, defaultdict
 
 import h5py
 import numpy as np
 
+from stepcovnet import constants, hdf5_recovery, io_stats, utils
+
+COMPRESSION_TYPES = ["lzf", "gzip", "none"]
+
+LABEL_LAYOUTS = ["dense", "sparse", "compact"]
+
+FEATURE_ENCODINGS = ["float16", "uint8"]
+
+# Bit of each difficulty in the available_difficulties song masks
+DIFFICULTIES = ["challenge", "hard", "medium", "easy", "beginner"]
+
+
+def build_arrow_code_tables() -> dict[str, np.ndarray]:
+    """Lookup tables from an arrow code, the index of the arrows in ALL_ARROW_COMBS, to each arrow encoding"""
+    arrows = np.array(
+        [list(arrow) for arrow in constants.ALL_ARROW_COMBS], dtype=np.int8
+    )
+    return {
+        "arrows": arrows,
+        "label_encoded_arrows": np.arange(constants.NUM_ARROW_COMBS, dtype=np.int16),
+        "binary_encoded_arrows": np.eye(constants.NUM_ARROW_TYPES, dtype=np.int8)[
+            arrows
+        ].reshape(constants.NUM_ARROW_COMBS, -1),
+        "string_arrows": constants.ALL_ARROW_COMBS.astype("S4"),
+        "onehot_encoded_arrows": np.eye(constants.NUM_ARROW_COMBS, dtype=np.int8),
+    }
+
+
+ARROW_CODE_TABLES = build_arrow_code_tables()
+
+
+def quantize_features(
+    features: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Quantize the features of a song to uint8 with an affine transform per frequency band and channel
+    :param features: np.ndarray - features of a song; shape: (frames, time bands, frequency bands, channels)
+    :return: tuple - uint8 features, and float32 scales and offsets of shape (frequency bands, channels)
+    """
+    features = np.asarray(features, dtype=np.float32)
+    if len(features) == 0:
+        band_shape = features.shape[2:]
+        return (
+            features.astype(np.uint8),
+            np.ones(band_shape, dtype=np.float32),
+            np.zeros(band_shape, dtype=np.float32),
+        )
+    offsets = features.min(axis=(0, 1))
+    scales = (features.max(axis=(0, 1)) - offsets) / 255
+    # Constant bands are stored as 0
+    scales[scales == 0] = 1
+    quantized = np.rint((features - offsets) / scales).clip(0, 255).astype(np.uint8)
+    return quantized, scales, offsets
+
+
+def dequantize_features(
+    quantized: np.ndarray, scales: np.ndarray, offsets: np.ndarray
+) -> np.ndarray:
+    return quantized * scales + offsets
+
+
+def coalesce_rows(
+    rows: np.ndarray, max_gap: int = 0
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Group row indexes into the contiguous ranges covering them, so they are read with one slice per range
+    :param rows: np.ndarray - row indexes in any order, possibly repeated
+    :param max_gap: int - number of unrequested rows between two ranges up to which they are read as one range
+    :return: tuple - starts and stops of the ranges, and the position of each requested row in the rows of the ranges
+             read one after the other
+    """
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    if len(unique_rows) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), rows
+    breaks = np.flatnonzero(np.diff(unique_rows) > max_gap + 1) + 1
+    starts = unique_rows[np.concatenate([[0], breaks])]
+    stops = unique_rows[np.concatenate([breaks - 1, [len(unique_rows) - 1]])] + 1
+    range_offsets = np.concatenate([[0], np.cumsum(stops - starts)[:-1]])
+    row_ranges = np.searchsorted(starts, unique_rows, side="right") - 1
+    positions = range_offsets[row_ranges] + unique_rows - starts[row_ranges]
+    return starts, stops, positions[inverse.reshape(-1)]
+
+
+class RowView:
+    """Read-only view of a dataset whose rows are rebuilt when read. Only the requested rows are rebuilt, so it can
+    be sliced like the h5py dataset it replaces."""
+
+    def __init__(self, model_dataset: ModelDataset):
+        self.model_dataset = model_dataset
+
+    def __len__(self) -> int:
+        return len(self.model_dataset)
+
+    def __getitem__(self, item) -> np.ndarray:
+        if isinstance(item, (int, np.integer)):
+            if not -len(self) <= item < len(self):
+                raise IndexError("Index %d is out of range" % item)
+            item = item % len(self)
+            return self[item : item + 1][0]
+        if not isinstance(item, slice):
+            raise TypeError("Row views can only be indexed with ints or slices")
+        start, stop, step = item.indices(len(self))
+        if step != 1:
+            raise ValueError("Row views do not support slice steps")
+        return self.read_rows(start, max(start, stop))
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        raise NotImplementedError
+
+
+class ArrowCodeView(RowView):
+    """Label dataset of a difficulty rebuilt from the stored arrow codes"""
+
+    def __init__(self, model_dataset: ModelDataset, dataset_name: str, difficulty: str):
+        super(ArrowCodeView, self).__init__(model_dataset)
+        self.dataset_name = dataset_name
+        self.difficulty = difficulty
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        return self.model_dataset.read_label_rows(
+            self.dataset_name, self.difficulty, start, stop
+        )
+
+
+class QuantizedFeatureView(RowView):
+    """Features dequantized from the stored uint8 features"""
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        return self.model_dataset.read_features(start, stop)
+
+
+class CachedRowView(RowView):
+    """Dataset whose rows are read through the song read cache of the model dataset"""
+
+    def __init__(
+        self,
+        model_dataset: ModelDataset,
+        cache_key: str,
+        source: h5py.Dataset | RowView,
+    ):
+        super(CachedRowView, self).__init__(model_dataset)
+        self.cache_key = cache_key
+        self.source = source
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        return self.model_dataset.read_cached_rows(
+            self.cache_key, self.source, start, stop
+        )
+
+
+class SongReadAhead:
+    """
+    Songs of a model dataset read ahead of the reader on a background thread, in the read order of set_read_order.
+    The songs after the one being read are read whole, up to num_songs of them, so the reader finds them decoded in
+    memory while it builds batches. Only the datasets the reader has read so far are read ahead.
+    """
+
+    def __init__(self, model_dataset: ModelDataset, num_songs: int):
+        self.model_dataset = model_dataset
+        self.num_songs = num_songs
+        self.condition = threading.Condition()
+        self.read_order: list[int] = []
+        self.read_order_positions: dict[int, int] = {}
+        # Position in the read order of the song being read, counted across epochs; -1 until the first song is read
+        self.position = -1
+        self.songs: dict[int, dict[str, np.ndarray]] = {}
+        self.sources: dict[str, h5py.Dataset | RowView] = {}
+        # Songs read by the thread for an older read order or file are dropped
+        self.generation = 0
+        self.thread: threading.Thread | None = None
+        self.stopped = False
+        self.hits = 0
+        self.misses = 0
+
+    def set_read_order(self, song_indexes: list[int] | np.ndarray):
+        with self.condition:
+            self.read_order = [int(song_index) for song_index in song_indexes]
+            self.read_order_positions = {}
+            for position, song_index in enumerate(self.read_order):
+                self.read_order_positions.setdefault(song_index, position)
+            self.position = -1
+            self.songs = {}
+            self.generation += 1
+            self.condition.notify_all()
+        if self.read_order and self.thread is None:
+            self.stopped = False
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def add_source(self, cache_key: str, source: h5py.Dataset | RowView):
+        with self.condition:
+            if cache_key not in self.sources:
+                self.sources[cache_key] = source
+                self.condition.notify_all()
+
+    def reset(self):
+        """Drop the songs read ahead and the datasets to read, which are outdated once the file changes"""
+        with self.condition:
+            self.songs = {}
+            self.sources = {}
+            self.generation += 1
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+        self.thread = None
+        self.songs = {}
+
+    def get_window(self) -> list[int]:
+        # Songs kept: the one being read and the next num_songs ones, wrapping around at the end of an epoch
+        first_position = max(self.position, 0)
+        return [
+            self.read_order[position % len(self.read_order)]
+            for position in range(first_position, self.position + 1 + self.num_songs)
+        ]
+
+    def get_rows(self, cache_key: str, song_index: int) -> np.ndarray | None:
+        """
+        Take the rows of a song read ahead, and move the reader to the song
+        :param cache_key: str - name of the dataset, including its difficulty
+        :param song_index: int - index of the song in song_index_ranges
+        :return: np.ndarray | None - rows of the song, or None if they were not read ahead
+        """
+        with self.condition:
+            position = self.read_order_positions.get(song_index)
+            if position is None:
+                return None
+            if self.position < 0:
+                self.position = position
+            else:
+                self.position += (position - self.position) % len(self.read_order)
+            window = set(self.get_window())
+            for read_song_index in list(self.songs):
+                if read_song_index not in window:
+                    del self.songs[read_song_index]
+            self.condition.notify_all()
+            song_rows = self.songs.get(song_index, {}).get(cache_key)
+            if song_rows is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return song_rows
+
+    def get_next_read(self) -> tuple[int, dict[str, h5py.Dataset | RowView]] | None:
+        if not self.read_order:
+            return None
+        # The song being read is left to the reader
+        window = self.get_window()[1:] if self.position >= 0 else self.get_window()
+        for song_index in window:
+            missing_sources = {
+                cache_key: source
+                for cache_key, source in self.sources.items()
+                if cache_key not in self.songs.get(song_index, {})
+            }
+            if missing_sources:
+                return song_index, missing_sources
+        return None
+
+    def run(self):
+        while True:
+            with self.condition:
+                next_read = self.get_next_read()
+                while not self.stopped and next_read is None:
+                    self.condition.wait()
+                    next_read = self.get_next_read()
+                if self.stopped:
+                    return
+                generation = self.generation
+            song_index, sources = next_read
+            try:
+                song_index_ranges, _ = self.model_dataset.get_song_availability()
+                song_start_index, song_end_index = song_index_ranges[song_index]
+                song_rows = {
+                    cache_key: source[song_start_index:song_end_index]
+                    for cache_key, source in sources.items()
+                }
+            except Exception:
+                # The reader reads the songs itself and gets the error, and the next read order restarts the thread
+                with self.condition:
+                    self.thread = None
+                return
+            with self.condition:
+                if generation == self.generation and song_index in self.get_window():
+                    self.songs.setdefault(song_index, {}).update(song_rows)
+                    self.condition.notify_all()
+
 
 class ModelDataset:
     def __init__(
@@ -14,7 +307,92 @@ class ModelDataset:
         overwrite: bool = False,
         mode: str = "a",
         difficulty: str = "challenge",
+        compression: str = "lzf",
+        compression_level: int | None = None,
+        shuffle: bool = False,
+        chunk_rows: int | None = None,
+        label_layout: str = "dense",
+        feature_encoding: str = "float16",
+        rdcc_nbytes: int | None = None,
+        rdcc_nslots: int | None = None,
+        read_cache_bytes: int = 0,
+        read_ahead_songs: int = 0,
+        flush_songs: int | None = 1,
+        flush_seconds: float | None = None,
+        swmr: bool = False,
+        io_stats: io_stats.IOStats | None = None,
     ):
+        if compression not in COMPRESSION_TYPES:
+            raise ValueError(
+                "%s is not a valid compression! Choose a valid compression: %s"
+                % (compression, COMPRESSION_TYPES)
+            )
+        if compression_level is not None and (
+            compression != "gzip" or not 0 <= compression_level <= 9
+        ):
+            raise ValueError("Compression level must be 0-9 and only used with gzip")
+        if chunk_rows is not None and chunk_rows <= 0:
+            raise ValueError("Number of rows per chunk must be > 0")
+        if label_layout not in LABEL_LAYOUTS:
+            raise ValueError(
+                "%s is not a valid label layout! Choose a valid label layout: %s"
+                % (label_layout, LABEL_LAYOUTS)
+            )
+        if feature_encoding not in FEATURE_ENCODINGS:
+            raise ValueError(
+                "%s is not a valid feature encoding! Choose a valid feature encoding: %s"
+                % (feature_encoding, FEATURE_ENCODINGS)
+            )
+        self.compression = compression
+        self.compression_level = compression_level
+        self.shuffle = shuffle
+        if rdcc_nbytes is not None and rdcc_nbytes <= 0:
+            raise ValueError("Chunk cache size must be > 0")
+        if rdcc_nslots is not None and rdcc_nslots <= 0:
+            raise ValueError("Number of chunk cache slots must be > 0")
+        if read_cache_bytes < 0:
+            raise ValueError("Read cache size must be >= 0")
+        if read_ahead_songs < 0:
+            raise ValueError("Number of songs read ahead must be >= 0")
+        if flush_songs is not None and flush_songs <= 0:
+            raise ValueError("Number of songs between flushes must be > 0")
+        if flush_seconds is not None and flush_seconds <= 0:
+            raise ValueError("Seconds between flushes must be > 0")
+        self.chunk_rows = chunk_rows
+        self.feature_encoding = feature_encoding
+        # h5py chunk cache of each opened dataset, which keeps decompressed chunks
+        self.rdcc_nbytes = rdcc_nbytes
+        self.rdcc_nslots = rdcc_nslots
+        # Decoded rows of whole songs kept across reads, up to read_cache_bytes; 0 disables it
+        self.read_cache_bytes = read_cache_bytes
+        self.read_cache: OrderedDict[tuple[str, int], np.ndarray] = OrderedDict()
+        self.read_cache_used_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Songs after the one being read in the read order are read on a background thread; 0 disables it
+        self.read_ahead_songs = read_ahead_songs
+        self.song_read_ahead: SongReadAhead | None = None
+        # Counters are written to the file every flush_songs songs or flush_seconds seconds; None disables a trigger,
+        # so with both None they are only written on close
+        self.flush_songs = flush_songs
+        self.flush_seconds = flush_seconds
+        self.dataset_attrs: dict[str, dict] = {}
+        self.outdated_attr_names: set[str] = set()
+        self.unflushed_songs = 0
+        self.last_flush_time = time.monotonic()
+        # Writers switch the file to HDF5 single-writer/multiple-reader mode after the first song, and readers open it
+        # so songs written after they opened the file are read after a refresh
+        self.swmr = swmr
+        # Reads and writes of the HDF5 datasets are counted in io_stats; None disables the counters
+        self.io_stats = io_stats
+        self.follows_writer = False
+        # Set for readers of a file with songs dumped after its last flush, which are left to writers to remove
+        self.hides_unflushed_songs = False
+        # Number of songs dumped after the last flush that were removed when the file was opened to append
+        self.removed_songs = 0
+        # Set by close if readers still had a file written in SWMR mode open, so its counters were not written
+        self.counters_deferred = False
+        self.visible_song_index_ranges = np.zeros((0, 2), dtype=np.int64)
         self.dataset_name = dataset_name
         self.dataset_path = self.append_file_type(self.dataset_name)
         self.overwrite = overwrite
@@ -37,6 +415,12 @@ class ModelDataset:
             "onehot_encoded_arrows",
             "file_names",
             "song_index_ranges",
+            "available_difficulties",
+            "feature_scales",
+            "feature_offsets",
+            "song_pos_samples",
+            "feature_means",
+            "feature_variances",
         ]
         self.difficulty_dataset_names = [
             "labels",
@@ -55,18 +439,70 @@ class ModelDataset:
         self.difficulties = {"challenge", "hard", "medium", "easy", "beginner"}
         self.difficulty = difficulty
         self.h5py_file: h5py.File | None = None
+        self.legacy_song_indexes: dict[str, int] | None = None
+        self.sparse_arrow_codes: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self.song_availability: tuple[np.ndarray, np.ndarray] | None = None
+        self.feature_quantization: tuple[np.ndarray, np.ndarray] | None = None
+        self.stores_availability = True
+        self.stores_song_stats = True
+        self.set_label_layout(label_layout)
 
     def __getitem__(self, item) -> list:
-        data = [
-            self.features[item],
-            self.labels[item],
-            self.sample_weights[item],
-            self.arrows[item],
-            self.label_encoded_arrows[item],
-            self.binary_encoded_arrows[item],
-            self.string_arrows[item],
-            self.onehot_encoded_arrows[item],
-        ]
+        return list(self.read(item).values())
+
+    def read(
+        self,
+        rows: int | slice | list[int] | np.ndarray,
+        columns: list[str] | None = None,
+        max_gap: int = 0,
+    ) -> dict[str, np.ndarray]:
+        """
+        Read rows of only the requested datasets. Row indexes are coalesced into contiguous ranges, so each dataset is
+        read with one slice per range whatever the order of the rows.
+        :param rows: int | slice | list[int] | np.ndarray - row, slice or row indexes in any order, possibly repeated
+        :param columns: list[str] - datasets to read: features and difficulty_dataset_names; defaults to all of them
+        :param max_gap: int - number of unrequested rows between two ranges up to which they are read as one range
+        :return: dict - key: dataset name; value: rows of the dataset in the requested order
+        """
+        row_column_names = ["features"] + self.difficulty_dataset_names
+        columns = row_column_names if columns is None else columns
+        invalid_columns = set(columns) - set(row_column_names)
+        if invalid_columns:
+            raise ValueError(
+                "%s cannot be read! Choose columns from: %s"
+                % (sorted(invalid_columns), row_column_names)
+            )
+        num_rows = len(self)
+        if isinstance(rows, (int, np.integer)):
+            if not -num_rows <= rows < num_rows:
+                raise IndexError("Index %d is out of range" % rows)
+            row = int(rows) % num_rows
+            return {
+                column: data[0]
+                for column, data in self.read(slice(row, row + 1), columns).items()
+            }
+        if isinstance(rows, slice):
+            start, stop, step = rows.indices(num_rows)
+            if step == 1:
+                return {
+                    column: getattr(self, column)[start : max(start, stop)]
+                    for column in columns
+                }
+            rows = np.arange(start, stop, step)
+        rows = np.asarray(rows, dtype=np.int64)
+        if ((rows < -num_rows) | (rows >= num_rows)).any():
+            raise IndexError("Row indexes must be in [%d, %d)" % (-num_rows, num_rows))
+        starts, stops, positions = coalesce_rows(rows % max(num_rows, 1), max_gap)
+        data = {}
+        for column in columns:
+            source = getattr(self, column)
+            ranges = [source[start:stop] for start, stop in zip(starts, stops)]
+            if not ranges:
+                data[column] = source[0:0]
+                continue
+            data[column] = (ranges[0] if len(ranges) == 1 else np.concatenate(ranges))[
+                positions
+            ].reshape(rows.shape + ranges[0].shape[1:])
         return data
 
     def __len__(self) -> int:
@@ -84,8 +520,59 @@ class ModelDataset:
         self.close()
 
     def close(self):
+        if self.song_read_ahead is not None:
+            self.song_read_ahead.stop()
+        # The file is already closed if a dump failed
+        if self.h5py_file:
+            self.flush()
+            swmr_mode = self.mode != "r" and self.h5py_file.swmr_mode
+            self.h5py_file.close()
+            if swmr_mode:
+                self.counters_deferred = not self.reopen_to_finish_swmr_writing()
+
+    def flush(self):
+        """
+        Write the counters kept in memory and flush the file. Songs dumped after the last flush are hidden from readers
+        and removed the next time the dataset is opened to append, so a dataset whose writer failed to dump a song or
+        crashed is read as it was at its last flush. See open_marked_h5py_file for the files of crashed writers.
+
+        In SWMR mode the counters are left to finish_swmr_writing, and the song index ranges are flushed after every
+        other dataset, so readers seeing a song in them can read all its rows.
+        """
+        if self.mode != "r" and self.h5py_file.swmr_mode:
+            song_table_names = self.get_song_table_names()
+            for dataset_name, h5py_dataset in self.h5py_file.items():
+                if (
+                    isinstance(h5py_dataset, h5py.Dataset)
+                    and dataset_name not in song_table_names
+                ):
+                    h5py_dataset.flush()
+            for dataset_name in song_table_names:
+                self.h5py_file[dataset_name].flush()
+        elif self.mode != "r":
+            self.write_dataset_attrs()
+            if "file_names" in self.h5py_file:
+                self.h5py_file.attrs["num_songs"] = self.h5py_file["file_names"].shape[
+                    0
+                ]
         self.h5py_file.flush()
-        self.h5py_file.close()
+        self.unflushed_songs = 0
+        self.last_flush_time = time.monotonic()
+
+    def flush_if_due(self):
+        self.unflushed_songs += 1
+        if (
+            self.flush_songs is not None and self.unflushed_songs >= self.flush_songs
+        ) or (
+            self.flush_seconds is not None
+            and time.monotonic() - self.last_flush_time >= self.flush_seconds
+        ):
+            self.flush()
+
+    def open_h5py_file(self, path: str, mode: str, **kwargs) -> h5py.File:
+        if self.io_stats is None:
+            return h5py.File(path, mode, **kwargs)
+        return io_stats.CountingFile(path, mode, io_stats=self.io_stats, **kwargs)
 
     def reset_h5py_file(self):
         if self.h5py_file is not None:
@@ -93,30 +580,375 @@ class ModelDataset:
                 self.h5py_file.close()
             except IOError:
                 pass
-        self.h5py_file: h5py.File = h5py.File(
-            self.dataset_path, self.mode, libver="latest"
+        open_kwargs = dict(
+            libver="latest", rdcc_nbytes=self.rdcc_nbytes, rdcc_nslots=self.rdcc_nslots
+        )
+        try:
+            self.h5py_file: h5py.File = self.open_h5py_file(
+                self.dataset_path,
+                self.mode,
+                swmr=self.swmr and self.mode == "r",
+                **open_kwargs,
+            )
+        except OSError as error:
+            # HDF5 refuses to open files it marked open for writing
+            if "h5clear" not in str(error):
+                raise
+            self.h5py_file = self.open_marked_h5py_file(error, **open_kwargs)
+        self.reset_dataset_attrs()
+        self.legacy_song_indexes = None
+        # Datasets created before availability masks were added keep storing the labels of missing difficulties
+        self.stores_availability = (
+            "available_difficulties" in self.h5py_file or len(self.h5py_file) == 0
+        )
+        # Song stats tables must cover every song, so they are only added to new datasets
+        self.stores_song_stats = (
+            "song_pos_samples" in self.h5py_file or len(self.h5py_file) == 0
+        )
+        if self.mode != "r" and len(self.h5py_file) == 0:
+            self.h5py_file.attrs["label_layout"] = self.label_layout
+            self.h5py_file.attrs["feature_encoding"] = self.feature_encoding
+        # Datasets created before these options were added are dense and float16
+        self.set_label_layout(self.h5py_file.attrs.get("label_layout", "dense"))
+        self.feature_encoding = self.h5py_file.attrs.get("feature_encoding", "float16")
+        # Set while a writer is in SWMR mode, or if it stopped without closing the dataset
+        swmr_writing = "swmr_start_songs" in self.h5py_file.attrs
+        self.follows_writer = swmr_writing and self.mode == "r"
+        self.hides_unflushed_songs = False
+        self.removed_songs = 0
+        if swmr_writing and self.mode != "r":
+            self.finish_swmr_writing()
+        elif not swmr_writing and self.has_unflushed_songs():
+            if self.mode == "r":
+                # The writer may still be dumping, so the songs are only hidden
+                self.hides_unflushed_songs = True
+            else:
+                self.removed_songs = self.remove_unflushed_songs()
+        self.reset_read_cache()
+        if self.follows_writer:
+            self.update_visible_songs()
+        elif self.hides_unflushed_songs:
+            self.visible_song_index_ranges = self.h5py_file["song_index_ranges"][
+                : int(self.h5py_file.attrs["num_songs"])
+            ]
+
+    def open_marked_h5py_file(self, error: OSError, **kwargs) -> h5py.File:
+        """
+        Open a file marked open for writing by a writer in SWMR mode, or by a writer that exited without closing it.
+        Readers follow writers in SWMR mode, whether they are still writing or not. The mark of other writers is
+        cleared once they no longer lock the file, and the songs they dumped after their last flush are removed like
+        the ones of a failed dump.
+        """
+        if self.mode == "r":
+            try:
+                return self.open_h5py_file(self.dataset_path, "r", swmr=True, **kwargs)
+            except OSError:
+                pass
+        if hdf5_recovery.clear_write_mark(self.dataset_path):
+            return self.open_h5py_file(
+                self.dataset_path,
+                self.mode,
+                swmr=self.swmr and self.mode == "r",
+                **kwargs,
+            )
+        raise OSError(
+            "Dataset %s is open for writing by another process, or was not closed by a writer in SWMR mode. The "
+            "mark of a writer that exited can be cleared with h5clear -s %s"
+            % (self.dataset_path, self.dataset_path)
+        ) from error
+
+    def reset_dataset_attrs(self):
+        self.dataset_attrs = {}
+        self.outdated_attr_names = set()
+        self.unflushed_songs = 0
+        self.last_flush_time = time.monotonic()
+
+    def get_flushed_dataset_length(self, dataset_name: str) -> int:
+        # Length of a dataset at the last flush, from the song and sample counts written by it
+        num_songs = int(self.h5py_file.attrs["num_songs"])
+        num_samples = int(self.h5py_file["features"].attrs.get("num_samples", 0))
+        if dataset_name.startswith("onsets_") or dataset_name.startswith(
+            "onset_arrows_"
+        ):
+            onsets_dataset_name = "onsets_" + dataset_name.rsplit("_", 1)[1]
+            return int(
+                np.searchsorted(self.h5py_file[onsets_dataset_name][:], num_samples)
+            )
+        if (
+            dataset_name in self.song_dataset_names
+            or dataset_name in ["feature_scales", "feature_offsets"]
+        ) and dataset_name != "features":
+            return num_songs
+        return num_samples
+
+    def has_unflushed_songs(self) -> bool:
+        # Datasets flushed before the song count was written are trusted as they are
+        if "num_songs" not in self.h5py_file.attrs or "features" not in self.h5py_file:
+            return False
+        return any(
+            isinstance(self.h5py_file[dataset_name], h5py.Dataset)
+            and self.h5py_file[dataset_name].shape[0]
+            > self.get_flushed_dataset_length(dataset_name)
+            for dataset_name in self.h5py_file
+        )
+
+    def remove_unflushed_songs(self) -> int:
+        """
+        Shrink the datasets back to the songs written at the last flush, e.g. after a dump failed or the writer crashed
+        :return: int - number of songs removed
+        """
+        num_songs = int(self.h5py_file.attrs["num_songs"])
+        num_removed_songs = self.h5py_file["file_names"].shape[0] - num_songs
+        dataset_lengths = {
+            dataset_name: self.get_flushed_dataset_length(dataset_name)
+            for dataset_name in self.h5py_file
+            if isinstance(self.h5py_file[dataset_name], h5py.Dataset)
+        }
+        for dataset_name, dataset_length in dataset_lengths.items():
+            if self.h5py_file[dataset_name].shape[0] > dataset_length:
+                self.h5py_file[dataset_name].resize(dataset_length, axis=0)
+        if "song_indexes" in self.h5py_file:
+            song_indexes = self.h5py_file["song_indexes"].attrs
+            for file_name in list(song_indexes):
+                if song_indexes[file_name] >= num_songs:
+                    del song_indexes[file_name]
+        self.h5py_file.flush()
+        return num_removed_songs
+
+    @property
+    def caps_visible_songs(self) -> bool:
+        # Readers of a file being written only see the songs in visible_song_index_ranges
+        return self.follows_writer or self.hides_unflushed_songs
+
+    def get_song_table_names(self) -> list[str]:
+        # Datasets with a row per song, with song_index_ranges last since readers use it to find the visible songs
+        return [
+            dataset_name
+            for dataset_name in self.song_dataset_names
+            + ["feature_scales", "feature_offsets"]
+            if dataset_name not in ["features", "song_index_ranges"]
+            and dataset_name in self.h5py_file
+        ] + ["song_index_ranges"]
+
+    def get_visible_songs(self) -> int:
+        # Songs with a row in every song table
+        return min(
+            self.h5py_file[dataset_name].shape[0]
+            for dataset_name in self.get_song_table_names()
+        )
+
+    def update_visible_songs(self):
+        self.visible_song_index_ranges = self.h5py_file["song_index_ranges"][
+            : self.get_visible_songs()
+        ]
+
+    def refresh(self):
+        """
+        Read the songs a writer in SWMR mode flushed since the dataset was opened or last refreshed. Nothing to do for
+        datasets that are not being written.
+        """
+        if not self.follows_writer:
+            return
+        # The writer flushes song_index_ranges last, so refreshing it first never shows a song with missing rows
+        self.h5py_file["song_index_ranges"].refresh()
+        for h5py_dataset in self.h5py_file.values():
+            if isinstance(h5py_dataset, h5py.Dataset):
+                h5py_dataset.refresh()
+        self.legacy_song_indexes = None
+        # Rows of the songs already read do not change, so only the tables covering every song are read again
+        self.sparse_arrow_codes = {}
+        self.song_availability = None
+        self.feature_quantization = None
+        self.update_visible_songs()
+
+    def start_swmr(self):
+        """
+        Switch the file to SWMR mode, so readers can open it while songs are dumped. Datasets cannot be added in SWMR
+        mode, so the onsets of difficulties no song had yet are created empty, and the counters and song indexes are
+        written by finish_swmr_writing once the dataset is closed.
+        """
+        if not self.stores_song_stats or not self.stores_availability:
+            raise ValueError(
+                "Datasets created before song stats were recorded cannot be written in SWMR mode"
+            )
+        if self.label_layout == "sparse":
+            for difficulty in self.difficulties:
+                for dataset_name, dtype in [
+                    ("onsets", np.int64),
+                    ("onset_arrows", np.uint8),
+                ]:
+                    difficulty_dataset_name = self.append_difficulty(
+                        dataset_name, difficulty
+                    )
+                    if difficulty_dataset_name not in self.h5py_file:
+                        self.create_dataset(
+                            np.zeros(0, dtype=dtype), difficulty_dataset_name
+                        )
+        self.flush()
+        # Songs from here on are only indexed and counted by finish_swmr_writing
+        self.h5py_file.attrs["swmr_start_songs"] = self.h5py_file["file_names"].shape[0]
+        self.h5py_file.swmr_mode = True
+
+    def reopen_to_finish_swmr_writing(self) -> bool:
+        # Attributes cannot be added in SWMR mode, so the file is reopened without it to write the counters. Readers
+        # still following the file lock it, and derive the counters from the song tables until the dataset is opened
+        # to append again.
+        try:
+            self.h5py_file = self.open_h5py_file(
+                self.dataset_path, "a", libver="latest"
+            )
+        except OSError:
+            return False
+        try:
+            self.finish_swmr_writing()
+        finally:
+            self.h5py_file.close()
+        return True
+
+    def finish_swmr_writing(self):
+        """
+        Write the counters and song indexes of the songs dumped in SWMR mode, derived from the song tables. Rows of a
+        song a writer did not finish, e.g. when it crashed, are removed.
+        """
+        num_songs = self.get_visible_songs()
+        song_index_ranges = self.h5py_file["song_index_ranges"][:num_songs]
+        self.h5py_file.attrs["num_songs"] = num_songs
+        self.h5py_file["features"].attrs["num_samples"] = (
+            int(song_index_ranges[-1, 1]) if num_songs else 0
+        )
+        if self.has_unflushed_songs():
+            self.remove_unflushed_songs()
+        for difficulty in self.difficulties:
+            dataset_name = self.get_label_stats_dataset_name(difficulty)
+            if dataset_name in self.h5py_file:
+                self.h5py_file[dataset_name].attrs.update(
+                    self.get_song_label_stats(difficulty, song_index_ranges)
+                )
+        file_names = self.h5py_file["file_names"]
+        for song_index in range(
+            int(self.h5py_file.attrs["swmr_start_songs"]), num_songs
+        ):
+            self.add_song_index(self.h5py_file, file_names[song_index], song_index)
+        del self.h5py_file.attrs["swmr_start_songs"]
+        self.reset_dataset_attrs()
+
+    def get_song_label_stats(
+        self, difficulty: str, song_index_ranges: np.ndarray
+    ) -> dict:
+        # Label stats of the first songs, from their difficulty masks and positive samples
+        num_songs = len(song_index_ranges)
+        difficulty_index = DIFFICULTIES.index(difficulty)
+        has_difficulty = (
+            self.h5py_file["available_difficulties"][:num_songs]
+            & (1 << difficulty_index)
+        ) > 0
+        num_valid_samples = int(
+            np.sum((song_index_ranges[:, 1] - song_index_ranges[:, 0])[has_difficulty])
+        )
+        pos_samples = int(
+            np.sum(self.h5py_file["song_pos_samples"][:num_songs, difficulty_index])
+        )
+        return {
+            "num_valid_samples": num_valid_samples,
+            "pos_samples": pos_samples,
+            "neg_samples": num_valid_samples - pos_samples,
+        }
+
+    def reset_read_cache(self):
+        self.sparse_arrow_codes = {}
+        self.song_availability = None
+        self.feature_quantization = None
+        self.read_cache.clear()
+        self.read_cache_used_bytes = 0
+        if self.song_read_ahead is not None:
+            self.song_read_ahead.reset()
+
+    def set_label_layout(self, label_layout: str):
+        """
+        Select how labels are stored. The dense layout stores every label encoding of every frame. The sparse layout
+        only stores the onset frames and their arrow codes. The compact layout stores the arrow code of every frame,
+        where code 0 is no onset.
+        :param label_layout: str - one of LABEL_LAYOUTS
+        """
+        self.label_layout = label_layout
+        if label_layout == "dense":
+            self.stored_difficulty_dataset_names = self.difficulty_dataset_names
+        elif label_layout == "sparse":
+            self.stored_difficulty_dataset_names = ["onsets", "onset_arrows"]
+        else:
+            self.stored_difficulty_dataset_names = ["arrow_codes"]
+        self.song_dataset_names = [
+            "features",
+            "file_names",
+            "song_index_ranges",
+            "available_difficulties",
+            "song_pos_samples",
+            "feature_means",
+            "feature_variances",
+        ]
+
+    def get_stored_dataset_names(self) -> list[str]:
+        feature_dataset_names = (
+            ["feature_scales", "feature_offsets"]
+            if self.feature_encoding == "uint8"
+            else []
+        )
+        return (
+            self.song_dataset_names
+            + feature_dataset_names
+            + [
+                self.append_difficulty(dataset_name, difficulty)
+                for dataset_name in self.stored_difficulty_dataset_names
+                for difficulty in self.difficulties
+            ]
         )
 
-    def create_dataset(self, data: np.ndarray, dataset_name: str):
+    def get_label_stats_dataset_name(self, difficulty: str) -> str:
+        # Dataset holding the num_valid_samples, pos_samples and neg_samples attributes of a difficulty
+        return self.append_difficulty(
+            self.stored_difficulty_dataset_names[0], difficulty
+        )
+
+    def create_dataset(
+        self, data: np.ndarray, dataset_name: str, fillvalue: int | bytes | None = None
+    ):
         if dataset_name in self.scaler_dataset_names:
+            # Variable-length strings cannot be appended in SWMR mode, so the names are kept fixed-length
             self.h5py_file.create_dataset(
-                dataset_name, data=data, compression="lzf", dtype="S1024"
+                dataset_name,
+                data=data if self.swmr else data.astype(object),
+                chunks=True,
+                compression="lzf",
+                dtype=None if self.swmr else h5py.string_dtype(),
+                maxshape=(None,),
             )
         else:
             if len(data.shape) > 1:
                 data_shape = (None,) + data.shape[1:]
             else:
                 data_shape = (None,)
+            # Training reads contiguous rows of a song, so chunks always hold whole rows
             self.h5py_file.create_dataset(
                 dataset_name,
                 data=data,
-                chunks=True,
-                compression="lzf",
+                chunks=(
+                    True
+                    if self.chunk_rows is None
+                    else (self.chunk_rows,) + data.shape[1:]
+                ),
+                compression=None if self.compression == "none" else self.compression,
+                compression_opts=self.compression_level,
+                shuffle=self.shuffle,
                 maxshape=data_shape,
+                fillvalue=fillvalue,
             )
 
     def extend_dataset(self, data: np.ndarray, dataset_name: str):
-        if dataset_name in self.scaler_dataset_names:
+        if (
+            dataset_name in self.scaler_dataset_names
+            and self.h5py_file[dataset_name].maxshape[0] is not None
+        ):
+            # Names of datasets created before they were appendable are converted once
             saved_dataset = self.h5py_file[dataset_name][:]
             del self.h5py_file[dataset_name]
             self.create_dataset(
@@ -135,14 +967,35 @@ class ModelDataset:
             dataset_name=dataset_name, difficulty=difficulty
         )
         if not self.h5py_file.get(difficulty_dataset_name):
-            self.create_dataset(value, difficulty_dataset_name)
+            self.create_dataset(
+                value, difficulty_dataset_name, self.get_null_value(value.dtype)
+            )
         else:
             self.extend_dataset(value, difficulty_dataset_name)
-        saved_attributes = self.save_attributes(self.h5py_file, difficulty_dataset_name)
-        self.set_dataset_attrs(
-            self.h5py_file, difficulty_dataset_name, saved_attributes
+        self.update_dataset_attrs(difficulty_dataset_name, value)
+
+    def dump_missing_difficulty_dataset(
+        self, dataset_name: str, difficulty: str, null_values: np.ndarray
+    ):
+        difficulty_dataset_name = self.append_difficulty(
+            dataset_name=dataset_name, difficulty=difficulty
         )
-        self.update_dataset_attrs(self.h5py_file, difficulty_dataset_name, value)
+        if not self.h5py_file.get(difficulty_dataset_name):
+            self.create_dataset(
+                null_values[:0],
+                difficulty_dataset_name,
+                self.get_null_value(null_values.dtype),
+            )
+        # Rows are only allocated, so they read back as the fill value without being stored
+        self.h5py_file[difficulty_dataset_name].resize(
+            self.h5py_file[difficulty_dataset_name].shape[0] + len(null_values), axis=0
+        )
+        self.update_dataset_attrs(difficulty_dataset_name)
+
+    @staticmethod
+    def get_null_value(dtype: np.dtype) -> int | bytes:
+        # Value of the labels of difficulties missing from a song
+        return b"0000" if dtype == np.dtype("S4") else -1
 
     def dump(
         self,
@@ -156,7 +1009,41 @@ class ModelDataset:
         string_arrows: np.ndarray,
         onehot_encoded_arrows: np.ndarray,
     ):
+        if self.label_layout != "dense":
+            # Checked before writing so a rejected song does not leave a partial song behind
+            for difficulty_sample_weights in sample_weights.values():
+                if (np.asarray(difficulty_sample_weights) != 1).any():
+                    raise ValueError(
+                        "Only sample weights of 1 can be stored in the %s label layout"
+                        % self.label_layout
+                    )
+        if self.label_layout == "compact":
+            for difficulty, difficulty_labels in labels.items():
+                if not np.array_equal(
+                    np.asarray(difficulty_labels) > 0,
+                    np.asarray(label_encoded_arrows[difficulty]).reshape(-1) > 0,
+                ):
+                    raise ValueError(
+                        "Onsets without arrows cannot be stored in the compact label layout"
+                    )
         try:
+            song_start_index = self.get_song_start_index()
+            num_frames = len(features)
+            feature_scales, feature_offsets = None, None
+            song_stats = {}
+            if self.feature_encoding == "uint8":
+                features, feature_scales, feature_offsets = quantize_features(features)
+                if self.stores_song_stats:
+                    # Moments of the features as they are read back
+                    song_stats = self.get_song_stats_data(
+                        dequantize_features(
+                            features, feature_scales, feature_offsets
+                        ).astype(np.float16),
+                        labels,
+                    )
+                feature_scales, feature_offsets = [feature_scales], [feature_offsets]
+            elif self.stores_song_stats:
+                song_stats = self.get_song_stats_data(features, labels)
             all_data = self.get_dataset_name_to_data_map(
                 features=features,
                 labels=labels,
@@ -167,7 +1054,15 @@ class ModelDataset:
                 string_arrows=string_arrows,
                 onehot_encoded_arrows=onehot_encoded_arrows,
                 file_names=file_names,
-                song_index_ranges=[[len(self), len(self) + len(features)]],
+                song_index_ranges=[[song_start_index, song_start_index + num_frames]],
+                feature_scales=feature_scales,
+                feature_offsets=feature_offsets,
+                available_difficulties=(
+                    [self.get_difficulty_mask(labels)]
+                    if self.stores_availability
+                    else None
+                ),
+                **song_stats,
             )
             for dataset_name, data in all_data.items():
                 if data is None:
@@ -175,6 +1070,8 @@ class ModelDataset:
                 if dataset_name in self.difficulty_dataset_names and isinstance(
                     data, (dict, defaultdict)
                 ):
+                    if self.label_layout != "dense":
+                        continue
                     diff_copy = self.difficulties.copy()
                     for difficulty, value in data.items():
                         if difficulty in diff_copy:
@@ -182,32 +1079,468 @@ class ModelDataset:
                         self.dump_difficulty_dataset(dataset_name, difficulty, value)
                     data_shape = data[next(iter(data))].shape
                     dtype = data[next(iter(data))].dtype
-                    if dtype == np.dtype("S4"):
-                        null_values = np.chararray(data_shape, itemsize=4)
-                        null_values[:] = "0000"
-                    else:
-                        null_values = np.full(data_shape, fill_value=-1)
+                    null_values = np.full(
+                        data_shape, fill_value=self.get_null_value(dtype), dtype=dtype
+                    )
                     for remaining_diff in diff_copy:
-                        self.dump_difficulty_dataset(
-                            dataset_name, remaining_diff, null_values
-                        )
+                        if self.stores_availability:
+                            self.dump_missing_difficulty_dataset(
+                                dataset_name, remaining_diff, null_values
+                            )
+                        else:
+                            self.dump_difficulty_dataset(
+                                dataset_name, remaining_diff, null_values
+                            )
                     continue
                 else:
                     if not self.h5py_file.get(dataset_name):
                         self.create_dataset(data, dataset_name)
                     else:
                         self.extend_dataset(data, dataset_name)
-                    saved_attributes = self.save_attributes(
-                        self.h5py_file, dataset_name
-                    )
-                    self.set_dataset_attrs(
-                        self.h5py_file, dataset_name, saved_attributes
-                    )
-                    self.update_dataset_attrs(self.h5py_file, dataset_name, data)
-            self.h5py_file.flush()
+                    self.update_dataset_attrs(dataset_name, data)
+            if self.label_layout == "sparse":
+                self.dump_onsets(labels, label_encoded_arrows, song_start_index)
+            elif self.label_layout == "compact":
+                self.dump_arrow_codes(labels, label_encoded_arrows, len(features))
+            if not self.h5py_file.swmr_mode:
+                self.add_song_index(
+                    self.h5py_file,
+                    all_data["file_names"][0],
+                    self.h5py_file["file_names"].shape[0] - 1,
+                )
+            self.reset_read_cache()
+            self.flush_if_due()
         except Exception as ex:
-            self.close()
+            # Counters of the failed song are dropped, so it is removed the next time the dataset is opened
+            self.reset_dataset_attrs()
+            self.h5py_file.close()
             raise ex
+        if self.swmr and not self.h5py_file.swmr_mode:
+            self.start_swmr()
+
+    def dump_onsets(
+        self,
+        labels: dict[str, np.ndarray],
+        label_encoded_arrows: dict[str, np.ndarray],
+        song_start_index: int,
+    ):
+        for difficulty, difficulty_labels in labels.items():
+            onsets = np.flatnonzero(np.asarray(difficulty_labels) > 0)
+            arrow_codes = np.asarray(label_encoded_arrows[difficulty]).astype(np.uint8)
+            for dataset_name, data in [
+                ("onsets", (onsets + song_start_index).astype(np.int64)),
+                ("onset_arrows", arrow_codes[onsets]),
+            ]:
+                difficulty_dataset_name = self.append_difficulty(
+                    dataset_name, difficulty
+                )
+                if not self.h5py_file.get(difficulty_dataset_name):
+                    self.create_dataset(data, difficulty_dataset_name)
+                else:
+                    self.extend_dataset(data, difficulty_dataset_name)
+            self.update_label_stats(
+                self.get_label_stats_dataset_name(difficulty), difficulty_labels
+            )
+
+    def dump_arrow_codes(
+        self,
+        labels: dict[str, np.ndarray],
+        label_encoded_arrows: dict[str, np.ndarray],
+        num_frames: int,
+    ):
+        for difficulty in self.difficulties:
+            dataset_name = self.append_difficulty("arrow_codes", difficulty)
+            if dataset_name not in self.h5py_file:
+                self.create_dataset(np.zeros(0, dtype=np.uint8), dataset_name)
+            arrow_codes_dataset = self.h5py_file[dataset_name]
+            song_start_index = arrow_codes_dataset.shape[0]
+            # Rows of missing difficulties are never written, so they take no space in the file
+            arrow_codes_dataset.resize(song_start_index + num_frames, axis=0)
+            if difficulty in labels:
+                arrow_codes_dataset[song_start_index:] = np.asarray(
+                    label_encoded_arrows[difficulty]
+                ).reshape(-1)
+                self.update_label_stats(dataset_name, labels[difficulty])
+
+    def update_label_stats(self, dataset_name: str, labels: np.ndarray):
+        attrs = self.get_dataset_attrs(dataset_name)
+        for dataset_attr in self.dataset_attr["labels"]:
+            attrs.setdefault(dataset_attr, 0)
+        attrs["num_valid_samples"] += len(labels)
+        attrs["pos_samples"] += labels.sum()
+        attrs["neg_samples"] += len(labels) - labels.sum()
+        self.outdated_attr_names.add(dataset_name)
+
+    @staticmethod
+    def get_song_stats_data(features: np.ndarray, labels: dict) -> dict:
+        feature_means, feature_variances = utils.get_feature_moments(features)
+        return {
+            "song_pos_samples": [
+                [
+                    int(np.sum(labels[difficulty])) if difficulty in labels else 0
+                    for difficulty in DIFFICULTIES
+                ]
+            ],
+            "feature_means": [feature_means],
+            "feature_variances": [feature_variances],
+        }
+
+    def get_song_stats(self) -> dict[str, np.ndarray] | None:
+        """
+        Read the stats recorded for each song when it was dumped, so the training split, bias and scalers do not
+        need to read the labels and features
+        :return: dict - song_pos_samples with the positive samples of each song and difficulty in DIFFICULTIES order,
+                 feature_means and feature_variances with the moments of the features of each song; None for datasets
+                 created before song stats were recorded
+        """
+        if self.h5py_file is None or "song_pos_samples" not in self.h5py_file:
+            return None
+        return {
+            dataset_name: self.h5py_file[dataset_name][: len(self.song_index_ranges)]
+            for dataset_name in [
+                "song_pos_samples",
+                "feature_means",
+                "feature_variances",
+            ]
+        }
+
+    @staticmethod
+    def get_difficulty_mask(difficulties) -> np.uint8:
+        mask = 0
+        for difficulty in difficulties:
+            mask |= 1 << DIFFICULTIES.index(difficulty)
+        return np.uint8(mask)
+
+    def get_available_difficulties(self, song_index: int) -> list[str]:
+        if "available_difficulties" in self.h5py_file:
+            mask = int(self.get_song_availability()[1][song_index])
+            return [
+                difficulty
+                for i, difficulty in enumerate(DIFFICULTIES)
+                if mask & (1 << i)
+            ]
+        # Dense datasets fill the labels of missing difficulties with -1
+        song_start_index, song_end_index = self.song_index_ranges[song_index]
+        return [
+            difficulty
+            for difficulty in DIFFICULTIES
+            if not (
+                self.h5py_file[self.append_difficulty("labels", difficulty)][
+                    song_start_index:song_end_index
+                ]
+                < 0
+            ).any()
+        ]
+
+    def read_label_rows(
+        self, dataset_name: str, difficulty: str, start: int, stop: int
+    ) -> np.ndarray:
+        """
+        Rebuild rows of a label dataset from the stored arrow codes
+        :param dataset_name: str - one of difficulty_dataset_names
+        :param difficulty: str - difficulty to read
+        :param start: int - first row
+        :param stop: int - row after the last row
+        :return: np.ndarray - same rows and dtype as the dense layout
+        """
+        if self.label_layout == "compact":
+            arrow_codes_name = self.append_difficulty("arrow_codes", difficulty)
+            arrow_codes = (
+                self.h5py_file[arrow_codes_name][start:stop]
+                if arrow_codes_name in self.h5py_file
+                else np.zeros(stop - start, dtype=np.uint8)
+            )
+            row_onsets = np.flatnonzero(arrow_codes)
+        else:
+            onsets, onset_arrows = self.get_sparse_arrow_codes(difficulty)
+            first_onset, last_onset = np.searchsorted(onsets, [start, stop])
+            row_onsets = onsets[first_onset:last_onset] - start
+            arrow_codes = np.zeros(stop - start, dtype=np.uint8)
+            arrow_codes[row_onsets] = onset_arrows[first_onset:last_onset]
+        if dataset_name == "labels":
+            data = np.zeros(stop - start, dtype=np.int8)
+            data[row_onsets] = 1
+        elif dataset_name == "sample_weights":
+            data = np.ones(stop - start, dtype=np.float16)
+        else:
+            data = ARROW_CODE_TABLES[dataset_name][arrow_codes]
+        missing_rows = self.get_missing_rows(difficulty, start, stop)
+        if missing_rows is not None:
+            data[missing_rows] = self.get_null_value(data.dtype)
+        return data
+
+    def get_sparse_arrow_codes(self, difficulty: str) -> tuple[np.ndarray, np.ndarray]:
+        # Onsets are a small fraction of the frames, so they are read once and kept in memory
+        if difficulty not in self.sparse_arrow_codes:
+            onsets_name = self.append_difficulty("onsets", difficulty)
+            if onsets_name in self.h5py_file:
+                self.sparse_arrow_codes[difficulty] = (
+                    self.h5py_file[onsets_name][:],
+                    self.h5py_file[self.append_difficulty("onset_arrows", difficulty)][
+                        :
+                    ],
+                )
+            else:
+                self.sparse_arrow_codes[difficulty] = (
+                    np.zeros(0, dtype=np.int64),
+                    np.zeros(0, dtype=np.uint8),
+                )
+        return self.sparse_arrow_codes[difficulty]
+
+    def get_missing_rows(
+        self, difficulty: str, start: int, stop: int
+    ) -> np.ndarray | None:
+        """Mask of the rows in [start, stop) of songs without the difficulty, or None if all songs have it"""
+        song_index_ranges, available_difficulties = self.get_song_availability()
+        if available_difficulties is None:
+            return None
+        first_song = np.searchsorted(song_index_ranges[:, 1], start, side="right")
+        last_song = np.searchsorted(song_index_ranges[:, 0], stop)
+        bit = 1 << DIFFICULTIES.index(difficulty)
+        missing_rows = None
+        for song_index in range(first_song, last_song):
+            if available_difficulties[song_index] & bit:
+                continue
+            if missing_rows is None:
+                missing_rows = np.zeros(stop - start, dtype=bool)
+            song_start_index, song_end_index = song_index_ranges[song_index]
+            missing_rows[
+                max(song_start_index, start) - start : min(song_end_index, stop) - start
+            ] = True
+        return missing_rows
+
+    def get_song_availability(self) -> tuple[np.ndarray, np.ndarray | None]:
+        # Song ranges and difficulty masks are small, so they are read once and kept in memory
+        if self.song_availability is None:
+            song_index_ranges = self.song_index_ranges[:]
+            self.song_availability = (
+                song_index_ranges,
+                (
+                    self.h5py_file["available_difficulties"][: len(song_index_ranges)]
+                    if "available_difficulties" in self.h5py_file
+                    else None
+                ),
+            )
+        return self.song_availability
+
+    def read_features(
+        self, start: int, stop: int, scalers: list | None = None
+    ) -> np.ndarray:
+        """
+        Read rows of features, optionally scaled
+        :param start: int - first row
+        :param stop: int - row after the last row
+        :param scalers: list - scalers of each channel to apply to the features
+        :return: np.ndarray - float16 features, or float64 features when scaled
+        """
+        if self.feature_encoding == "float16":
+            features = self.features[start:stop]
+            if scalers is None:
+                return features
+            return utils.apply_scalers(features.astype(np.float64), scalers)
+        features = self.cache_rows("features", self.h5py_file["features"])[start:stop]
+        if scalers is not None:
+            if not isinstance(scalers, list):
+                scalers = [scalers]
+            # StandardScaler of each channel works on the flattened time and frequency bands
+            band_shape = features.shape[1:3]
+            scaler_means = np.stack(
+                [
+                    (
+                        np.zeros(band_shape)
+                        if scaler.mean_ is None
+                        else scaler.mean_.reshape(band_shape)
+                    )
+                    for scaler in scalers
+                ],
+                axis=-1,
+            )
+            scaler_scales = np.stack(
+                [
+                    (
+                        np.ones(band_shape)
+                        if scaler.scale_ is None
+                        else scaler.scale_.reshape(band_shape)
+                    )
+                    for scaler in scalers
+                ],
+                axis=-1,
+            )
+        dequantized = np.empty(
+            features.shape, dtype=np.float16 if scalers is None else np.float64
+        )
+        song_index_ranges, _ = self.get_song_availability()
+        feature_scales, feature_offsets = self.get_feature_quantization()
+        first_song = np.searchsorted(song_index_ranges[:, 1], start, side="right")
+        last_song = np.searchsorted(song_index_ranges[:, 0], stop)
+        for song_index in range(first_song, last_song):
+            song_start_index, song_end_index = song_index_ranges[song_index]
+            rows = slice(
+                max(song_start_index, start) - start, min(song_end_index, stop) - start
+            )
+            scales = feature_scales[song_index]
+            offsets = feature_offsets[song_index]
+            if scalers is not None:
+                # Dequantizing and scaling are both affine, so they are applied as a single transform
+                scales = scales / scaler_scales
+                offsets = (offsets - scaler_means) / scaler_scales
+            dequantized[rows] = dequantize_features(features[rows], scales, offsets)
+        return dequantized
+
+    def get_feature_quantization(self) -> tuple[np.ndarray, np.ndarray]:
+        if self.feature_quantization is None:
+            self.feature_quantization = (
+                self.h5py_file["feature_scales"][:],
+                self.h5py_file["feature_offsets"][:],
+            )
+        return self.feature_quantization
+
+    def cache_rows(
+        self, cache_key: str, source: h5py.Dataset | RowView
+    ) -> h5py.Dataset | RowView:
+        if self.song_read_ahead is not None:
+            self.song_read_ahead.add_source(cache_key, source)
+        elif self.read_cache_bytes == 0:
+            return source
+        return CachedRowView(self, cache_key, source)
+
+    def read_cached_rows(
+        self, cache_key: str, source: h5py.Dataset | RowView, start: int, stop: int
+    ) -> np.ndarray:
+        """
+        Read rows of a dataset through the song read cache and the songs read ahead. The rows of each song in
+        [start, stop) are read whole on a miss of the read cache, so the overlapping reads of the training generator
+        decompress each chunk once.
+        :param cache_key: str - name of the dataset, including its difficulty
+        :param source: h5py.Dataset | RowView - dataset to read on a miss
+        :param start: int - first row
+        :param stop: int - row after the last row
+        :return: np.ndarray - rows [start, stop)
+        """
+        song_index_ranges, _ = self.get_song_availability()
+        first_song = np.searchsorted(song_index_ranges[:, 1], start, side="right")
+        last_song = np.searchsorted(song_index_ranges[:, 0], stop)
+        rows = []
+        for song_index in range(first_song, last_song):
+            song_start_index, song_end_index = song_index_ranges[song_index]
+            # Reading a song moves the read-ahead to it, even when the song is in the read cache
+            read_ahead_rows = (
+                None
+                if self.song_read_ahead is None
+                else self.song_read_ahead.get_rows(cache_key, song_index)
+            )
+            song_rows = self.read_cache.get((cache_key, song_index))
+            if song_rows is not None:
+                self.cache_hits += 1
+                self.read_cache.move_to_end((cache_key, song_index))
+            elif self.read_cache_bytes > 0:
+                self.cache_misses += 1
+                song_rows = read_ahead_rows
+                if song_rows is None:
+                    song_rows = source[song_start_index:song_end_index]
+                self.add_to_read_cache((cache_key, song_index), song_rows)
+            elif read_ahead_rows is not None:
+                song_rows = read_ahead_rows
+            else:
+                # Without a read cache only the requested rows are read
+                rows.append(
+                    source[max(song_start_index, start) : min(song_end_index, stop)]
+                )
+                continue
+            rows.append(
+                song_rows[
+                    max(song_start_index, start)
+                    - song_start_index : min(song_end_index, stop)
+                    - song_start_index
+                ]
+            )
+        if not rows:
+            return source[start:stop]
+        # Concatenating copies the rows, so callers cannot modify the cached songs
+        return np.concatenate(rows, axis=0)
+
+    def add_to_read_cache(self, key: tuple[str, int], song_rows: np.ndarray):
+        if song_rows.nbytes > self.read_cache_bytes:
+            return
+        while self.read_cache_used_bytes + song_rows.nbytes > self.read_cache_bytes:
+            _, evicted_rows = self.read_cache.popitem(last=False)
+            self.read_cache_used_bytes -= evicted_rows.nbytes
+        self.read_cache[key] = song_rows
+        self.read_cache_used_bytes += song_rows.nbytes
+
+    def read_difficulty_rows(
+        self, dataset_name: str, difficulty: str, start: int, stop: int
+    ) -> np.ndarray:
+        if self.label_layout == "dense":
+            return self.h5py_file[self.append_difficulty(dataset_name, difficulty)][
+                start:stop
+            ]
+        return self.read_label_rows(dataset_name, difficulty, start, stop)
+
+    def read_song(self, song_index: int) -> dict:
+        """
+        Read all the data of a song in the format accepted by dump. Difficulties missing from the song are left out.
+        :param song_index: int - index of the song in song_index_ranges
+        :return: dict - key: dump argument name; value: song data
+        """
+        song_start_index, song_end_index = self.song_index_ranges[song_index]
+        available_difficulties = self.get_available_difficulties(song_index)
+        song_data = {
+            "features": self.read_features(song_start_index, song_end_index),
+            "file_names": self.h5py_file["file_names"][song_index].decode("ascii"),
+        }
+        for dataset_name in self.difficulty_dataset_names:
+            song_data[dataset_name] = {
+                difficulty: self.read_difficulty_rows(
+                    dataset_name, difficulty, song_start_index, song_end_index
+                )
+                for difficulty in available_difficulties
+            }
+        return song_data
+
+    def get_song_index(self, file_name: str) -> int:
+        """
+        Find a song by name without reading all the song names
+        :param file_name: str - name of the song as dumped
+        :return: int - index of the song in song_index_ranges; the last one dumped if the name was dumped twice
+        """
+        # Songs dumped in SWMR mode are only indexed by finish_swmr_writing, and unflushed songs may replace indexes
+        if "song_indexes" in self.h5py_file and not self.caps_visible_songs:
+            try:
+                return int(self.h5py_file["song_indexes"].attrs[file_name])
+            except KeyError:
+                raise KeyError("Song %s not found in dataset" % file_name)
+        # Datasets created before song indexes were saved
+        if self.legacy_song_indexes is None:
+            file_names = self.h5py_file["file_names"]
+            if self.caps_visible_songs:
+                file_names = file_names[: len(self.visible_song_index_ranges)]
+            self.legacy_song_indexes = {
+                song_name.decode("ascii"): song_index
+                for song_index, song_name in enumerate(file_names)
+            }
+        if file_name not in self.legacy_song_indexes:
+            raise KeyError("Song %s not found in dataset" % file_name)
+        return self.legacy_song_indexes[file_name]
+
+    @staticmethod
+    def add_song_index(h5py_file: h5py.File, file_name: bytes | str, song_index: int):
+        if isinstance(file_name, bytes):
+            file_name = file_name.decode("ascii")
+        h5py_file.require_group("song_indexes").attrs[file_name] = song_index
+
+    def get_song_start_index(self) -> int:
+        return len(self)
+
+    def set_read_order(self, song_indexes: list[int] | np.ndarray):
+        """Hint of the order songs are about to be read in. Datasets computing songs on demand use it to compute the
+        next songs ahead of time, and datasets stored on disk read the next read_ahead_songs songs ahead of time.
+        """
+        if self.read_ahead_songs == 0:
+            return
+        if self.song_read_ahead is None:
+            self.song_read_ahead = SongReadAhead(self, self.read_ahead_songs)
+        self.song_read_ahead.set_read_order(song_indexes)
 
     def set_difficulty(self, difficulty: str):
         if difficulty not in self.difficulties:
@@ -231,42 +1564,36 @@ class ModelDataset:
                 dataset_name_to_data_map[dataset_name] = None
         return dataset_name_to_data_map
 
-    def set_dataset_attrs(
-        self,
-        h5py_file: h5py.File,
-        dataset_name: str,
-        saved_attributes: dict | None = None,
-    ):
-        if "labels" in dataset_name:
-            for dataset_attr in self.dataset_attr["labels"]:
-                if saved_attributes is not None and dataset_attr in saved_attributes:
-                    h5py_file[dataset_name].attrs[dataset_attr] = saved_attributes[
-                        dataset_attr
-                    ]
-                else:
-                    h5py_file[dataset_name].attrs[dataset_attr] = 0
-        if "features" in dataset_name:
-            for dataset_attr in self.dataset_attr["features"]:
-                if saved_attributes is not None and dataset_attr in saved_attributes:
-                    h5py_file[dataset_name].attrs[dataset_attr] = saved_attributes[
-                        dataset_attr
-                    ]
-                else:
-                    h5py_file[dataset_name].attrs[dataset_attr] = 0
+    def get_dataset_attrs(self, dataset_name: str) -> dict:
+        """Counters of a dataset, read from the file once and kept in memory until flush writes them"""
+        if dataset_name not in self.dataset_attrs:
+            attrs = self.save_attributes(self.h5py_file, dataset_name)
+            for attr_type in ["labels", "features"]:
+                if attr_type in dataset_name:
+                    for dataset_attr in self.dataset_attr[attr_type]:
+                        attrs.setdefault(dataset_attr, 0)
+            self.dataset_attrs[dataset_name] = attrs
+        return self.dataset_attrs[dataset_name]
 
-    @staticmethod
     def update_dataset_attrs(
-        h5py_file: h5py.File, dataset_name: str, attr_value: np.ndarray
+        self, dataset_name: str, attr_value: np.ndarray | None = None
     ):
-        if "labels" in dataset_name:
-            if not any(attr_value < 0):
-                h5py_file[dataset_name].attrs["num_valid_samples"] += len(attr_value)
-                h5py_file[dataset_name].attrs["pos_samples"] += attr_value.sum()
-                h5py_file[dataset_name].attrs["neg_samples"] += (
-                    len(attr_value) - attr_value.sum()
-                )
-        elif "features" in dataset_name:
-            h5py_file[dataset_name].attrs["num_samples"] += len(attr_value)
+        attrs = self.get_dataset_attrs(dataset_name)
+        if attr_value is not None:
+            if "labels" in dataset_name:
+                if not (attr_value < 0).any():
+                    attrs["num_valid_samples"] += len(attr_value)
+                    attrs["pos_samples"] += attr_value.sum()
+                    attrs["neg_samples"] += len(attr_value) - attr_value.sum()
+            elif "features" in dataset_name:
+                attrs["num_samples"] += len(attr_value)
+        self.outdated_attr_names.add(dataset_name)
+
+    def write_dataset_attrs(self):
+        for dataset_name in self.outdated_attr_names:
+            for attr_name, attr_value in self.dataset_attrs[dataset_name].items():
+                self.h5py_file[dataset_name].attrs[attr_name] = attr_value
+        self.outdated_attr_names = set()
 
     @staticmethod
     def save_attributes(h5py_file: h5py.File, dataset_name: str) -> dict:
@@ -284,161 +1611,254 @@ class ModelDataset:
     def append_difficulty(dataset_name: str, difficulty: str) -> str:
         return "%s_%s" % (dataset_name, difficulty)
 
+    @property
+    def layout(self) -> dict:
+        return {
+            "compression": self.compression,
+            "compression_level": self.compression_level,
+            "shuffle": self.shuffle,
+            "chunk_rows": self.chunk_rows,
+            "label_layout": self.label_layout,
+            "feature_encoding": self.feature_encoding,
+        }
+
     @property
     def num_samples(self) -> int:
-        return self.h5py_file["features"].attrs["num_samples"]
+        if "features" not in self.h5py_file:
+            raise KeyError("Dataset %s has no features" % self.dataset_path)
+        if self.caps_visible_songs:
+            song_index_ranges = self.visible_song_index_ranges
+            return int(song_index_ranges[-1, 1]) if len(song_index_ranges) else 0
+        return self.get_dataset_attrs("features")["num_samples"]
 
     @property
     def num_valid_samples(self) -> int:
-        return self.h5py_file[self.append_difficulty("labels", self.difficulty)].attrs[
-            "num_valid_samples"
-        ]
+        return self.get_label_stats(self.difficulty).get("num_valid_samples", 0)
 
     @property
     def pos_samples(self) -> int:
-        return self.h5py_file[self.append_difficulty("labels", self.difficulty)].attrs[
-            "pos_samples"
-        ]
+        return self.get_label_stats(self.difficulty).get("pos_samples", 0)
 
     @property
     def neg_samples(self) -> int:
-        return self.h5py_file[self.append_difficulty("labels", self.difficulty)].attrs[
-            "neg_samples"
-        ]
+        return self.get_label_stats(self.difficulty).get("neg_samples", 0)
 
     @property
     def labels(self) -> np.ndarray:
-        return self.h5py_file[self.append_difficulty("labels", self.difficulty)]
+        return self.get_label_dataset("labels")
 
     @property
     def sample_weights(self) -> np.ndarray:
-        return self.h5py_file[self.append_difficulty("sample_weights", self.difficulty)]
+        return self.get_label_dataset("sample_weights")
 
     @property
     def arrows(self) -> np.ndarray:
-        return self.h5py_file[self.append_difficulty("arrows", self.difficulty)]
+        return self.get_label_dataset("arrows")
 
     @property
     def label_encoded_arrows(self) -> np.ndarray:
-        return self.h5py_file[
-            self.append_difficulty("label_encoded_arrows", self.difficulty)
-        ]
+        return self.get_label_dataset("label_encoded_arrows")
 
     @property
     def binary_encoded_arrows(self) -> np.ndarray:
-        return self.h5py_file[
-            self.append_difficulty("binary_encoded_arrows", self.difficulty)
-        ]
+        return self.get_label_dataset("binary_encoded_arrows")
 
     @property
     def string_arrows(self) -> np.ndarray:
-        return self.h5py_file[self.append_difficulty("string_arrows", self.difficulty)]
+        return self.get_label_dataset("string_arrows")
 
     @property
     def onehot_encoded_arrows(self) -> np.ndarray:
-        return self.h5py_file[
-            self.append_difficulty("onehot_encoded_arrows", self.difficulty)
-        ]
+        return self.get_label_dataset("onehot_encoded_arrows")
+
+    def get_label_dataset(self, dataset_name: str) -> h5py.Dataset | RowView:
+        difficulty_dataset_name = self.append_difficulty(dataset_name, self.difficulty)
+        if self.label_layout == "dense":
+            return self.cache_rows(
+                difficulty_dataset_name, self.h5py_file[difficulty_dataset_name]
+            )
+        return self.cache_rows(
+            difficulty_dataset_name,
+            ArrowCodeView(self, dataset_name, self.difficulty),
+        )
+
+    def get_label_stats(self, difficulty: str) -> dict:
+        dataset_name = self.get_label_stats_dataset_name(difficulty)
+        if dataset_name not in self.h5py_file:
+            return {}
+        if self.follows_writer:
+            return self.get_song_label_stats(difficulty, self.visible_song_index_ranges)
+        return self.get_dataset_attrs(dataset_name)
 
     @property
     def file_names(self) -> list[str]:
-        return [file_name.decode("ascii") for file_name in self.h5py_file["file_names"]]
+        file_names = self.h5py_file["file_names"]
+        if self.caps_visible_songs:
+            file_names = file_names[: len(self.visible_song_index_ranges)]
+        return [file_name.decode("ascii") for file_name in file_names]
 
     @property
-    def song_index_ranges(self) -> tuple[int, int]:
+    def song_index_ranges(self) -> tuple[int, int] | np.ndarray:
+        if self.caps_visible_songs:
+            return self.visible_song_index_ranges
         return self.h5py_file["song_index_ranges"]
 
     @property
-    def features(self) -> np.ndarray:
-        return self.h5py_file["features"]
+    def features(self) -> np.ndarray | QuantizedFeatureView:
+        if self.feature_encoding == "uint8":
+            return QuantizedFeatureView(self)
+        return self.cache_rows("features", self.h5py_file["features"])
 
 
 class DistributedModelDataset(ModelDataset):
+    """
+    Dataset storing each song in its own file, read through virtual datasets mapping the song files in order.
+
+    Virtual datasets cannot be extended, so dump records the shape, dtype and stats of the datasets of each song file,
+    and the virtual datasets are rebuilt from the records the next time the dataset is read or closed. Song files are
+    never reopened to build them.
+    """
+
     def __init__(self, *args, **kwargs):
+        self.opened_h5py_file: h5py.File | None = None
+        # Set after songs are dumped until the virtual datasets are rebuilt
+        self.virtual_dataset_outdated = False
         super(DistributedModelDataset, self).__init__(*args, **kwargs)
+        if self.swmr:
+            raise ValueError("SWMR mode is only supported by single file datasets")
+        # Loaded from the virtual datasets by the first dump
+        self.virtual_sources: dict[str, list[h5py.VirtualSource]] | None = None
+        self.virtual_dtypes: dict[str, np.dtype] = {}
+        self.virtual_attrs: dict[str, dict] = {}
+        self.virtual_file_names: list[bytes] = []
+        self.outdated_dataset_names: set[str] = set()
+        self.outdated_song_indexes: dict[bytes, int] = {}
+
+    @property
+    def h5py_file(self) -> h5py.File | None:
+        if self.virtual_dataset_outdated:
+            self.build_dataset()
+        return self.opened_h5py_file
+
+    @h5py_file.setter
+    def h5py_file(self, h5py_file: h5py.File | None):
+        self.opened_h5py_file = h5py_file
 
     def dump(self, *args, **kwargs):
+        self.load_virtual_sources()
         sub_dataset_name = self.format_sub_dataset_name(kwargs["file_names"])
         sub_dataset_path = self.append_file_type(sub_dataset_name)
+        self.song_start_index = len(self)
         if os.path.isfile(sub_dataset_path):
             os.remove(sub_dataset_path)
-        self.h5py_file = h5py.File(sub_dataset_path, self.mode, libver="latest")
-        super(DistributedModelDataset, self).dump(*args, **kwargs)
+        virtual_h5py_file = self.opened_h5py_file
+        # The song file is the opened file while dumping, so it must not trigger a rebuild
+        self.virtual_dataset_outdated = False
+        self.h5py_file = self.open_h5py_file(
+            sub_dataset_path, self.mode, libver="latest"
+        )
+        # Counters of the song file start from 0, and the ones of the virtual datasets are kept in the records
+        self.reset_dataset_attrs()
         try:
-            sub_dataset_names = self.file_names + [sub_dataset_name]
-        except KeyError:
-            sub_dataset_names = [sub_dataset_name]
-        self.build_dataset(sub_dataset_names, self.h5py_file)
-        self.reset_h5py_file()
+            super(DistributedModelDataset, self).dump(*args, **kwargs)
+            # Song files are closed after each song, so their counters are always written
+            self.flush()
+            self.record_virtual_sources(self.opened_h5py_file)
+            self.opened_h5py_file.close()
+        finally:
+            self.h5py_file = virtual_h5py_file
+            self.reset_dataset_attrs()
+            self.virtual_dataset_outdated = bool(self.outdated_dataset_names)
+
+    def get_song_start_index(self) -> int:
+        return self.song_start_index
+
+    def has_unflushed_songs(self) -> bool:
+        # Songs are only added to the virtual datasets once their song file is written and closed
+        return False
 
     def format_sub_dataset_name(self, file_name: str) -> str:
         return "%s_%s" % (self.dataset_name, file_name)
 
-    def build_dataset(self, sub_dataset_names: list[str], h5py_file: h5py.File):
-        if not sub_dataset_names:
-            raise ValueError("Cannot build dataset until data is dumped")
-        virtual_dataset = h5py.File(self.dataset_path, self.mode, libver="latest")
-        for dataset_name in self.dataset_names:
-            if dataset_name in self.difficulty_dataset_names:
-                for difficulty in self.difficulties:
-                    difficulty_dataset_name = self.append_difficulty(
-                        dataset_name, difficulty
-                    )
-                    self.build_virtual_dataset(
-                        data=h5py_file[difficulty_dataset_name][:],
-                        dataset_name=difficulty_dataset_name,
-                        sub_dataset_names=sub_dataset_names,
-                        virtual_dataset=virtual_dataset,
-                    )
-            else:
-                self.build_virtual_dataset(
-                    data=h5py_file[dataset_name][:],
-                    dataset_name=dataset_name,
-                    sub_dataset_names=sub_dataset_names,
-                    virtual_dataset=virtual_dataset,
+    def load_virtual_sources(self):
+        """Record the sources, dtype and stats of the virtual datasets already built, without opening the song files"""
+        if self.virtual_sources is not None:
+            return
+        self.virtual_sources = {}
+        for dataset_name in self.get_stored_dataset_names():
+            if dataset_name not in self.h5py_file:
+                continue
+            virtual_dataset = self.h5py_file[dataset_name]
+            self.virtual_sources[dataset_name] = [
+                h5py.VirtualSource(
+                    vds_map.file_name,
+                    vds_map.dset_name,
+                    shape=self.get_selection_shape(vds_map.vspace),
+                    dtype=virtual_dataset.dtype,
                 )
+                for vds_map in virtual_dataset.virtual_sources()
+            ]
+            self.virtual_dtypes[dataset_name] = virtual_dataset.dtype
+            self.virtual_attrs[dataset_name] = self.save_attributes(
+                self.h5py_file, dataset_name
+            )
+        self.virtual_file_names = (
+            list(self.h5py_file["file_names"]) if "file_names" in self.h5py_file else []
+        )
 
-    def build_virtual_dataset(
-        self,
-        data: np.ndarray,
-        dataset_name: str,
-        sub_dataset_names: list[str],
-        virtual_dataset: h5py.File,
-    ):
-        (
-            virtual_sources,
-            virtual_source_shape,
-            virtual_dtype,
-        ) = self.build_virtual_sources(dataset_name, sub_dataset_names)
+    def record_virtual_sources(self, h5py_file: h5py.File):
+        for dataset_name in self.get_stored_dataset_names():
+            # Songs without a difficulty have no onsets of it in the sparse layout
+            if dataset_name not in h5py_file:
+                continue
+            sub_dataset = h5py_file[dataset_name]
+            self.virtual_sources.setdefault(dataset_name, []).append(
+                h5py.VirtualSource(sub_dataset)
+            )
+            self.virtual_dtypes.setdefault(dataset_name, sub_dataset.dtype)
+            # The stats of the new song were already computed when it was dumped to its sub dataset
+            virtual_attrs = self.virtual_attrs.setdefault(dataset_name, {})
+            for attr_name, attr_value in sub_dataset.attrs.items():
+                virtual_attrs[attr_name] = virtual_attrs.get(attr_name, 0) + attr_value
+            self.outdated_dataset_names.add(dataset_name)
+        file_name = h5py_file["file_names"][0]
+        self.virtual_file_names.append(file_name)
+        self.outdated_song_indexes[file_name] = len(self.virtual_file_names) - 1
+
+    def build_dataset(self):
+        """Rebuild the virtual datasets of the songs dumped since the last build from the recorded sources"""
+        self.virtual_dataset_outdated = False
+        self.opened_h5py_file.close()
+        with self.open_h5py_file(
+            self.dataset_path, self.mode, libver="latest"
+        ) as virtual_dataset:
+            for file_name, song_index in self.outdated_song_indexes.items():
+                self.add_song_index(virtual_dataset, file_name, song_index)
+            for dataset_name in self.outdated_dataset_names:
+                self.build_virtual_dataset(virtual_dataset, dataset_name)
+        self.outdated_dataset_names = set()
+        self.outdated_song_indexes = {}
+        self.reset_h5py_file()
+
+    def build_virtual_dataset(self, virtual_dataset: h5py.File, dataset_name: str):
+        sources = self.virtual_sources[dataset_name]
         virtual_layout = self.build_virtual_layout(
-            virtual_sources, virtual_source_shape, virtual_dtype
+            sources,
+            (sum(source.shape[0] for source in sources),) + sources[0].shape[1:],
+            self.virtual_dtypes[dataset_name],
         )
-        saved_attributes = self.save_attributes(virtual_dataset, dataset_name)
         if dataset_name in virtual_dataset:
             del virtual_dataset[dataset_name]
         virtual_dataset.create_virtual_dataset(dataset_name, virtual_layout)
-        self.set_dataset_attrs(virtual_dataset, dataset_name, saved_attributes)
-        self.update_dataset_attrs(virtual_dataset, dataset_name, data)
-
-    def build_virtual_sources(
-        self, dataset_name: str, sub_dataset_names: list[str]
-    ) -> tuple[list[h5py.VirtualSource], tuple[int, ...], np.dtype | None]:
-        sources = []
-        dtype: np.dtype | None = None
-        source_shape = None
-        for sub_dataset_name in sub_dataset_names:
-            with h5py.File(self.append_file_type(sub_dataset_name), "r") as sub_dataset:
-                vsource = h5py.VirtualSource(sub_dataset[dataset_name])
-                if source_shape is None:
-                    source_shape = vsource.shape
-                else:
-                    source_shape = (source_shape[0] + vsource.shape[0],)
-                    if len(vsource.shape) > 1:
-                        source_shape = source_shape + vsource.shape[1:]
-                dtype = sub_dataset[dataset_name].dtype if dtype is None else dtype
-                sources.append(vsource)
+        for attr_name, attr_value in self.virtual_attrs[dataset_name].items():
+            virtual_dataset[dataset_name].attrs[attr_name] = attr_value
 
-        return sources, source_shape, dtype
+    @staticmethod
+    def get_selection_shape(space: h5py.h5s.SpaceID) -> tuple[int, ...]:
+        start, end = space.get_select_bounds()
+        return tuple(
+            int(dim_end) - int(dim_start) + 1 for dim_start, dim_end in zip(start, end)
+        )
 
     @staticmethod
     def build_virtual_layout(
@@ -455,9 +1875,21 @@ class DistributedModelDataset(ModelDataset):
 
         return virtual_layout
 
+    @property
+    def num_samples(self) -> int:
+        # Read from the records, so checking the size after each dump does not rebuild the virtual datasets
+        if self.virtual_sources is None:
+            return super(DistributedModelDataset, self).num_samples
+        return int(self.virtual_attrs.get("features", {}).get("num_samples", 0))
+
     @property
     def file_names(self) -> list[str]:
+        file_names = (
+            self.h5py_file["file_names"]
+            if self.virtual_sources is None
+            else self.virtual_file_names
+        )
         return [
             self.format_sub_dataset_name(file_name.decode("ascii"))
-            for file_name in self.h5py_file["file_names"]
+            for file_name in file_names
         ]
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import atexit
+import collections
+import contextlib
+import os
+import threading
+from collections.abc import Iterator
+
+from stepcovnet import dataset
+
+
+class DatasetPool:
+    """
+    Read-only datasets kept open between uses, so the statistics of the training config and each call of the training
+    generators reuse the opened dataset instead of opening it again.
+
+    A dataset is held by one holder at a time, since readers keep their own difficulty, read order and read cache. A
+    holder asking for a dataset whose handles are all held gets a new handle. Released handles stay open, up to
+    max_idle of them. Past that, the least recently released handles of datasets no one holds are closed first, since
+    the datasets still held, e.g. by the generator of the other split, are about to be asked for again. close() closes
+    every handle, the ones still held as soon as they are released.
+    """
+
+    def __init__(self, max_idle: int = 4):
+        if max_idle < 0:
+            raise ValueError("Number of idle datasets must be >= 0")
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle: collections.OrderedDict[int, tuple[tuple, dataset.ModelDataset]] = (
+            collections.OrderedDict()
+        )
+        # Number of holders of each dataset key, which keeps its idle handles open, and the key of each held handle
+        self.references: collections.Counter[tuple] = collections.Counter()
+        self.held: dict[int, tuple] = {}
+        # Held handles to close when released, because the pool was closed while they were held
+        self.retired: set[int] = set()
+        self.num_opened = 0
+        self.num_reused = 0
+        self.num_closed = 0
+        self.pid = os.getpid()
+
+    @staticmethod
+    def get_key(
+        dataset_type: type[dataset.ModelDataset], dataset_name: str, **kwargs
+    ) -> tuple:
+        return (
+            dataset_type,
+            os.path.abspath(dataset_name),
+            tuple(sorted(kwargs.items())),
+        )
+
+    @contextlib.contextmanager
+    def open(
+        self,
+        dataset_type: type[dataset.ModelDataset],
+        dataset_name: str,
+        difficulty: str = "challenge",
+        **kwargs,
+    ) -> Iterator[dataset.ModelDataset]:
+        """
+        Hold an opened dataset for the duration of a with block
+        :param dataset_type: type[ModelDataset] - type of the dataset
+        :param dataset_name: str - dataset name without the file extension
+        :param difficulty: str - difficulty to read
+        :param kwargs: other options to open the dataset with, e.g. the read cache size
+        :return: Iterator[ModelDataset] - opened dataset, released at the end of the with block
+        """
+        model_dataset = self.acquire(
+            dataset_type, dataset_name, difficulty=difficulty, **kwargs
+        )
+        try:
+            yield model_dataset
+        finally:
+            self.release(model_dataset)
+
+    def acquire(
+        self,
+        dataset_type: type[dataset.ModelDataset],
+        dataset_name: str,
+        difficulty: str = "challenge",
+        **kwargs,
+    ) -> dataset.ModelDataset:
+        key = self.get_key(dataset_type, dataset_name, **kwargs)
+        with self.lock:
+            self.forget_parent_handles()
+            handle_id = next(
+                (
+                    handle_id
+                    for handle_id, (idle_key, _) in self.idle.items()
+                    if idle_key == key
+                ),
+                None,
+            )
+            model_dataset = None
+            if handle_id is not None:
+                _, model_dataset = self.idle.pop(handle_id)
+                self.num_reused += 1
+            self.references[key] += 1
+        if model_dataset is None:
+            try:
+                model_dataset = dataset_type(dataset_name, **kwargs).__enter__()
+            except Exception:
+                with self.lock:
+                    self.release_reference(key)
+                raise
+            with self.lock:
+                self.num_opened += 1
+        else:
+            # Songs a writer in SWMR mode added while the dataset was idle
+            model_dataset.refresh()
+        model_dataset.set_difficulty(difficulty)
+        with self.lock:
+            self.held[id(model_dataset)] = key
+        return model_dataset
+
+    def release(self, model_dataset: dataset.ModelDataset):
+        # The next holder reads in its own order, so songs are no longer read ahead in the order of this one
+        model_dataset.set_read_order([])
+        with self.lock:
+            handle_id = id(model_dataset)
+            key = self.held.pop(handle_id)
+            self.release_reference(key)
+            closed_datasets = []
+            if handle_id in self.retired:
+                self.retired.discard(handle_id)
+                closed_datasets.append(model_dataset)
+            else:
+                self.idle[handle_id] = (key, model_dataset)
+                while len(self.idle) > self.max_idle:
+                    closed_id = next(
+                        (
+                            idle_id
+                            for idle_id, (idle_key, _) in self.idle.items()
+                            if idle_key not in self.references
+                        ),
+                        next(iter(self.idle)),
+                    )
+                    _, closed_dataset = self.idle.pop(closed_id)
+                    closed_datasets.append(closed_dataset)
+            self.num_closed += len(closed_datasets)
+        for closed_dataset in closed_datasets:
+            closed_dataset.close()
+
+    def release_reference(self, key: tuple):
+        self.references[key] -= 1
+        if self.references[key] <= 0:
+            del self.references[key]
+
+    def close(self):
+        """Close the idle datasets now and the held ones when they are released"""
+        with self.lock:
+            self.forget_parent_handles()
+            closed_datasets = [model_dataset for _, model_dataset in self.idle.values()]
+            self.idle.clear()
+            self.retired.update(self.held)
+            self.num_closed += len(closed_datasets)
+        for model_dataset in closed_datasets:
+            model_dataset.close()
+
+    def forget_parent_handles(self):
+        # Handles inherited from the parent process by a forked child belong to the parent, so they are not reused
+        if os.getpid() != self.pid:
+            self.idle.clear()
+            self.references.clear()
+            self.held.clear()
+            self.retired.clear()
+            self.pid = os.getpid()
+
+    def get_counters(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "opened": self.num_opened,
+                "reused": self.num_reused,
+                "closed": self.num_closed,
+                "idle": len(self.idle),
+                "held": len(self.held),
+            }
+
+
+# Datasets of this process read by the training config and generators
+DATASET_POOL = DatasetPool()
+atexit.register(DATASET_POOL.close)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import collections
+import multiprocessing
+from collections.abc import Iterable, Iterator
+from multiprocessing.pool import Pool
+
+import numpy as np
+import psutil
+
+from stepcovnet import dataset
+
+
+class SongFileDataset(dataset.ModelDataset):
+    """
+    Song file of a DistributedModelDataset opened on its own. Rows are stored from 0 in the file, but the song range and
+    sparse onsets hold the rows of the distributed dataset, so they are shifted to the start of the file.
+    """
+
+    def reset_h5py_file(self):
+        # Song files do not save the layout, which is the one of the distributed dataset
+        label_layout, feature_encoding = self.label_layout, self.feature_encoding
+        super(SongFileDataset, self).reset_h5py_file()
+        self.set_label_layout(label_layout)
+        self.feature_encoding = feature_encoding
+
+    def has_unflushed_songs(self) -> bool:
+        # Song files only become part of the distributed dataset once they are written and closed
+        return False
+
+    def get_sparse_arrow_codes(self, difficulty: str) -> tuple[np.ndarray, np.ndarray]:
+        if difficulty not in self.sparse_arrow_codes:
+            onsets, onset_arrows = super(SongFileDataset, self).get_sparse_arrow_codes(
+                difficulty
+            )
+            self.sparse_arrow_codes[difficulty] = (
+                onsets - self.h5py_file["song_index_ranges"][0, 0],
+                onset_arrows,
+            )
+        return self.sparse_arrow_codes[difficulty]
+
+    @property
+    def song_index_ranges(self) -> np.ndarray:
+        song_index_ranges = self.h5py_file["song_index_ranges"][:]
+        return song_index_ranges - song_index_ranges[0, 0]
+
+
+class SongFileCache:
+    """Song files kept open between reads, closing the least recently used one past max_open_files"""
+
+    def __init__(self, max_open_files: int):
+        if max_open_files <= 0:
+            raise ValueError("Number of open song files must be > 0")
+        self.max_open_files = max_open_files
+        self.song_files: collections.OrderedDict[str, SongFileDataset] = (
+            collections.OrderedDict()
+        )
+
+    def read_song(
+        self, song_file_name: str, label_layout: str, feature_encoding: str
+    ) -> dict:
+        song_file = self.song_files.pop(song_file_name, None)
+        if song_file is None:
+            song_file = SongFileDataset(
+                song_file_name,
+                label_layout=label_layout,
+                feature_encoding=feature_encoding,
+            ).__enter__()
+        self.song_files[song_file_name] = song_file
+        while len(self.song_files) > self.max_open_files:
+            _, closed_song_file = self.song_files.popitem(last=False)
+            closed_song_file.close()
+        return song_file.read_song(0)
+
+    def close(self):
+        while self.song_files:
+            _, song_file = self.song_files.popitem()
+            song_file.close()
+
+
+# Song files opened by each worker process of a DistributedSongReader
+WORKER_SONG_FILE_CACHE: SongFileCache | None = None
+
+
+def init_song_file_worker(max_open_files: int):
+    global WORKER_SONG_FILE_CACHE
+    WORKER_SONG_FILE_CACHE = SongFileCache(max_open_files)
+
+
+def read_song_file(song_file: tuple[str, str, str]) -> dict:
+    return WORKER_SONG_FILE_CACHE.read_song(*song_file)
+
+
+class DistributedSongReader:
+    """
+    Reads songs of a DistributedModelDataset straight from their song files instead of through the virtual datasets.
+
+    Songs are located with the song names and ranges of the distributed dataset, and read by a pool of worker
+    processes, each keeping up to max_open_files song files open. Several songs are fetched at a time without
+    contending for the h5py lock, which pays off on network storage where the latency of each file dominates.
+    """
+
+    def __init__(
+        self,
+        dataset_name: str,
+        cores: int | None = None,
+        max_open_files: int = 16,
+        pool_kwargs: dict | None = None,
+    ):
+        if max_open_files <= 0:
+            raise ValueError("Number of open song files must be > 0")
+        self.dataset_name = dataset_name
+        self.cores = cores if cores is not None else psutil.cpu_count(logical=False)
+        self.max_open_files = max_open_files
+        self.pool_kwargs = pool_kwargs or {}
+        self.song_file_names: list[str] = []
+        self.song_index_ranges = np.zeros((0, 2), dtype=np.int64)
+        self.label_layout = "dense"
+        self.feature_encoding = "float16"
+        self.pool: Pool | None = None
+        self.song_file_cache: SongFileCache | None = None
+
+    def __enter__(self) -> DistributedSongReader:
+        with dataset.DistributedModelDataset(self.dataset_name) as model_dataset:
+            self.song_file_names = model_dataset.file_names
+            self.song_index_ranges = model_dataset.song_index_ranges[:]
+            self.label_layout = model_dataset.label_layout
+            self.feature_encoding = model_dataset.feature_encoding
+        if self.cores > 1:
+            # Spawned workers do not inherit the threads of the parent, e.g. the ones of a running Tensorflow job
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                self.cores,
+                initializer=init_song_file_worker,
+                initargs=(self.max_open_files,),
+                **self.pool_kwargs,
+            )
+        else:
+            self.song_file_cache = SongFileCache(self.max_open_files)
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        if self.song_file_cache is not None:
+            self.song_file_cache.close()
+            self.song_file_cache = None
+
+    def __len__(self) -> int:
+        return len(self.song_file_names)
+
+    def get_song_indexes(self, start: int, stop: int) -> range:
+        """
+        Find the songs holding rows of the distributed dataset
+        :param start: int - first row
+        :param stop: int - row after the last row
+        :return: range - indexes of the songs with rows in [start, stop)
+        """
+        return range(
+            int(np.searchsorted(self.song_index_ranges[:, 1], start, side="right")),
+            int(np.searchsorted(self.song_index_ranges[:, 0], stop)),
+        )
+
+    def imap_songs(self, song_indexes: Iterable[int]) -> Iterator[dict]:
+        """
+        Read songs in the format of ModelDataset.read_song, fetching up to cores songs at a time
+        :param song_indexes: Iterable[int] - indexes of the songs in the distributed dataset
+        :return: Iterator[dict] - data of each song, in the order of song_indexes
+        """
+        song_files = [
+            (self.song_file_names[song_index], self.label_layout, self.feature_encoding)
+            for song_index in song_indexes
+        ]
+        if self.pool is None:
+            return (
+                self.song_file_cache.read_song(*song_file) for song_file in song_files
+            )
+        return self.pool.imap(read_song_file, song_files)
+
+    def read_songs(self, song_indexes: Iterable[int]) -> list[dict]:
+        return list(self.imap_songs(song_indexes))
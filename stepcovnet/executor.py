@@ -11,6 +11,7 @@ from stepcovnet import (
     config,
     encoder,
     inputs,
+    io_stats,
     training,
     model,
     constants,
@@ -19,6 +20,28 @@ from stepcovnet import (
 )
 
 
+class IOStatsCallback(callbacks.Callback):
+    """Writes the dataset I/O counters as TensorBoard scalars at the end of each epoch"""
+
+    def __init__(self, log_dir: str, dataset_io_stats: io_stats.IOStats):
+        super(IOStatsCallback, self).__init__()
+        self.dataset_io_stats = dataset_io_stats
+        self.summary_writer = tf.summary.create_file_writer(log_dir)
+
+    def on_epoch_end(self, epoch, logs=None):
+        report = self.dataset_io_stats.report()
+        with self.summary_writer.as_default():
+            tf.summary.scalar("files_opened", report["files_opened"], step=epoch)
+            for dataset_name, counters in list(report["datasets"].items()) + [
+                ("total", report["totals"])
+            ]:
+                for counter, value in counters.items():
+                    tf.summary.scalar(
+                        "%s/%s" % (dataset_name, counter), value, step=epoch
+                    )
+        self.summary_writer.flush()
+
+
 class AbstractExecutor(ABC):
     def __init__(self, stepcovnet_model: model.StepCOVNetModel, *args, **kwargs):
         self.stepcovnet_model = stepcovnet_model
@@ -108,7 +131,13 @@ class TrainingExecutor(AbstractExecutor):
         self.stepcovnet_model.model.summary()
         # Saving scalers and metadata in the case of errors during training
         self.save(input_data.config, pretrained=True, retrained=False)
-        history = self.train(input_data, self.get_training_callbacks(hyperparameters))
+        history = self.train(
+            input_data,
+            self.get_training_callbacks(
+                hyperparameters,
+                dataset_io_stats=input_data.config.dataset_kwargs.get("io_stats"),
+            ),
+        )
         self.save(input_data.config, training_history=history, retrained=False)
 
         if hyperparameters.retrain:
@@ -125,7 +154,9 @@ class TrainingExecutor(AbstractExecutor):
         return self.stepcovnet_model
 
     def get_training_callbacks(
-        self, hyperparameters: training.TrainingHyperparameters
+        self,
+        hyperparameters: training.TrainingHyperparameters,
+        dataset_io_stats: io_stats.IOStats | None = None,
     ) -> list[callbacks.Callback]:
         model_out_path = self.stepcovnet_model.model_root_path
         model_name = self.stepcovnet_model.model_name
@@ -155,6 +186,13 @@ class TrainingExecutor(AbstractExecutor):
                     profile_batch=100000000,
                 )
             )
+            if dataset_io_stats is not None:
+                callback_list.append(
+                    IOStatsCallback(
+                        log_dir=os.path.join(log_path, "split_dataset", "io_stats"),
+                        dataset_io_stats=dataset_io_stats,
+                    )
+                )
         return callback_list
 
     @staticmethod
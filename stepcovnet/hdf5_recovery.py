@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import fcntl
+import os
+
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+# File consistency flags of version 3 superblocks
+OPEN_FOR_WRITE_FLAG = 0x01
+SWMR_WRITE_FLAG = 0x04
+
+
+def rotate(value: int, bits: int) -> int:
+    return ((value << bits) | (value >> (32 - bits))) & 0xFFFFFFFF
+
+
+def get_metadata_checksum(data: bytes) -> int:
+    """
+    Checksum HDF5 stores with its metadata, Bob Jenkins' lookup3 hash with an initial value of 0
+    :param data: bytes - checksummed metadata
+    :return: int - 32 bit checksum
+    """
+    mask = 0xFFFFFFFF
+    a = b = c = (0xDEADBEEF + len(data)) & mask
+    position = 0
+    remaining = len(data)
+    while remaining > 12:
+        a = (a + int.from_bytes(data[position : position + 4], "little")) & mask
+        b = (b + int.from_bytes(data[position + 4 : position + 8], "little")) & mask
+        c = (c + int.from_bytes(data[position + 8 : position + 12], "little")) & mask
+        a = ((a - c) & mask) ^ rotate(c, 4)
+        c = (c + b) & mask
+        b = ((b - a) & mask) ^ rotate(a, 6)
+        a = (a + c) & mask
+        c = ((c - b) & mask) ^ rotate(b, 8)
+        b = (b + a) & mask
+        a = ((a - c) & mask) ^ rotate(c, 16)
+        c = (c + b) & mask
+        b = ((b - a) & mask) ^ rotate(a, 19)
+        a = (a + c) & mask
+        c = ((c - b) & mask) ^ rotate(b, 4)
+        b = (b + a) & mask
+        position += 12
+        remaining -= 12
+    if remaining == 0:
+        return c
+    tail = data[position:] + bytes(12 - remaining)
+    a = (a + int.from_bytes(tail[0:4], "little")) & mask
+    b = (b + int.from_bytes(tail[4:8], "little")) & mask
+    c = (c + int.from_bytes(tail[8:12], "little")) & mask
+    c = (c ^ b) - rotate(b, 14) & mask
+    a = (a ^ c) - rotate(c, 11) & mask
+    b = (b ^ a) - rotate(a, 25) & mask
+    c = (c ^ b) - rotate(b, 16) & mask
+    a = (a ^ c) - rotate(c, 4) & mask
+    b = (b ^ a) - rotate(a, 14) & mask
+    c = (c ^ b) - rotate(b, 24) & mask
+    return c
+
+
+def find_superblock(hdf5_file) -> int | None:
+    # The superblock follows the user block, whose size is 0 or a power of 2 from 512 bytes
+    file_size = os.fstat(hdf5_file.fileno()).st_size
+    offset = 0
+    while offset < file_size:
+        hdf5_file.seek(offset)
+        if hdf5_file.read(len(HDF5_SIGNATURE)) == HDF5_SIGNATURE:
+            return offset
+        offset = 512 if offset == 0 else offset * 2
+    return None
+
+
+def clear_write_mark(path: str) -> bool:
+    """
+    Clear the open for write mark HDF5 leaves on a file written with libver="latest" by a process that exited without
+    closing it, like h5clear -s. Writers in SWMR mode do not lock the file, so a file they marked may still be written
+    and is left as it is.
+    :param path: str - path of the HDF5 file
+    :return: bool - True if the mark was cleared; False if the file is not marked, is marked by a SWMR writer, is still
+             open for writing by another process or cannot be written
+    """
+    try:
+        hdf5_file = open(path, "r+b")
+    except OSError:
+        return False
+    with hdf5_file:
+        try:
+            # Writers not in SWMR mode hold this lock until they close the file
+            fcntl.flock(hdf5_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        try:
+            offset = find_superblock(hdf5_file)
+            if offset is None:
+                return False
+            hdf5_file.seek(offset + len(HDF5_SIGNATURE))
+            version, offset_size, _, flags = hdf5_file.read(4)
+            if (
+                version < 3
+                or not flags & OPEN_FOR_WRITE_FLAG
+                or flags & SWMR_WRITE_FLAG
+            ):
+                return False
+            # Signature, versions and sizes, flags and the base, extension, end of file and root group addresses
+            superblock_size = len(HDF5_SIGNATURE) + 4 + 4 * offset_size
+            hdf5_file.seek(offset)
+            superblock = bytearray(hdf5_file.read(superblock_size))
+            superblock[len(HDF5_SIGNATURE) + 3] = 0
+            hdf5_file.seek(offset)
+            hdf5_file.write(
+                bytes(superblock)
+                + get_metadata_checksum(bytes(superblock)).to_bytes(4, "little")
+            )
+            hdf5_file.flush()
+            os.fsync(hdf5_file.fileno())
+            return True
+        finally:
+            fcntl.flock(hdf5_file.fileno(), fcntl.LOCK_UN)
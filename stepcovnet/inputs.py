@@ -67,6 +67,10 @@ class TrainingInput(AbstractInput):
             difficulty=self.config.difficulty,
             warmup=True,
             tokenizer_name=self.config.tokenizer_name,
+            dataset_kwargs=self.config.dataset_kwargs,
+            # Songs collected while training are only used to train, so the validation songs stay the same
+            follow_new_songs=self.config.dataset_kwargs.get("swmr", False),
+            known_songs=len(self.config.song_index_ranges),
         )
         self.val_feature_generator = training.TrainingFeatureGenerator(
             dataset_path=self.config.dataset_path,
@@ -79,6 +83,7 @@ class TrainingInput(AbstractInput):
             difficulty=self.config.difficulty,
             shuffle=False,
             tokenizer_name=self.config.tokenizer_name,
+            dataset_kwargs=self.config.dataset_kwargs,
         )
         self.all_feature_generator = training.TrainingFeatureGenerator(
             dataset_path=self.config.dataset_path,
@@ -91,6 +96,7 @@ class TrainingInput(AbstractInput):
             difficulty=self.config.difficulty,
             warmup=True,
             tokenizer_name=self.config.tokenizer_name,
+            dataset_kwargs=self.config.dataset_kwargs,
         )
 
     def get_tf_dataset(
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import collections
+import math
+import threading
+import time
+
+import h5py
+import numpy as np
+
+IO_COUNTERS = [
+    "selections",
+    "bytes_requested",
+    "read_seconds",
+    "writes",
+    "bytes_written",
+    "write_seconds",
+]
+# Estimated from the selections, and only reported for the datasets they are modelled for
+MODELLED_IO_COUNTERS = [
+    "modelled_chunks_read",
+    "modelled_chunk_cache_hits",
+    "modelled_bytes_decompressed",
+]
+
+
+class IOStats:
+    """
+    Counters of the reads and writes of the HDF5 datasets of model datasets opened with it, by dataset name.
+
+    HDF5 does not report its chunk cache activity, so the MODELLED_IO_COUNTERS estimate it: reads touch the chunks
+    holding their rows along the first axis and all the chunks along the other axes, and the chunk cache of each
+    opened dataset is modelled as an LRU cache of the chunk cache size of the file. HDF5 evicts chunks from a hash
+    table, so it can miss more than the model. Virtual datasets, like the ones of distributed datasets, read the chunks
+    of their source files and contiguous datasets have no chunks, so they are not modelled and have no
+    MODELLED_IO_COUNTERS in the report.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files_opened = 0
+        self.dataset_counters: dict[str, collections.Counter] = collections.defaultdict(
+            collections.Counter
+        )
+
+    def record_file_opened(self):
+        with self.lock:
+            self.files_opened += 1
+
+    def record(self, dataset_name: str, **counters):
+        with self.lock:
+            self.dataset_counters[dataset_name].update(counters)
+
+    def reset(self):
+        with self.lock:
+            self.files_opened = 0
+            self.dataset_counters.clear()
+
+    def report(self) -> dict:
+        """
+        Counters of each dataset name and their totals
+        :return: dict - files_opened, and the IO_COUNTERS of each dataset name under datasets and summed under totals,
+                 along with the MODELLED_IO_COUNTERS of the datasets they are modelled for
+        """
+        with self.lock:
+            datasets = {
+                dataset_name: {
+                    counter: counters[counter]
+                    for counter in IO_COUNTERS + MODELLED_IO_COUNTERS
+                    if counter in IO_COUNTERS or counter in counters
+                }
+                for dataset_name, counters in sorted(self.dataset_counters.items())
+            }
+            files_opened = self.files_opened
+        totals = {
+            counter: sum(
+                counters[counter]
+                for counters in datasets.values()
+                if counter in counters
+            )
+            for counter in IO_COUNTERS + MODELLED_IO_COUNTERS
+            if counter in IO_COUNTERS
+            or any(counter in counters for counters in datasets.values())
+        }
+        return {"files_opened": files_opened, "datasets": datasets, "totals": totals}
+
+    def print_report(self):
+        report = self.report()
+        print("Dataset I/O: %d files opened" % report["files_opened"])
+        for dataset_name, counters in list(report["datasets"].items()) + [
+            ("total", report["totals"])
+        ]:
+            modelled = ""
+            if "modelled_chunks_read" in counters:
+                modelled = (
+                    ", modelled %d/%d chunk cache hits and %.1f MB decompressed"
+                    % (
+                        counters["modelled_chunk_cache_hits"],
+                        counters["modelled_chunks_read"],
+                        counters["modelled_bytes_decompressed"] / 1024**2,
+                    )
+                )
+            print(
+                "  %s: %d selections, %.1f MB requested in %.2fs, %.1f MB written in %.2fs%s"
+                % (
+                    dataset_name,
+                    counters["selections"],
+                    counters["bytes_requested"] / 1024**2,
+                    counters["read_seconds"],
+                    counters["bytes_written"] / 1024**2,
+                    counters["write_seconds"],
+                    modelled,
+                )
+            )
+
+
+# Counters of the datasets of this process opened with io_stats=IO_STATS
+IO_STATS = IOStats()
+
+
+def get_selected_row_chunks(
+    selection, num_rows: int, chunk_rows: int
+) -> np.ndarray | range | None:
+    """
+    Indexes of the chunks along the first axis holding the rows of a selection
+    :param selection: index passed to h5py.Dataset.__getitem__
+    :param num_rows: int - length of the first axis
+    :param chunk_rows: int - number of rows per chunk
+    :return: np.ndarray | range | None - chunk indexes, or None if the selection is not understood
+    """
+    if isinstance(selection, tuple):
+        selection = selection[0] if selection else Ellipsis
+    if selection is Ellipsis:
+        selection = slice(None)
+    if isinstance(selection, (int, np.integer)):
+        row = int(selection) % max(num_rows, 1)
+        return range(row // chunk_rows, row // chunk_rows + 1)
+    if isinstance(selection, slice):
+        start, stop, step = selection.indices(num_rows)
+        if step == 1:
+            if stop <= start:
+                return range(0)
+            return range(start // chunk_rows, (stop - 1) // chunk_rows + 1)
+        rows = np.arange(start, stop, step)
+    else:
+        try:
+            rows = np.asarray(selection)
+        except Exception:
+            return None
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        elif not np.issubdtype(rows.dtype, np.integer):
+            return None
+    return np.unique(rows.reshape(-1) % max(num_rows, 1) // chunk_rows)
+
+
+class CountingDataset(h5py.Dataset):
+    """HDF5 dataset recording its reads and writes in the IOStats of its file"""
+
+    def __init__(self, bind, counting_file: CountingFile):
+        super(CountingDataset, self).__init__(bind)
+        self.counting_file = counting_file
+        self.dataset_name = self.name.lstrip("/")
+
+    def __getitem__(self, args, new_dtype=None):
+        start_time = time.perf_counter()
+        data = super(CountingDataset, self).__getitem__(args, new_dtype=new_dtype)
+        read_seconds = time.perf_counter() - start_time
+        counters = {
+            "selections": 1,
+            "bytes_requested": int(np.asarray(data).nbytes),
+            "read_seconds": read_seconds,
+        }
+        counters.update(self.model_chunk_cache(args))
+        self.counting_file.io_stats.record(self.dataset_name, **counters)
+        return data
+
+    def __setitem__(self, args, val):
+        start_time = time.perf_counter()
+        super(CountingDataset, self).__setitem__(args, val)
+        self.counting_file.io_stats.record(
+            self.dataset_name,
+            writes=1,
+            bytes_written=int(np.asarray(val).nbytes),
+            write_seconds=time.perf_counter() - start_time,
+        )
+
+    def model_chunk_cache(self, args) -> dict[str, int]:
+        if self.chunks is None or self.is_virtual or len(self.shape) == 0:
+            return {}
+        row_chunks = get_selected_row_chunks(args, self.shape[0], self.chunks[0])
+        if row_chunks is None:
+            return {}
+        # Chunks along the other axes are read along with each chunk of rows
+        chunks_per_row_chunk = math.prod(
+            math.ceil(length / chunk_length) if length else 0
+            for length, chunk_length in zip(self.shape[1:], self.chunks[1:])
+        )
+        chunk_bytes = math.prod(self.chunks) * self.dtype.itemsize
+        row_chunk_bytes = chunk_bytes * chunks_per_row_chunk
+        chunk_cache = self.counting_file.get_chunk_cache(self.dataset_name)
+        capacity = (
+            self.counting_file.chunk_cache_bytes // row_chunk_bytes
+            if row_chunk_bytes
+            else 0
+        )
+        hits = 0
+        with self.counting_file.lock:
+            for row_chunk in row_chunks:
+                row_chunk = int(row_chunk)
+                if row_chunk in chunk_cache:
+                    hits += 1
+                    chunk_cache.move_to_end(row_chunk)
+                elif capacity > 0:
+                    chunk_cache[row_chunk] = None
+                    if len(chunk_cache) > capacity:
+                        chunk_cache.popitem(last=False)
+        misses = len(row_chunks) - hits
+        return {
+            "modelled_chunks_read": len(row_chunks) * chunks_per_row_chunk,
+            "modelled_chunk_cache_hits": hits * chunks_per_row_chunk,
+            "modelled_bytes_decompressed": (
+                misses * row_chunk_bytes if self.compression is not None else 0
+            ),
+        }
+
+
+class CountingFile(h5py.File):
+    """HDF5 file whose datasets record their reads and writes in an IOStats"""
+
+    def __init__(self, name, mode: str = "r", io_stats: IOStats = IO_STATS, **kwargs):
+        super(CountingFile, self).__init__(name, mode, **kwargs)
+        self.io_stats = io_stats
+        self.chunk_cache_bytes = self.id.get_access_plist().get_cache()[2]
+        self.chunk_caches: dict[str, collections.OrderedDict] = {}
+        self.lock = threading.Lock()
+        io_stats.record_file_opened()
+
+    def __getitem__(self, name):
+        item = super(CountingFile, self).__getitem__(name)
+        if isinstance(item, h5py.Dataset):
+            return CountingDataset(item.id, self)
+        return item
+
+    def create_dataset(self, name, shape=None, dtype=None, data=None, **kwargs):
+        start_time = time.perf_counter()
+        h5py_dataset = super(CountingFile, self).create_dataset(
+            name, shape=shape, dtype=dtype, data=data, **kwargs
+        )
+        if data is not None:
+            self.io_stats.record(
+                h5py_dataset.name.lstrip("/"),
+                writes=1,
+                bytes_written=int(np.asarray(data).nbytes),
+                write_seconds=time.perf_counter() - start_time,
+            )
+        return CountingDataset(h5py_dataset.id, self)
+
+    def get_chunk_cache(self, dataset_name: str) -> collections.OrderedDict:
+        with self.lock:
+            return self.chunk_caches.setdefault(dataset_name, collections.OrderedDict())
@@ -60,6 +60,25 @@ def frame(data: np.ndarray, window_length: int, hop_length: int) -> np.ndarray:
     )
 
 
+def get_num_frames(num_samples: int, window_length: int, hop_length: int) -> int:
+    """Return the number of frames frame() produces for num_samples samples.
+
+    Args:
+      num_samples: Number of samples in the data to frame.
+      window_length: Number of samples in each frame.
+      hop_length: Advance (in samples) between each window.
+
+    Returns:
+      Number of frames, including the frames added by zero padding.
+    """
+    num_frames = 1 + int(np.floor((num_samples - window_length) / hop_length))
+    padding_diff = int(np.floor(num_samples / hop_length) - num_frames)
+    if padding_diff > 0:
+        num_samples += padding_diff * hop_length
+        num_frames = 1 + int(np.floor((num_samples - window_length) / hop_length))
+    return num_frames
+
+
 def periodic_hann(window_length: int) -> np.ndarray:
     """Calculate a "periodic" Hann window.
 
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+import struct
+
+import numpy as np
+
+from stepcovnet import dataset
+
+# Headers are written with a fixed size so the shape can be updated in place when rows are appended
+NPY_HEADER_SIZE = 256
+
+
+def write_npy_header(npy_file, dtype: np.dtype, shape: tuple[int, ...]):
+    """
+    Write a version 1.0 .npy header padded to NPY_HEADER_SIZE bytes at the start of the file
+    :param npy_file: file object opened for binary writing
+    :param dtype: np.dtype - dtype of the array
+    :param shape: tuple[int, ...] - shape of the array
+    """
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": tuple(int(dim) for dim in shape),
+        }
+    )
+    prefix = np.lib.format.MAGIC_PREFIX + bytes([1, 0])
+    header_length = NPY_HEADER_SIZE - len(prefix) - 2
+    if len(header) + 1 > header_length:
+        raise ValueError("Shape %s does not fit in the .npy header" % (shape,))
+    npy_file.seek(0)
+    npy_file.write(
+        prefix
+        + struct.pack("<H", header_length)
+        + (header.ljust(header_length - 1) + "\n").encode("latin1")
+    )
+
+
+def convert_dataset(
+    source_dataset: dataset.ModelDataset, memmap_dataset: MemmapModelDataset
+):
+    """
+    Copy every song of a dataset to a memory-mapped dataset. Works with any label layout or feature encoding since
+    songs are read in the format accepted by dump.
+    :param source_dataset: ModelDataset - opened dataset to copy from
+    :param memmap_dataset: MemmapModelDataset - opened dataset to copy to
+    """
+    num_songs = len(source_dataset.song_index_ranges)
+    for song_index in range(num_songs):
+        song_data = source_dataset.read_song(song_index)
+        print(
+            "[%d/%d] Converting: %s"
+            % (song_index + 1, num_songs, song_data["file_names"])
+        )
+        memmap_dataset.dump(**song_data)
+
+
+class MemmapModelDataset(dataset.ModelDataset):
+    """
+    Dataset stored as one uncompressed .npy file per dataset and a JSON index with the song names and sample counts.
+
+    The .npy files are memory-mapped, so slices are read straight from the page cache without decompressing or
+    copying them. Labels are stored dense for every difficulty, with fill values for the difficulties missing from a
+    song. Use convert_dataset to create one from an HDF5 dataset.
+    """
+
+    def __init__(
+        self,
+        dataset_name: str,
+        overwrite: bool = False,
+        mode: str = "a",
+        difficulty: str = "challenge",
+    ):
+        super(MemmapModelDataset, self).__init__(
+            dataset_name, overwrite=overwrite, mode=mode, difficulty=difficulty
+        )
+        if self.overwrite:
+            for npy_path in glob.glob(glob.escape(dataset_name) + ".*.npy"):
+                os.remove(npy_path)
+        self.index = {"datasets": {}, "attrs": {}, "file_names": []}
+        self.song_indexes: dict[str, int] = {}
+        self.arrays: dict[str, np.ndarray] = {}
+
+    def __enter__(self) -> MemmapModelDataset:
+        if os.path.isfile(self.dataset_path):
+            with open(self.dataset_path, "r") as index_file:
+                self.index = json.load(index_file)
+        elif self.mode == "r":
+            raise FileNotFoundError("Dataset %s not found" % self.dataset_path)
+        self.song_indexes = {
+            file_name: song_index
+            for song_index, file_name in enumerate(self.index["file_names"])
+        }
+        self.arrays = {}
+        self.set_difficulty(difficulty=self.difficulty)
+        return self
+
+    def close(self):
+        self.arrays = {}
+        if self.mode != "r":
+            with open(self.dataset_path, "w") as index_file:
+                json.dump(self.index, index_file)
+
+    def get_npy_path(self, dataset_name: str) -> str:
+        return "%s.%s.npy" % (self.dataset_name, dataset_name)
+
+    def get_array(self, dataset_name: str) -> np.ndarray:
+        if dataset_name not in self.arrays:
+            dataset_info = self.index["datasets"][dataset_name]
+            if dataset_info["shape"][0] == 0:
+                # Empty files cannot be memory-mapped
+                self.arrays[dataset_name] = np.zeros(
+                    dataset_info["shape"], dtype=dataset_info["dtype"]
+                )
+            else:
+                self.arrays[dataset_name] = np.lib.format.open_memmap(
+                    self.get_npy_path(dataset_name), mode="r"
+                )
+        return self.arrays[dataset_name]
+
+    def append_rows(self, dataset_name: str, data: np.ndarray):
+        # Arrays read from HDF5 can carry dtype metadata, which .npy files do not support
+        data = np.ascontiguousarray(data, dtype=np.dtype(data.dtype.str))
+        npy_path = self.get_npy_path(dataset_name)
+        if dataset_name not in self.index["datasets"]:
+            self.index["datasets"][dataset_name] = {
+                "dtype": np.lib.format.dtype_to_descr(data.dtype),
+                "shape": [0] + list(data.shape[1:]),
+            }
+            with open(npy_path, "wb") as npy_file:
+                write_npy_header(npy_file, data.dtype, (0,) + data.shape[1:])
+        dataset_info = self.index["datasets"][dataset_name]
+        data = data.astype(dataset_info["dtype"], copy=False)
+        dataset_info["shape"][0] += len(data)
+        with open(npy_path, "r+b") as npy_file:
+            npy_file.seek(0, os.SEEK_END)
+            npy_file.write(data.tobytes())
+            write_npy_header(npy_file, data.dtype, dataset_info["shape"])
+        # The next read maps the file again with the new shape
+        self.arrays.pop(dataset_name, None)
+
+    def dump(
+        self,
+        features: np.ndarray,
+        labels: dict,
+        sample_weights: dict,
+        arrows: dict,
+        label_encoded_arrows: dict,
+        binary_encoded_arrows: dict,
+        file_names: str,
+        string_arrows: dict,
+        onehot_encoded_arrows: dict,
+    ):
+        num_frames = len(features)
+        song_start_index = self.num_samples
+        self.append_rows("features", np.asarray(features))
+        self.append_rows(
+            "song_index_ranges",
+            np.array([[song_start_index, song_start_index + num_frames]]),
+        )
+        self.append_rows(
+            "available_difficulties", np.array([self.get_difficulty_mask(labels)])
+        )
+        for dataset_name, data in zip(
+            self.difficulty_dataset_names,
+            [
+                labels,
+                sample_weights,
+                arrows,
+                label_encoded_arrows,
+                binary_encoded_arrows,
+                string_arrows,
+                onehot_encoded_arrows,
+            ],
+        ):
+            song_data = next(iter(data.values()))
+            null_values = np.full(
+                song_data.shape,
+                fill_value=self.get_null_value(song_data.dtype),
+                dtype=song_data.dtype,
+            )
+            for difficulty in self.difficulties:
+                self.append_rows(
+                    self.append_difficulty(dataset_name, difficulty),
+                    np.asarray(data.get(difficulty, null_values)),
+                )
+        for difficulty, difficulty_labels in labels.items():
+            attrs = self.index["attrs"].setdefault(
+                self.append_difficulty("labels", difficulty),
+                dict.fromkeys(self.dataset_attr["labels"], 0),
+            )
+            attrs["num_valid_samples"] += len(difficulty_labels)
+            attrs["pos_samples"] += int(difficulty_labels.sum())
+            attrs["neg_samples"] += len(difficulty_labels) - int(
+                difficulty_labels.sum()
+            )
+        self.index["file_names"].append(file_names)
+        self.song_indexes[file_names] = len(self.index["file_names"]) - 1
+
+    def read_song(self, song_index: int) -> dict:
+        song_start_index, song_end_index = self.song_index_ranges[song_index]
+        song_data = {
+            "features": np.array(self.features[song_start_index:song_end_index]),
+            "file_names": self.index["file_names"][song_index],
+        }
+        for dataset_name in self.difficulty_dataset_names:
+            song_data[dataset_name] = {
+                difficulty: np.array(
+                    self.get_array(self.append_difficulty(dataset_name, difficulty))[
+                        song_start_index:song_end_index
+                    ]
+                )
+                for difficulty in self.get_available_difficulties(song_index)
+            }
+        return song_data
+
+    def get_available_difficulties(self, song_index: int) -> list[str]:
+        mask = int(self.get_array("available_difficulties")[song_index])
+        return [
+            difficulty
+            for i, difficulty in enumerate(dataset.DIFFICULTIES)
+            if mask & (1 << i)
+        ]
+
+    def get_song_index(self, file_name: str) -> int:
+        return self.song_indexes[file_name]
+
+    def get_label_dataset(self, dataset_name: str) -> np.ndarray:
+        return self.get_array(self.append_difficulty(dataset_name, self.difficulty))
+
+    def get_label_stats(self, difficulty: str) -> dict:
+        return self.index["attrs"].get(self.append_difficulty("labels", difficulty), {})
+
+    @property
+    def num_samples(self) -> int:
+        if "features" not in self.index["datasets"]:
+            return 0
+        return self.index["datasets"]["features"]["shape"][0]
+
+    @property
+    def file_names(self) -> list[str]:
+        return list(self.index["file_names"])
+
+    @property
+    def song_index_ranges(self) -> np.ndarray:
+        if "song_index_ranges" not in self.index["datasets"]:
+            return np.zeros((0, 2), dtype=np.int64)
+        return self.get_array("song_index_ranges")
+
+    @property
+    def features(self) -> np.ndarray:
+        return self.get_array("features")
+
+    @staticmethod
+    def append_file_type(path: str) -> str:
+        return path + ".index.json"
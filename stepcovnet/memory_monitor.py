@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import collections
+import re
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from multiprocessing.pool import Pool
+
+import psutil
+
+MEMORY_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_memory_size(memory_size: str | int) -> int:
+    """
+    Parse a memory size such as 512M or 16G into bytes
+    :param memory_size: str | int - number of bytes, optionally suffixed with K, M, G or T
+    :return: int - number of bytes
+    """
+    match = re.fullmatch(
+        r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", str(memory_size).upper()
+    )
+    if match is None or float(match.group(1)) <= 0:
+        raise ValueError(
+            "%s is not a valid memory size. Use a positive number of bytes optionally suffixed with K, M, G or T"
+            % memory_size
+        )
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2)])
+
+
+def format_memory_size(num_bytes: int) -> str:
+    return "%.1f MB" % (num_bytes / MEMORY_UNITS["M"])
+
+
+def get_rss(process: psutil.Process) -> int:
+    try:
+        return process.memory_info().rss
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return 0
+
+
+class StageMemoryTracker:
+    """Samples the RSS of a process in a background thread and records the peak of each named stage"""
+
+    def __init__(
+        self, process: psutil.Process | None = None, poll_seconds: float = 0.02
+    ):
+        self.process = process if process is not None else psutil.Process()
+        self.poll_seconds = poll_seconds
+        self.stage: str | None = None
+        self.stage_peaks: dict[str, int] = {}
+        self.start_rss = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def __enter__(self) -> StageMemoryTracker:
+        self.start_rss = get_rss(self.process)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.poll, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.sample()
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def poll(self):
+        while not self.stop_event.wait(self.poll_seconds):
+            self.sample()
+
+    def sample(self):
+        rss = get_rss(self.process)
+        with self.lock:
+            if self.stage is not None:
+                self.stage_peaks[self.stage] = max(
+                    self.stage_peaks.get(self.stage, 0), rss
+                )
+
+    def set_stage(self, stage: str):
+        # Close the previous stage with a final sample so short stages are not missed by the polling thread
+        self.sample()
+        with self.lock:
+            self.stage = stage
+        self.sample()
+
+    @property
+    def peak(self) -> int:
+        return max(self.stage_peaks.values(), default=self.start_rss)
+
+    def report(self) -> dict:
+        return {"start_rss": self.start_rss, "stage_peaks": dict(self.stage_peaks)}
+
+
+class MemoryBudget:
+    """Throttles the dispatch of songs to pool workers to keep the collection under a memory budget.
+
+    The RSS of the parent process and all its children is checked before every dispatch. A song is only dispatched if
+    the current RSS plus the largest memory growth seen for a song so far fits in the budget. Concurrency is shrunk
+    when the RSS goes over the high watermark and grown back, up to the number of pool workers, under the low one.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int,
+        max_concurrency: int,
+        high_watermark: float = 0.9,
+        low_watermark: float = 0.7,
+    ):
+        self.memory_budget = memory_budget
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.process = psutil.Process()
+        self.expected_song_memory = 0
+        self.peak_total_rss = 0
+        self.peak_concurrency_reduction = 0
+        self.song_peaks: dict[str, int] = {}
+        self.stage_peaks: dict[str, int] = {}
+
+    def get_total_rss(self) -> int:
+        total_rss = get_rss(self.process) + sum(
+            get_rss(child) for child in self.process.children(recursive=True)
+        )
+        self.peak_total_rss = max(self.peak_total_rss, total_rss)
+        return total_rss
+
+    def can_dispatch(self, num_pending: int) -> bool:
+        total_rss = self.get_total_rss()
+        if total_rss > self.high_watermark * self.memory_budget:
+            self.concurrency = max(1, self.concurrency - 1)
+        elif (
+            total_rss < self.low_watermark * self.memory_budget
+            and self.concurrency < self.max_concurrency
+        ):
+            self.concurrency += 1
+        self.peak_concurrency_reduction = max(
+            self.peak_concurrency_reduction, self.max_concurrency - self.concurrency
+        )
+        if num_pending >= self.concurrency:
+            return False
+        return total_rss + self.expected_song_memory <= self.memory_budget
+
+    def imap(self, pool: Pool, func: Callable, iterable: Iterable) -> Iterator:
+        """Like Pool.imap but only dispatches new items while the budget allows it. At least one item is always
+        in flight so collection keeps progressing even when a single song does not fit in the budget.
+        """
+        pending_results = collections.deque()
+        items = iter(iterable)
+        exhausted = False
+        while True:
+            while not exhausted and (
+                not pending_results or self.can_dispatch(len(pending_results))
+            ):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending_results.append(pool.apply_async(func, (item,)))
+            if not pending_results:
+                return
+            yield pending_results.popleft().get()
+
+    def record_song(self, file_name: str, memory_usage: dict):
+        stage_peaks = memory_usage["stage_peaks"]
+        song_peak = max(stage_peaks.values(), default=memory_usage["start_rss"])
+        self.song_peaks[file_name] = song_peak
+        self.expected_song_memory = max(
+            self.expected_song_memory, song_peak - memory_usage["start_rss"]
+        )
+        self.record_stages(stage_peaks)
+
+    def record_stages(self, stage_peaks: dict[str, int]):
+        for stage, peak in stage_peaks.items():
+            self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), peak)
+
+    def report(self) -> dict:
+        return {
+            "memory_budget": self.memory_budget,
+            "peak_total_rss": self.peak_total_rss,
+            "peak_concurrency_reduction": self.peak_concurrency_reduction,
+            "stage_peaks": self.stage_peaks,
+            "song_peaks": self.song_peaks,
+        }
+
+    def print_report(self):
+        print(
+            "Peak memory: %s of %s budget"
+            % (
+                format_memory_size(self.peak_total_rss),
+                format_memory_size(self.memory_budget),
+            )
+        )
+        if self.peak_concurrency_reduction > 0:
+            print(
+                "Concurrency was reduced by up to %d workers to stay under budget"
+                % self.peak_concurrency_reduction
+            )
+        print("Peak memory per stage:")
+        for stage, peak in self.stage_peaks.items():
+            print("  %s: %s" % (stage, format_memory_size(peak)))
+        print("Peak memory per song:")
+        for file_name, peak in sorted(
+            self.song_peaks.items(), key=lambda song_peak: song_peak[1], reverse=True
+        ):
+            print("  %s: %s" % (file_name, format_memory_size(peak)))
@@ -0,0 +1,472 @@
+from __future__ import annotations
+
+import collections
+import functools
+import json
+import multiprocessing
+import os
+from multiprocessing.pool import AsyncResult, Pool
+
+import numpy as np
+import psutil
+
+from stepcovnet import archive, dataset, sample_collection_helper
+
+
+@functools.lru_cache(maxsize=None)
+def get_song_path(path: str) -> str | archive.SongArchive:
+    # Archives are indexed once per worker instead of once per song
+    return archive.get_song_path(path)
+
+
+def get_song_info(
+    wavs_path: str, timings_path: str, config: dict, file_name: str
+) -> dict | None:
+    try:
+        num_audio_samples, audio_data_sample_rate = (
+            sample_collection_helper.get_audio_info(
+                archive.open_song_file(get_song_path(wavs_path), file_name + ".wav")
+            )
+        )
+        num_frames = sample_collection_helper.get_num_audio_features(
+            num_audio_samples, audio_data_sample_rate, config
+        )
+        onsets = sample_collection_helper.get_labels(
+            get_song_path(timings_path), file_name, config
+        )[0]
+        pos_samples = {
+            difficulty: len(
+                np.unique(
+                    sample_collection_helper.remove_out_of_range(
+                        difficulty_onsets, 0, num_frames - 1
+                    )
+                )
+            )
+            for difficulty, difficulty_onsets in onsets.items()
+        }
+        return {
+            "file_name": file_name,
+            "num_frames": num_frames,
+            "pos_samples": pos_samples,
+        }
+    except Exception as ex:
+        print("Error reading song info for %s: %r" % (file_name, ex))
+        return None
+
+
+def get_song_labels(
+    timings_path: str, config: dict, num_frames: int, file_name: str
+) -> tuple:
+    (
+        onsets,
+        arrows,
+        label_encoded_arrows,
+        binary_encoded_arrows,
+        string_arrows,
+        onehot_encoded_arrows,
+    ) = sample_collection_helper.get_labels(
+        get_song_path(timings_path), file_name, config
+    )
+    return sample_collection_helper.get_frame_labels(
+        onsets,
+        num_frames,
+        arrows,
+        label_encoded_arrows,
+        binary_encoded_arrows,
+        string_arrows,
+        onehot_encoded_arrows,
+        config["NUM_ARROW_TYPES"],
+    )
+
+
+def get_song_features_and_labels(
+    wavs_path: str, timings_path: str, config: dict, num_frames: int, file_name: str
+) -> tuple[np.ndarray, tuple]:
+    (
+        log_mel,
+        onsets,
+        arrows,
+        label_encoded_arrows,
+        binary_encoded_arrows,
+        string_arrows,
+        onehot_encoded_arrows,
+    ) = sample_collection_helper.get_features_and_labels(
+        get_song_path(wavs_path), get_song_path(timings_path), file_name, config
+    )
+    if log_mel.shape[0] != num_frames:
+        raise ValueError(
+            "%s has %d frames but %d were expected. The audio file changed since the dataset was created."
+            % (file_name, log_mel.shape[0], num_frames)
+        )
+    labels = sample_collection_helper.get_frame_labels(
+        onsets,
+        num_frames,
+        arrows,
+        label_encoded_arrows,
+        binary_encoded_arrows,
+        string_arrows,
+        onehot_encoded_arrows,
+        config["NUM_ARROW_TYPES"],
+    )
+    # Same type casting as the features saved by the data collection
+    return log_mel.astype("float16"), labels
+
+
+class OnlineDatasetColumn:
+    """Read-only view of one dataset of an OnlineModelDataset. Rows are indexed across songs like an h5py dataset."""
+
+    def __init__(self, model_dataset: OnlineModelDataset, dataset_name: str):
+        self.model_dataset = model_dataset
+        self.dataset_name = dataset_name
+
+    def __len__(self) -> int:
+        return self.model_dataset.num_samples
+
+    def __getitem__(self, item) -> np.ndarray:
+        if isinstance(item, (int, np.integer)):
+            if not -len(self) <= item < len(self):
+                raise IndexError("Index %d is out of range" % item)
+            item = item % len(self)
+            return self[item : item + 1][0]
+        if not isinstance(item, slice):
+            raise TypeError("Online datasets can only be indexed with ints or slices")
+        start, stop, step = item.indices(len(self))
+        if step != 1:
+            raise ValueError("Online datasets do not support slice steps")
+        song_index_ranges = self.model_dataset.song_index_ranges
+        first_song_index = int(
+            np.searchsorted(song_index_ranges[:, 1], start, side="right")
+        )
+        if stop <= start:
+            song_index = min(first_song_index, len(song_index_ranges) - 1)
+            return self.model_dataset.get_song_data(song_index, self.dataset_name)[:0]
+        end_song_index = int(np.searchsorted(song_index_ranges[:, 0], stop))
+        data = []
+        for song_index in range(first_song_index, end_song_index):
+            song_start_index, song_end_index = song_index_ranges[song_index]
+            song_data = self.model_dataset.get_song_data(song_index, self.dataset_name)
+            data.append(
+                song_data[
+                    max(start, song_start_index)
+                    - song_start_index : min(stop, song_end_index)
+                    - song_start_index
+                ]
+            )
+        return data[0] if len(data) == 1 else np.concatenate(data)
+
+
+class OnlineModelDataset(dataset.ModelDataset):
+    """Dataset that computes features and labels from the source audio and timings files when they are read instead
+    of storing them. Only a manifest with the sources, config, frame count and positive samples of each song is written
+    to disk, so the training split and bias are computed without decoding audio. Song stats have no feature moments,
+    so training fits the scalers on a subsample of the songs.
+
+    Songs are computed by a pool of worker processes and kept in LRU caches. Labels only need the timings file, so
+    reading labels never decodes audio. When the read order is known, the songs read next are computed ahead of time.
+    """
+
+    def __init__(
+        self,
+        dataset_name: str,
+        overwrite: bool = False,
+        mode: str = "a",
+        difficulty: str = "challenge",
+        cache_size: int = 16,
+        cores: int | None = None,
+    ):
+        super(OnlineModelDataset, self).__init__(
+            dataset_name, overwrite=overwrite, mode=mode, difficulty=difficulty
+        )
+        self.cache_size = cache_size
+        self.cores = cores if cores is not None else psutil.cpu_count(logical=False)
+        self.manifest = {
+            "wavs_path": None,
+            "timings_path": None,
+            "config": None,
+            "songs": [],
+        }
+        self.song_index_ranges_array = np.zeros((0, 2), dtype=np.int64)
+        self.feature_cache: collections.OrderedDict = collections.OrderedDict()
+        self.label_cache: collections.OrderedDict = collections.OrderedDict()
+        self.pending_results: dict[tuple[int, bool], AsyncResult] = {}
+        self.read_order: list[int] = []
+        self.read_order_positions: dict[int, int] = {}
+        self.pool: Pool | None = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __enter__(self) -> OnlineModelDataset:
+        if os.path.isfile(self.dataset_path):
+            with open(self.dataset_path, "r") as manifest_file:
+                self.manifest = json.load(manifest_file)
+        elif self.mode == "r":
+            raise FileNotFoundError("Dataset %s not found" % self.dataset_path)
+        self.reset_song_index_ranges()
+        self.set_difficulty(difficulty=self.difficulty)
+        return self
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.pending_results.clear()
+        self.feature_cache.clear()
+        self.label_cache.clear()
+
+    def reset_song_index_ranges(self):
+        num_frames = np.array(
+            [song["num_frames"] for song in self.manifest["songs"]], dtype=np.int64
+        )
+        song_end_indexes = np.cumsum(num_frames)
+        self.song_index_ranges_array = np.stack(
+            [song_end_indexes - num_frames, song_end_indexes], axis=1
+        )
+
+    def build(
+        self,
+        wavs_path: str,
+        timings_path: str,
+        config: dict,
+        file_names: list[str],
+        limit: int = -1,
+        pool_kwargs: dict | None = None,
+    ):
+        """
+        Read the frame count and onset counts of each song and save the manifest. Audio data is not decoded.
+        :param wavs_path: str - directory or archive of the audio files
+        :param timings_path: str - directory or archive of the timings files
+        :param config: dict - dataset config
+        :param file_names: list[str] - names of the songs without file extension
+        :param limit: int - maximum number of frames, -1 for unlimited
+        :param pool_kwargs: dict - keyword arguments of multiprocessing.Pool
+        """
+        if self.mode == "r":
+            raise ValueError("Cannot build an online dataset opened in read mode")
+        self.manifest = {
+            "wavs_path": os.path.abspath(wavs_path),
+            "timings_path": os.path.abspath(timings_path),
+            "config": config,
+            "songs": [],
+        }
+        func = functools.partial(
+            get_song_info,
+            self.manifest["wavs_path"],
+            self.manifest["timings_path"],
+            config,
+        )
+        num_samples = 0
+        with multiprocessing.Pool(self.cores, **(pool_kwargs or {})) as pool:
+            for song_info in pool.imap(func, file_names):
+                # Songs without any difficulty cannot be trained on
+                if song_info is None or not song_info["pos_samples"]:
+                    continue
+                self.manifest["songs"].append(song_info)
+                num_samples += song_info["num_frames"]
+                if 0 < limit <= num_samples:
+                    print(
+                        "Limit reached after %d songs. Breaking..."
+                        % len(self.manifest["songs"])
+                    )
+                    break
+        temp_dataset_path = self.dataset_path + ".tmp"
+        with open(temp_dataset_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file)
+        os.replace(temp_dataset_path, self.dataset_path)
+        self.reset_song_index_ranges()
+
+    def dump(self, *args, **kwargs):
+        raise ValueError(
+            "Online datasets compute their data from the source files. Use build instead."
+        )
+
+    def get_song_stats(self) -> dict[str, np.ndarray] | None:
+        # Feature moments would need the audio of every song decoded, so only the positive samples are recorded
+        if not self.manifest["songs"]:
+            return None
+        return {
+            "song_pos_samples": np.array(
+                [
+                    [
+                        song["pos_samples"].get(difficulty, 0)
+                        for difficulty in dataset.DIFFICULTIES
+                    ]
+                    for song in self.manifest["songs"]
+                ],
+                dtype=np.int64,
+            )
+        }
+
+    def set_read_order(self, song_indexes: list[int] | np.ndarray):
+        self.read_order = [int(song_index) for song_index in song_indexes]
+        self.read_order_positions = {
+            song_index: position for position, song_index in enumerate(self.read_order)
+        }
+
+    def read_song(self, song_index: int) -> dict:
+        features, labels = self.load_song(song_index, with_features=True)
+        song_data = {
+            "features": features,
+            "file_names": self.manifest["songs"][song_index]["file_name"],
+        }
+        for dataset_name, data in zip(self.difficulty_dataset_names, labels):
+            song_data[dataset_name] = dict(data)
+        return song_data
+
+    def get_song_data(self, song_index: int, dataset_name: str) -> np.ndarray:
+        if dataset_name == "features":
+            return self.load_song(song_index, with_features=True)[0]
+        labels = dict(
+            zip(self.difficulty_dataset_names, self.get_song_labels(song_index))
+        )[dataset_name]
+        if self.difficulty in labels:
+            return labels[self.difficulty]
+        # Same fill values as the missing difficulties of the datasets stored on disk
+        data = next(iter(labels.values()))
+        return np.full_like(data, self.get_null_value(data.dtype))
+
+    def get_available_difficulties(self, song_index: int) -> list[str]:
+        # Known from the manifest, so the timings file is not parsed
+        return list(self.manifest["songs"][song_index]["pos_samples"])
+
+    def get_song_labels(self, song_index: int) -> tuple:
+        # Labels computed along with features are reused instead of parsing the timings file again
+        if (
+            song_index in self.feature_cache
+            or (song_index, True) in self.pending_results
+        ):
+            return self.load_song(song_index, with_features=True)[1]
+        return self.load_song(song_index, with_features=False)
+
+    def load_song(self, song_index: int, with_features: bool):
+        cache = self.feature_cache if with_features else self.label_cache
+        if song_index in cache:
+            self.cache_hits += 1
+            cache.move_to_end(song_index)
+            song_data = cache[song_index]
+        else:
+            self.cache_misses += 1
+            pending_result = self.pending_results.pop((song_index, with_features), None)
+            if pending_result is not None:
+                song_data = pending_result.get()
+            else:
+                func, args = self.get_song_job(song_index, with_features)
+                song_data = func(*args)
+            cache[song_index] = song_data
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        self.read_ahead(song_index, with_features)
+        return song_data
+
+    def get_song_job(self, song_index: int, with_features: bool) -> tuple:
+        song = self.manifest["songs"][song_index]
+        if with_features:
+            return get_song_features_and_labels, (
+                self.manifest["wavs_path"],
+                self.manifest["timings_path"],
+                self.manifest["config"],
+                song["num_frames"],
+                song["file_name"],
+            )
+        return get_song_labels, (
+            self.manifest["timings_path"],
+            self.manifest["config"],
+            song["num_frames"],
+            song["file_name"],
+        )
+
+    def read_ahead(self, song_index: int, with_features: bool):
+        if self.cores <= 1 or song_index not in self.read_order_positions:
+            return
+        if self.pool is None:
+            # Spawned workers do not inherit the threads of the parent, e.g. the ones of a running Tensorflow job
+            self.pool = multiprocessing.get_context("spawn").Pool(self.cores)
+        cache = self.feature_cache if with_features else self.label_cache
+        position = self.read_order_positions[song_index]
+        for next_song_index in self.read_order[
+            position + 1 : position + 1 + self.cores
+        ]:
+            if (
+                next_song_index not in cache
+                and (next_song_index, with_features) not in self.pending_results
+            ):
+                self.pending_results[(next_song_index, with_features)] = (
+                    self.pool.apply_async(
+                        *self.get_song_job(next_song_index, with_features)
+                    )
+                )
+
+    @property
+    def config(self) -> dict:
+        return self.manifest["config"]
+
+    @property
+    def num_samples(self) -> int:
+        return (
+            int(self.song_index_ranges_array[-1, 1])
+            if len(self.song_index_ranges_array)
+            else 0
+        )
+
+    @property
+    def num_valid_samples(self) -> int:
+        return sum(
+            song["num_frames"]
+            for song in self.manifest["songs"]
+            if self.difficulty in song["pos_samples"]
+        )
+
+    @property
+    def pos_samples(self) -> int:
+        return sum(
+            song["pos_samples"].get(self.difficulty, 0)
+            for song in self.manifest["songs"]
+        )
+
+    @property
+    def neg_samples(self) -> int:
+        return self.num_valid_samples - self.pos_samples
+
+    @property
+    def labels(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "labels")
+
+    @property
+    def sample_weights(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "sample_weights")
+
+    @property
+    def arrows(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "arrows")
+
+    @property
+    def label_encoded_arrows(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "label_encoded_arrows")
+
+    @property
+    def binary_encoded_arrows(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "binary_encoded_arrows")
+
+    @property
+    def string_arrows(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "string_arrows")
+
+    @property
+    def onehot_encoded_arrows(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "onehot_encoded_arrows")
+
+    @property
+    def file_names(self) -> list[str]:
+        return [song["file_name"] for song in self.manifest["songs"]]
+
+    @property
+    def song_index_ranges(self) -> np.ndarray:
+        return self.song_index_ranges_array
+
+    @property
+    def features(self) -> OnlineDatasetColumn:
+        return OnlineDatasetColumn(self, "features")
+
+    @staticmethod
+    def append_file_type(path: str) -> str:
+        return path + ".json"
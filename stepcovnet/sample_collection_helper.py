@@ -1,11 +1,12 @@
+import io
 from collections import defaultdict
-from os.path import join
+from typing import BinaryIO
 
 import numpy as np
 import resampy
 import soundfile as sf
 
-from stepcovnet import encoder, mel_features, constants
+from stepcovnet import archive, encoder, mel_features, constants
 
 
 def remove_out_of_range(frames: np.ndarray, frame_start: int, frame_end: int):
@@ -26,6 +27,32 @@ def feature_onset_phrase_label_sample_weights(
     # to the last onset. This may affect how models interpret long periods of empty notes.
     frame_start = 0
     frame_end = mfcc.shape[0] - 1
+    mfcc_line = mfcc[frame_start : frame_end + 1, :]
+
+    return (mfcc_line,) + get_frame_labels(
+        frames_onset,
+        mfcc.shape[0],
+        arrows,
+        label_encoded_arrows,
+        binary_encoded_arrows,
+        string_arrows,
+        onehot_encoded_arrows,
+        num_arrow_types,
+    )
+
+
+def get_frame_labels(
+    frames_onset: dict[str, np.ndarray],
+    num_frames: int,
+    arrows: dict[str, np.ndarray],
+    label_encoded_arrows: dict[str, np.ndarray],
+    binary_encoded_arrows: dict[str, np.ndarray],
+    string_arrows: dict[str, np.ndarray],
+    onehot_encoded_arrows: dict[str, np.ndarray],
+    num_arrow_types: int = 4,
+):
+    frame_start = 0
+    frame_end = num_frames - 1
     labels_dict = defaultdict(np.array)
     sample_weights_dict = defaultdict(np.array)
     arrows_dict = defaultdict(np.array)
@@ -97,10 +124,7 @@ def feature_onset_phrase_label_sample_weights(
             "int8"
         )
 
-    mfcc_line = mfcc[frame_start : frame_end + 1, :]
-
     return (
-        mfcc_line,
         labels_dict,
         sample_weights_dict,
         arrows_dict,
@@ -111,14 +135,18 @@ def feature_onset_phrase_label_sample_weights(
     )
 
 
-def timings_parser(timing_file_path: str) -> dict:
+def timings_parser(timing_file_path: str | BinaryIO) -> dict:
     """
     Read each line of timings file and parse arrows and timings
-    :param timing_file_path: str - file name containing note timings
+    :param timing_file_path: str | BinaryIO - file name or binary file-like object containing note timings
     :return: dict - key: difficulty; value: list containing note arrows and timings
     """
 
-    with open(timing_file_path, "r") as file:
+    with (
+        open(timing_file_path, "r")
+        if isinstance(timing_file_path, str)
+        else io.TextIOWrapper(timing_file_path)
+    ) as file:
         data = defaultdict(dict)
         read_timings = False
         curr_difficulty = None
@@ -226,14 +254,65 @@ def get_log_mels(audio_data: np.ndarray, audio_data_sample_rate: int, config: di
         return np.expand_dims(log_mels[0], axis=-1)
 
 
-def get_audio_data(audio_file_path: str) -> np.ndarray:
+def get_num_audio_features(
+    num_audio_samples: int, audio_data_sample_rate: int, config: dict
+) -> int:
+    """
+    Return the number of feature frames get_log_mels produces for an audio file without reading its audio data
+    :param num_audio_samples: int - number of samples per channel in the audio file
+    :param audio_data_sample_rate: int - audio file sample rate
+    :param config: dict - dataset config
+    :return: int - number of feature frames
+    """
+    if audio_data_sample_rate != config["SAMPLE_RATE"]:
+        # Same length as the output of resampy
+        num_audio_samples = int(
+            num_audio_samples
+            * float(config["SAMPLE_RATE"])
+            / float(audio_data_sample_rate)
+        )
+    _, window_length_samples = get_fft_lengths(
+        audio_sample_rate=config["SAMPLE_RATE"],
+        window_length_secs=config["STFT_WINDOW_LENGTH_SECONDS"],
+    )
+    num_log_mels = mel_features.get_num_frames(
+        num_audio_samples,
+        window_length=window_length_samples,
+        hop_length=int(
+            round(config["SAMPLE_RATE"] * config["STFT_HOP_LENGTH_SECONDS"])
+        ),
+    )
+    return mel_features.get_num_frames(
+        num_log_mels, window_length=config["NUM_TIME_BANDS"], hop_length=1
+    )
+
+
+def get_audio_info(audio_file_path: str | BinaryIO) -> tuple[int, int]:
+    """
+    Return the number of samples per channel and sample rate of an audio file without reading its audio data
+    :param audio_file_path: str | BinaryIO - file name or binary file-like object containing audio data
+    :return: num_audio_samples (int): number of samples per channel
+             audio_data_sample_rate (int): audio file sample rate
+    """
+    if isinstance(audio_file_path, str):
+        info = sf.info(audio_file_path)
+    else:
+        with audio_file_path as audio_file:
+            info = sf.info(audio_file)
+    return info.frames, info.samplerate
+
+
+def get_audio_data(audio_file_path: str | BinaryIO) -> np.ndarray:
     """
     Return audio data and sample rate from an audio file
-    :param audio_file_path:
+    :param audio_file_path: str | BinaryIO - file name or binary file-like object containing audio data
     :return: audio_data (np.array): 2-d numpy array containing audio data (frames x channels)
              audio_data_sample_rate (int): audio file sample rate
     """
-    return sf.read(audio_file_path, always_2d=True)
+    if isinstance(audio_file_path, str):
+        return sf.read(audio_file_path, always_2d=True)
+    with audio_file_path as audio_file:
+        return sf.read(audio_file, always_2d=True)
 
 
 def convert_note_data(
@@ -285,10 +364,12 @@ def convert_note_data(
     )
 
 
-def get_audio_features(wav_path: str, file_name: str, config: dict) -> np.ndarray:
+def get_audio_features(
+    wav_path: str | archive.SongArchive, file_name: str, config: dict
+) -> np.ndarray:
     # Read audio data (needs to be a wav)
     audio_data, audio_data_sample_rate = get_audio_data(
-        audio_file_path=join(wav_path, file_name + ".wav")
+        audio_file_path=archive.open_song_file(wav_path, file_name + ".wav")
     )
     # Create log mel features
     log_mel_frames = get_log_mels(
@@ -300,7 +381,7 @@ def get_audio_features(wav_path: str, file_name: str, config: dict) -> np.ndarra
 
 
 def get_labels(
-    note_data_path: str, file_name: str, config: dict
+    note_data_path: str | archive.SongArchive, file_name: str, config: dict
 ) -> tuple[
     dict[str, np.ndarray],
     dict[str, np.ndarray],
@@ -311,7 +392,7 @@ def get_labels(
 ]:
     # Read data from timings file
     note_data = timings_parser(
-        timing_file_path=join(note_data_path, file_name + ".txt")
+        timing_file_path=archive.open_song_file(note_data_path, file_name + ".txt")
     )
     # Parse notes data to get onsets and arrows
     (
@@ -335,7 +416,10 @@ def get_labels(
 
 
 def get_features_and_labels(
-    wav_path: str, note_data_path: str, file_name: str, config: dict
+    wav_path: str | archive.SongArchive,
+    note_data_path: str | archive.SongArchive,
+    file_name: str,
+    config: dict,
 ) -> tuple[
     np.ndarray,
     dict[str, np.ndarray],
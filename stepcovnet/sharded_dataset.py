@@ -0,0 +1,365 @@
+from __future__ import annotations
+
+import glob
+import json
+import os
+from collections.abc import Callable
+
+import h5py
+import numpy as np
+
+from stepcovnet import dataset
+
+
+def get_shard_dataset_name(dataset_name: str, shard_name: str) -> str:
+    return "%s.shard-%s" % (dataset_name, shard_name)
+
+
+def open_shard(dataset_name: str, shard_name: str, **kwargs) -> dataset.ModelDataset:
+    """
+    Create the shard of a writer of a ShardedModelDataset. Each writer appends songs to its own shard, so writers never
+    share a file. The songs are part of the sharded dataset once the shard is closed and the sharded dataset is closed
+    after it, which adds the shard to the index.
+    :param dataset_name: str - sharded dataset name without the file extension
+    :param shard_name: str - name of the shard, unique to the writer
+    :param kwargs: layout and flush policy of the shard, as for ModelDataset; must match the sharded dataset layout
+    :return: ModelDataset - shard to open and dump songs to
+    """
+    return dataset.ModelDataset(
+        get_shard_dataset_name(dataset_name, shard_name), overwrite=True, **kwargs
+    )
+
+
+class ShardRowView(dataset.RowView):
+    """Dataset of a sharded dataset, read from the rows of the shards holding the requested rows"""
+
+    def __init__(
+        self,
+        model_dataset: ShardedModelDataset,
+        get_rows: Callable[[dataset.ModelDataset], h5py.Dataset | dataset.RowView],
+    ):
+        super(ShardRowView, self).__init__(model_dataset)
+        self.get_rows = get_rows
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        return self.model_dataset.read_shard_rows(
+            lambda shard, shard_start, shard_stop: self.get_rows(shard)[
+                shard_start:shard_stop
+            ],
+            start,
+            stop,
+        )
+
+
+class ShardedModelDataset(dataset.ModelDataset):
+    """
+    Dataset split into HDF5 shards that each have a single writer, e.g. one per collection worker, so songs are
+    written in parallel without a central writer and the number of files stays the number of writers.
+
+    Readers see the songs of all shards as one dataset. Shards are ordered by name and songs by the order they were
+    dumped in their shard, so a song index maps to a shard and an offset in it. The index file lists the shards and
+    the layout. It is written when a writable sharded dataset is closed, adding the shards written by other processes
+    with open_shard since it was opened. Songs dumped to the sharded dataset itself go to its own shard, shard_name.
+    """
+
+    def __init__(
+        self,
+        dataset_name: str,
+        overwrite: bool = False,
+        mode: str = "a",
+        difficulty: str = "challenge",
+        shard_name: str = "0",
+        **kwargs,
+    ):
+        super(ShardedModelDataset, self).__init__(
+            dataset_name,
+            overwrite=overwrite,
+            mode=mode,
+            difficulty=difficulty,
+            **kwargs,
+        )
+        if self.swmr:
+            raise ValueError("SWMR mode is only supported by single file datasets")
+        if self.overwrite:
+            for shard_path in self.find_shard_paths():
+                os.remove(shard_path)
+        self.shard_name = shard_name
+        # Layout, caches and flush policy of the shards
+        self.shard_kwargs = kwargs
+        self.shard_names: list[str] = []
+        self.shards: list[dataset.ModelDataset] = []
+        self.song_index_outdated = True
+        self.shard_row_offsets = np.zeros(1, dtype=np.int64)
+        self.shard_song_offsets = np.zeros(1, dtype=np.int64)
+        self.sharded_song_index_ranges = np.zeros((0, 2), dtype=np.int64)
+
+    def __enter__(self) -> ShardedModelDataset:
+        if os.path.isfile(self.dataset_path):
+            with open(self.dataset_path, "r") as index_file:
+                index = json.load(index_file)
+            self.shard_names = index["shards"]
+            self.set_layout(index["layout"])
+        elif self.mode == "r":
+            # Shards written without closing a writable sharded dataset after them
+            self.shard_names = self.find_shard_names()
+            if not self.shard_names:
+                raise FileNotFoundError("Dataset %s not found" % self.dataset_path)
+        else:
+            self.shard_names = []
+        self.shards = [
+            self.open_shard_reader(shard_name).__enter__()
+            for shard_name in self.shard_names
+        ]
+        if not os.path.isfile(self.dataset_path) and self.shards:
+            self.set_label_layout(self.shards[0].label_layout)
+            self.feature_encoding = self.shards[0].feature_encoding
+        self.song_index_outdated = True
+        self.set_difficulty(difficulty=self.difficulty)
+        return self
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+        if self.mode != "r":
+            self.shard_names = sorted(set(self.shard_names + self.find_shard_names()))
+            with open(self.dataset_path, "w") as index_file:
+                json.dump(
+                    {"shards": self.shard_names, "layout": self.layout}, index_file
+                )
+
+    def find_shard_paths(self) -> list[str]:
+        return glob.glob(
+            dataset.ModelDataset.append_file_type(
+                glob.escape(get_shard_dataset_name(self.dataset_name, "")) + "*"
+            )
+        )
+
+    def find_shard_names(self) -> list[str]:
+        shard_prefix = get_shard_dataset_name(self.dataset_name, "")
+        return sorted(
+            os.path.splitext(shard_path)[0][len(shard_prefix) :]
+            for shard_path in self.find_shard_paths()
+        )
+
+    def set_layout(self, layout: dict):
+        self.compression = layout["compression"]
+        self.compression_level = layout["compression_level"]
+        self.shuffle = layout["shuffle"]
+        self.chunk_rows = layout["chunk_rows"]
+        self.set_label_layout(layout["label_layout"])
+        self.feature_encoding = layout["feature_encoding"]
+
+    def open_shard_reader(self, shard_name: str) -> dataset.ModelDataset:
+        return dataset.ModelDataset(
+            get_shard_dataset_name(self.dataset_name, shard_name),
+            difficulty=self.difficulty,
+            **self.shard_kwargs,
+        )
+
+    def dump(self, *args, **kwargs):
+        if self.mode == "r":
+            raise ValueError("Dataset %s is opened read-only" % self.dataset_path)
+        if self.shard_name not in self.shard_names:
+            shard = open_shard(
+                self.dataset_name, self.shard_name, **self.shard_kwargs
+            ).__enter__()
+            shard.set_difficulty(self.difficulty)
+            self.shard_names.append(self.shard_name)
+            self.shards.append(shard)
+        self.shards[self.shard_names.index(self.shard_name)].dump(*args, **kwargs)
+        self.song_index_outdated = True
+
+    def update_song_index(self):
+        """Map the songs and rows of the shards to the songs and rows of the sharded dataset"""
+        if not self.song_index_outdated:
+            return
+        self.order_shards()
+        shard_song_index_ranges = [
+            (
+                shard.song_index_ranges[:]
+                if len(shard) > 0
+                else np.zeros((0, 2), dtype=np.int64)
+            )
+            for shard in self.shards
+        ]
+        self.shard_row_offsets = np.cumsum(
+            [0] + [len(shard) for shard in self.shards], dtype=np.int64
+        )
+        self.shard_song_offsets = np.cumsum(
+            [0]
+            + [len(song_index_ranges) for song_index_ranges in shard_song_index_ranges],
+            dtype=np.int64,
+        )
+        self.sharded_song_index_ranges = np.concatenate(
+            [np.zeros((0, 2), dtype=np.int64)]
+            + [
+                song_index_ranges + row_offset
+                for song_index_ranges, row_offset in zip(
+                    shard_song_index_ranges, self.shard_row_offsets
+                )
+            ]
+        )
+        self.song_index_outdated = False
+
+    def order_shards(self):
+        # Shards are ordered by name, wherever a shard dumped to since opening was added
+        order = np.argsort(self.shard_names, kind="stable")
+        self.shard_names = [self.shard_names[i] for i in order]
+        self.shards = [self.shards[i] for i in order]
+
+    def get_song_shard(self, song_index: int) -> tuple[dataset.ModelDataset, int]:
+        """
+        Find the shard of a song
+        :param song_index: int - index of the song in the sharded dataset
+        :return: tuple[ModelDataset, int] - shard and index of the song in the shard
+        """
+        self.update_song_index()
+        if not 0 <= song_index < self.shard_song_offsets[-1]:
+            raise IndexError("Song %d is out of range" % song_index)
+        shard_index = (
+            int(np.searchsorted(self.shard_song_offsets, song_index, side="right")) - 1
+        )
+        return (
+            self.shards[shard_index],
+            song_index - int(self.shard_song_offsets[shard_index]),
+        )
+
+    def read_shard_rows(
+        self,
+        read_rows: Callable[[dataset.ModelDataset, int, int], np.ndarray],
+        start: int,
+        stop: int,
+    ) -> np.ndarray:
+        """
+        Read rows of the sharded dataset from the shards holding them
+        :param read_rows: Callable - reads rows [start, stop) of a shard
+        :param start: int - first row
+        :param stop: int - row after the last row
+        :return: np.ndarray - rows [start, stop)
+        """
+        self.update_song_index()
+        rows = []
+        first_shard = np.searchsorted(self.shard_row_offsets[1:], start, side="right")
+        last_shard = np.searchsorted(self.shard_row_offsets[:-1], stop)
+        for shard_index in range(first_shard, last_shard):
+            row_offset = int(self.shard_row_offsets[shard_index])
+            rows.append(
+                read_rows(
+                    self.shards[shard_index],
+                    max(start - row_offset, 0),
+                    min(stop, int(self.shard_row_offsets[shard_index + 1]))
+                    - row_offset,
+                )
+            )
+        if not rows:
+            if not self.shards:
+                return np.zeros(0)
+            return read_rows(self.shards[0], 0, 0)
+        return rows[0] if len(rows) == 1 else np.concatenate(rows)
+
+    def read_features(
+        self, start: int, stop: int, scalers: list | None = None
+    ) -> np.ndarray:
+        return self.read_shard_rows(
+            lambda shard, shard_start, shard_stop: shard.read_features(
+                shard_start, shard_stop, scalers=scalers
+            ),
+            start,
+            stop,
+        )
+
+    def read_song(self, song_index: int) -> dict:
+        shard, shard_song_index = self.get_song_shard(song_index)
+        return shard.read_song(shard_song_index)
+
+    def get_available_difficulties(self, song_index: int) -> list[str]:
+        shard, shard_song_index = self.get_song_shard(song_index)
+        return shard.get_available_difficulties(shard_song_index)
+
+    def get_song_index(self, file_name: str) -> int:
+        self.update_song_index()
+        # The last one dumped is in the last shard holding the song
+        for shard_index in reversed(range(len(self.shards))):
+            if len(self.shards[shard_index]) == 0:
+                continue
+            try:
+                return int(self.shard_song_offsets[shard_index]) + self.shards[
+                    shard_index
+                ].get_song_index(file_name)
+            except KeyError:
+                continue
+        raise KeyError("Song %s not found in dataset" % file_name)
+
+    def get_song_stats(self) -> dict[str, np.ndarray] | None:
+        shard_song_stats = [
+            shard.get_song_stats() for shard in self.shards if len(shard) > 0
+        ]
+        if not shard_song_stats or any(
+            song_stats is None for song_stats in shard_song_stats
+        ):
+            return None
+        return {
+            dataset_name: np.concatenate(
+                [song_stats[dataset_name] for song_stats in shard_song_stats]
+            )
+            for dataset_name in shard_song_stats[0]
+        }
+
+    def set_read_order(self, song_indexes: list[int] | np.ndarray):
+        # Each shard reads its own songs ahead, in the order they are read in the sharded dataset
+        self.update_song_index()
+        song_indexes = np.asarray(song_indexes, dtype=np.int64)
+        shard_indexes = (
+            np.searchsorted(self.shard_song_offsets, song_indexes, side="right") - 1
+        )
+        for shard_index, shard in enumerate(self.shards):
+            shard.set_read_order(
+                song_indexes[shard_indexes == shard_index]
+                - self.shard_song_offsets[shard_index]
+            )
+
+    def set_difficulty(self, difficulty: str):
+        super(ShardedModelDataset, self).set_difficulty(difficulty)
+        for shard in self.shards:
+            shard.set_difficulty(difficulty)
+
+    def get_label_dataset(self, dataset_name: str) -> ShardRowView:
+        return ShardRowView(self, lambda shard: shard.get_label_dataset(dataset_name))
+
+    def get_label_stats(self, difficulty: str) -> dict:
+        label_stats = {}
+        for shard in self.shards:
+            if len(shard) == 0:
+                continue
+            for stat, value in shard.get_label_stats(difficulty).items():
+                label_stats[stat] = label_stats.get(stat, 0) + value
+        return label_stats
+
+    @property
+    def num_samples(self) -> int:
+        self.update_song_index()
+        return int(self.shard_row_offsets[-1])
+
+    @property
+    def file_names(self) -> list[str]:
+        self.update_song_index()
+        return [
+            file_name
+            for shard in self.shards
+            if len(shard) > 0
+            for file_name in shard.file_names
+        ]
+
+    @property
+    def song_index_ranges(self) -> np.ndarray:
+        self.update_song_index()
+        return self.sharded_song_index_ranges
+
+    @property
+    def features(self) -> ShardRowView:
+        return ShardRowView(self, lambda shard: shard.features)
+
+    @staticmethod
+    def append_file_type(path: str) -> str:
+        return path + ".shards.json"
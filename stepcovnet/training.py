@@ -3,7 +3,7 @@ from collections import defaultdict
 import numpy as np
 from keras import metrics, losses, optimizers
 
-from stepcovnet import data, utils
+from stepcovnet import data, dataset_pool, utils
 
 
 class TrainingHyperparameters:
@@ -68,9 +68,13 @@ class TrainingFeatureGenerator(object):
         warmup=False,
         shuffle=True,
         tokenizer_name=None,
+        dataset_kwargs=None,
+        follow_new_songs=False,
+        known_songs=None,
     ):
         self.dataset_path = dataset_path
         self.dataset_type = dataset_type
+        self.dataset_kwargs = {} if dataset_kwargs is None else dataset_kwargs
         self.train_indexes = indexes
         self.num_samples = num_samples
         self.scalers = scalers
@@ -88,21 +92,32 @@ class TrainingFeatureGenerator(object):
         self.rng = np.random.default_rng(42)
         # add shuffling
 
+        # Songs a writer in SWMR mode adds to the dataset after the known songs are added to the indexes between epochs
+        self.follow_new_songs = follow_new_songs
+        self.known_songs = known_songs
+
     def __len__(self):
         return int(np.ceil(self.num_samples / self.batch_size))
 
     def __call__(self):
-        with self.dataset_type(self.dataset_path) as dataset:
-            dataset.set_difficulty(self.difficulty)
+        with dataset_pool.DATASET_POOL.open(
+            self.dataset_type,
+            self.dataset_path,
+            difficulty=self.difficulty,
+            **self.dataset_kwargs,
+        ) as dataset:
             self.song_index = 0
             self.song_start_index = None
             new_song = True
             if self.shuffle:
                 self.rng.shuffle(self.train_indexes)
+            dataset.set_read_order(self.train_indexes)
             while True:
                 features = defaultdict(lambda: np.array([]))
                 if self.song_index >= len(self.train_indexes):
                     self.song_index = 0
+                    if self.follow_new_songs:
+                        self.add_new_songs(dataset)
                 song_start_index, song_end_index = dataset.song_index_ranges[
                     self.train_indexes[self.song_index]
                 ]
@@ -148,9 +163,10 @@ class TrainingFeatureGenerator(object):
                             arrows, mask_padding_value, lookback_padding_added
                         )
 
-                    audio_data = dataset.features[
-                        lookback_index_padding_start:end_index
-                    ]
+                    # Scaling the rows before building the lookback windows scales each row once
+                    audio_data = dataset.read_features(
+                        lookback_index_padding_start, end_index, scalers=self.scalers
+                    )
                     audio_features = self.get_audio_features(
                         audio_data, lookback_padding_added
                     )
@@ -189,16 +205,34 @@ class TrainingFeatureGenerator(object):
                     self.song_index += 1
 
                 if len(features["y_batch"]) > 0:
-                    scaled_audio_features = utils.apply_timeseries_scalers(
-                        features=features["audio_features"], scalers=self.scalers
-                    )
                     x_batch = {
                         "arrow_input": features["arrow_features"],
                         "arrow_mask": features["arrow_mask"],
-                        "audio_input": scaled_audio_features,
+                        "audio_input": features["audio_features"],
                     }
                     yield x_batch, features["y_batch"], features["sample_weights_batch"]
 
+    def add_new_songs(self, dataset):
+        dataset.refresh()
+        num_songs = len(dataset.song_index_ranges)
+        known_songs = num_songs if self.known_songs is None else self.known_songs
+        new_indexes = np.array(
+            [
+                song_index
+                for song_index in range(known_songs, num_songs)
+                if self.difficulty in dataset.get_available_difficulties(song_index)
+            ],
+            dtype=int,
+        )
+        self.known_songs = num_songs
+        if len(new_indexes) == 0:
+            return
+        if self.shuffle:
+            self.rng.shuffle(new_indexes)
+        self.train_indexes = np.concatenate([self.train_indexes, new_indexes])
+        dataset.set_read_order(self.train_indexes)
+        print("Added %d new songs to the training songs" % len(new_indexes))
+
     @staticmethod
     def append_existing_data(
         features, arrow_features, arrow_mask, audio_features, arrows, sample_weights
@@ -280,10 +314,15 @@ class TrainingFeatureGenerator(object):
         return arrow_features.astype(np.int32), arrow_mask.astype(np.int32)
 
     def get_audio_features(self, audio_data, lookback_padding_added):
+        # Features are scaled before building the windows, so the windows at the start of a song are padded with
+        # scaled zero rows instead of the zero rows added by the ngrams
+        padding = np.zeros((self.lookback,) + audio_data.shape[1:])
+        if self.scalers is not None:
+            padding = utils.apply_scalers(features=padding, scalers=self.scalers)
         audio_features, _ = utils.get_samples_ngram_with_mask(
-            audio_data, self.lookback, squeeze=False
+            np.concatenate((padding, audio_data), axis=0), self.lookback, squeeze=False
         )
-        audio_features = audio_features[lookback_padding_added:]
+        audio_features = audio_features[self.lookback + lookback_padding_added :]
         audio_features = audio_features[1:]
 
         return audio_features.astype(np.float64)
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import json
+import os
+
+from stepcovnet import dataset, sharded_dataset
+
+# Datasets that can be members of a union, by their name in data.ModelDatasetTypes
+MEMBER_DATASET_TYPES = {
+    "SINGULAR_DATASET": dataset.ModelDataset,
+    "DISTRIBUTED_DATASET": dataset.DistributedModelDataset,
+    "SHARDED_DATASET": sharded_dataset.ShardedModelDataset,
+}
+
+
+def create_union(dataset_name: str, members: list[tuple[str, str]]):
+    """
+    Write the index of a UnionModelDataset. The member datasets are not read or copied.
+    :param dataset_name: str - union dataset name without the file extension
+    :param members: list[tuple[str, str]] - dataset type name and dataset name without the file extension of each
+                    member, in the order their songs are read in
+    """
+    union_dir = os.path.dirname(os.path.abspath(dataset_name))
+    index_members = []
+    for type_name, member_name in members:
+        if type_name not in MEMBER_DATASET_TYPES:
+            raise ValueError(
+                "%s cannot be a member of a union dataset. Choose one of: %s"
+                % (type_name, list(MEMBER_DATASET_TYPES))
+            )
+        member_path = MEMBER_DATASET_TYPES[type_name].append_file_type(member_name)
+        if not os.path.isfile(member_path):
+            raise FileNotFoundError("Dataset %s not found" % member_path)
+        # Relative paths keep the union valid when it is moved along with its members
+        index_members.append(
+            {
+                "dataset_type": type_name,
+                "dataset_name": os.path.relpath(
+                    os.path.abspath(member_name), union_dir
+                ),
+            }
+        )
+    with open(UnionModelDataset.append_file_type(dataset_name), "w") as index_file:
+        json.dump({"members": index_members}, index_file)
+
+
+class UnionModelDataset(sharded_dataset.ShardedModelDataset):
+    """
+    Read-only dataset of the songs of several datasets, e.g. one per chart pack, without copying them. Songs are
+    ordered by member and by their order in the member, and reads are delegated to the members holding the rows like
+    the shards of a sharded dataset. Members keep their own layout, so they only need the same features shape.
+
+    The index file lists the members, created with create_union.
+    """
+
+    def __init__(
+        self,
+        dataset_name: str,
+        overwrite: bool = False,
+        mode: str = "r",
+        difficulty: str = "challenge",
+        **kwargs,
+    ):
+        if overwrite:
+            raise ValueError(
+                "Union datasets are read-only. Create them with create_union."
+            )
+        super(UnionModelDataset, self).__init__(
+            dataset_name, mode=mode, difficulty=difficulty, **kwargs
+        )
+        self.member_types: list[type[dataset.ModelDataset]] = []
+
+    def __enter__(self) -> UnionModelDataset:
+        if not os.path.isfile(self.dataset_path):
+            raise FileNotFoundError("Dataset %s not found" % self.dataset_path)
+        with open(self.dataset_path, "r") as index_file:
+            index = json.load(index_file)
+        union_dir = os.path.dirname(os.path.abspath(self.dataset_path))
+        self.shard_names = [
+            os.path.normpath(os.path.join(union_dir, member["dataset_name"]))
+            for member in index["members"]
+        ]
+        self.member_types = [
+            MEMBER_DATASET_TYPES[member["dataset_type"]] for member in index["members"]
+        ]
+        self.shards = [
+            member_type(
+                member_name, difficulty=self.difficulty, **self.shard_kwargs
+            ).__enter__()
+            for member_type, member_name in zip(self.member_types, self.shard_names)
+        ]
+        frame_shapes = {
+            member_name: member.features[0:0].shape[1:]
+            for member_name, member in zip(self.shard_names, self.shards)
+            if len(member) > 0
+        }
+        if len(set(frame_shapes.values())) > 1:
+            self.close()
+            raise ValueError(
+                "Members of a union dataset must have the same features shape: %s"
+                % frame_shapes
+            )
+        # Layout of the first member, which is only informative since each member reads its own layout
+        if self.shards:
+            self.set_label_layout(self.shards[0].label_layout)
+            self.feature_encoding = self.shards[0].feature_encoding
+        self.song_index_outdated = True
+        self.set_difficulty(difficulty=self.difficulty)
+        return self
+
+    def order_shards(self):
+        # Members keep the order of the index
+        pass
+
+    @staticmethod
+    def append_file_type(path: str) -> str:
+        return path + ".union.json"
@@ -23,6 +23,30 @@ def get_filename(file_path: str, with_ext: bool = True) -> str:
         return os.path.splitext(os.path.basename(file_path))[0]
 
 
+# Collections name their dataset after its type, by its name in data.ModelDatasetTypes. Datasets of other types end
+# with _dataset.
+DATASET_NAME_POSTFIXES = {
+    "DISTRIBUTED_DATASET": "_distributed_dataset",
+    "SHARDED_DATASET": "_sharded_dataset",
+}
+
+
+def get_dataset_name(name_prefix: str, type_name: str) -> str:
+    return name_prefix + DATASET_NAME_POSTFIXES.get(type_name, "_dataset")
+
+
+def get_dataset_path(input_path: str, metadata: dict) -> str:
+    """
+    Path of the dataset saved in a training data path
+    :param input_path: str - training data path
+    :param metadata: dict - contents of the metadata.json saved with the dataset
+    :return: str - dataset path without the file extension
+    """
+    return os.path.join(
+        input_path, get_dataset_name(metadata["dataset_name"], metadata["dataset_type"])
+    )
+
+
 def standardize_filename(filename: str) -> str:
     return re.sub(" ", "_", re.sub("[^a-z0-9-_ ]", "", filename.lower()))
 
@@ -93,6 +117,88 @@ def get_channel_scalers(
     return channel_scalers
 
 
+def get_feature_moments(features: np.ndarray[float]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Mean and variance of each feature over the frames of a song, to combine songs with get_channel_scalers_from_moments
+    :param features: np.ndarray - features of a song; frames on the first axis
+    :return: tuple[np.ndarray, np.ndarray] - float64 mean and variance with the shape of a frame
+    """
+    features = np.asarray(features, dtype=np.float64)
+    return features.mean(axis=0), features.var(axis=0)
+
+
+def get_channel_scalers_from_moments(
+    num_frames: np.ndarray[int], means: np.ndarray[float], variances: np.ndarray[float]
+) -> list[StandardScaler] | None:
+    """
+    Build the scalers get_channel_scalers would fit on the features of several songs from the moments of each song
+    :param num_frames: np.ndarray - number of frames of each song
+    :param means: np.ndarray - mean of each song from get_feature_moments; shape (songs, time, freq, channels)
+    :param variances: np.ndarray - variance of each song from get_feature_moments
+    :return: list[StandardScaler] - scaler of each channel, or None if there are no songs
+    """
+    if len(num_frames) == 0:
+        return None
+    weights = np.asarray(num_frames, dtype=np.float64).reshape(
+        (-1,) + (1,) * (means.ndim - 1)
+    )
+    total_frames = int(np.sum(num_frames))
+    mean = (weights * means).sum(axis=0) / total_frames
+    # Pooled variance: variance within each song plus the variance of the song means
+    variance = (weights * (variances + (means - mean) ** 2)).sum(axis=0) / total_frames
+    mean = mean.reshape((-1, mean.shape[-1]))
+    variance = variance.reshape((-1, variance.shape[-1]))
+    channel_scalers = []
+    for i in range(mean.shape[-1]):
+        scaler = StandardScaler()
+        scaler.mean_ = mean[:, i]
+        scaler.var_ = variance[:, i]
+        # Same detection of constant features as StandardScaler, which are left unscaled
+        eps = np.finfo(np.float64).eps
+        constant = (
+            scaler.var_
+            <= total_frames * eps * scaler.var_
+            + (total_frames * scaler.mean_ * eps) ** 2
+        )
+        scaler.scale_ = np.where(constant, 1.0, np.sqrt(scaler.var_))
+        scaler.n_samples_seen_ = total_frames
+        scaler.n_features_in_ = mean.shape[0]
+        channel_scalers.append(scaler)
+    return channel_scalers
+
+
+def merge_channel_scalers(
+    all_scalers: list[list[StandardScaler]],
+) -> list[StandardScaler] | None:
+    """
+    Build the scalers get_channel_scalers would fit on the features of several datasets from the fitted scalers of each
+    dataset, whose means, variances and sample counts are the moments of their features
+    :param all_scalers: list[list[StandardScaler]] - scalers of each channel of each dataset
+    :return: list[StandardScaler] - scaler of each channel, or None if there are no datasets
+    """
+    if not all_scalers:
+        return None
+    if len({len(scalers) for scalers in all_scalers}) > 1:
+        raise ValueError("Scalers of the datasets have different numbers of channels")
+    num_frames = np.array(
+        [int(np.max(scalers[0].n_samples_seen_)) for scalers in all_scalers]
+    )
+    # Shape (datasets, time and frequency bands, channels), as the song moments flattened by frame
+    means = np.stack(
+        [
+            np.stack([scaler.mean_ for scaler in scalers], axis=-1)
+            for scalers in all_scalers
+        ]
+    )
+    variances = np.stack(
+        [
+            np.stack([scaler.var_ for scaler in scalers], axis=-1)
+            for scalers in all_scalers
+        ]
+    )
+    return get_channel_scalers_from_moments(num_frames, means, variances)
+
+
 def apply_timeseries_scalers(
     features: np.ndarray[float], scalers: StandardScaler | list[StandardScaler]
 ) -> np.ndarray[float]:
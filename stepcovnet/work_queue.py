@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+
+def create_exclusive(path: str, content: str) -> bool:
+    # Write to a private temporary file first and hard link it into place. Linking fails if the target already exists
+    # and is atomic on local filesystems and NFS alike, so readers never see partially written files.
+    tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+    with open(tmp_path, "w") as tmp_file:
+        tmp_file.write(content)
+    try:
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(tmp_path)
+
+
+def read_json(path: str) -> dict | list | None:
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+class SharedWorkQueue:
+    """Song work queue shared by collectors through a common job directory.
+
+    Songs are claimed with lease files created atomically in the job directory, so collectors running on one host or
+    on several hosts sharing the directory (e.g. over NFS) never collect the same song at the same time. Held leases
+    are renewed by a heartbeat thread. Leases that have not been renewed for `lease_seconds` are considered abandoned
+    by a crashed collector and can be taken over by any other collector.
+    """
+
+    def __init__(
+        self,
+        job_dir: str,
+        worker_id: str | None = None,
+        lease_seconds: float = 600.0,
+    ):
+        if lease_seconds <= 0:
+            raise ValueError("Lease duration must be > 0 seconds")
+        self.job_dir = job_dir
+        self.worker_id = (
+            worker_id
+            if worker_id is not None
+            else "%s_%d" % (socket.gethostname(), os.getpid())
+        )
+        self.lease_seconds = lease_seconds
+        self.token = uuid.uuid4().hex
+        self.jobs_path = os.path.join(job_dir, "jobs.json")
+        self.leases_path = os.path.join(job_dir, "leases")
+        self.done_path = os.path.join(job_dir, "done")
+        self.shards_path = os.path.join(job_dir, "shards")
+        self.job_names: list[str] = []
+        self.held_leases: set[int] = set()
+        self.lock = threading.Lock()
+        self.heartbeat_stop = threading.Event()
+        self.heartbeat_thread: threading.Thread | None = None
+
+    def __enter__(self) -> SharedWorkQueue:
+        self.heartbeat_stop.clear()
+        self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+        self.heartbeat_thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.heartbeat_stop.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        for job_index in list(self.held_leases):
+            self.release(job_index)
+
+    def initialize(self, job_names: list[str]):
+        """Create the job directory layout. The first collector to initialize the queue decides the job list."""
+        for path in [self.job_dir, self.leases_path, self.done_path, self.shards_path]:
+            os.makedirs(path, exist_ok=True)
+        create_exclusive(self.jobs_path, json.dumps(list(job_names)))
+        self.load()
+
+    def load(self):
+        job_names = read_json(self.jobs_path)
+        if job_names is None:
+            raise FileNotFoundError(
+                "Job directory %s has not been initialized"
+                % os.path.abspath(self.job_dir)
+            )
+        self.job_names = job_names
+
+    def claim(self) -> tuple[int, str] | None:
+        """Lease the next song that is neither done nor leased by a live collector"""
+        done_job_indexes = self.done_job_indexes()
+        for job_index, job_name in enumerate(self.job_names):
+            if job_index in done_job_indexes or job_index in self.held_leases:
+                continue
+            if self.acquire(job_index):
+                # The song may have been completed, and its lease released, after the done markers were listed
+                if os.path.isfile(self.get_done_path(job_index)):
+                    self.release(job_index)
+                    continue
+                return job_index, job_name
+        return None
+
+    def acquire(self, job_index: int) -> bool:
+        lease_path = self.get_lease_path(job_index)
+        if create_exclusive(lease_path, self.lease_content):
+            with self.lock:
+                self.held_leases.add(job_index)
+            return True
+        try:
+            lease_stat = os.stat(lease_path)
+        except FileNotFoundError:
+            return False
+        if time.time() - lease_stat.st_mtime < self.lease_seconds:
+            return False
+        # Lease expired. Move it aside before replacing it so only one collector can take it over.
+        tombstone_path = "%s.%s.expired" % (lease_path, uuid.uuid4().hex)
+        try:
+            os.rename(lease_path, tombstone_path)
+        except FileNotFoundError:
+            return False
+        try:
+            if os.stat(tombstone_path).st_mtime_ns != lease_stat.st_mtime_ns:
+                # The lease was renewed or replaced after we checked it. Put it back for its owner.
+                try:
+                    os.link(tombstone_path, lease_path)
+                except FileExistsError:
+                    pass
+                return False
+        finally:
+            os.remove(tombstone_path)
+        return self.acquire(job_index)
+
+    def renew(self) -> list[int]:
+        """Renew all held leases and return the job indexes of leases lost to other collectors"""
+        lost_job_indexes = []
+        with self.lock:
+            for job_index in list(self.held_leases):
+                lease_path = self.get_lease_path(job_index)
+                lease = read_json(lease_path)
+                if lease is None or lease.get("token") != self.token:
+                    self.held_leases.remove(job_index)
+                    lost_job_indexes.append(job_index)
+                    continue
+                try:
+                    os.utime(lease_path)
+                except FileNotFoundError:
+                    self.held_leases.remove(job_index)
+                    lost_job_indexes.append(job_index)
+        return lost_job_indexes
+
+    def heartbeat(self):
+        while not self.heartbeat_stop.wait(self.lease_seconds / 3):
+            for job_index in self.renew():
+                print(
+                    "[WARN] Lease lost for %s. Another collector may collect it again."
+                    % self.job_names[job_index]
+                )
+
+    def release(self, job_index: int):
+        with self.lock:
+            if job_index not in self.held_leases:
+                return
+            self.held_leases.remove(job_index)
+            lease_path = self.get_lease_path(job_index)
+            lease = read_json(lease_path)
+            if lease is not None and lease.get("token") == self.token:
+                try:
+                    os.remove(lease_path)
+                except FileNotFoundError:
+                    pass
+
+    def complete(self, job_index: int, shard_name: str | None) -> bool:
+        """
+        Mark a song as done and release its lease
+        :param job_index: int - index of the song in the job list
+        :param shard_name: str - name of the shard the song was written to; None if the song failed to collect
+        :return: bool - False if another collector already completed the song
+        """
+        done = create_exclusive(
+            self.get_done_path(job_index),
+            json.dumps(
+                {
+                    "name": self.job_names[job_index],
+                    "shard": shard_name,
+                    "worker_id": self.worker_id,
+                }
+            ),
+        )
+        self.release(job_index)
+        return done
+
+    def done_job_indexes(self) -> set[int]:
+        return {
+            int(file_name[: -len(".json")])
+            for file_name in os.listdir(self.done_path)
+            if file_name.endswith(".json")
+        }
+
+    def completed_jobs(self) -> dict[int, dict]:
+        return {
+            job_index: read_json(self.get_done_path(job_index))
+            for job_index in sorted(self.done_job_indexes())
+        }
+
+    def is_finished(self) -> bool:
+        return len(self.done_job_indexes()) >= len(self.job_names)
+
+    def new_shard_name(self) -> str:
+        return "%s_%s" % (self.worker_id, self.token[:8])
+
+    def get_shard_path(self, shard_name: str) -> str:
+        return os.path.join(self.shards_path, shard_name)
+
+    def get_lease_path(self, job_index: int) -> str:
+        return os.path.join(self.leases_path, "%d.lease" % job_index)
+
+    def get_done_path(self, job_index: int) -> str:
+        return os.path.join(self.done_path, "%d.json" % job_index)
+
+    @property
+    def lease_content(self) -> str:
+        return json.dumps(
+            {
+                "worker_id": self.worker_id,
+                "token": self.token,
+                "hostname": socket.gethostname(),
+                "pid": os.getpid(),
+            }
+        )
@@ -0,0 +1,29 @@
+import os
+import sys
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.affinity import get_numa_nodes, parse_cpu_list, plan_worker_cpus
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpu_list("") == []
+
+
+def test_plan_worker_cpus_spreads_across_numa_nodes():
+    numa_nodes = [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert plan_worker_cpus(2, numa_nodes) == [[0, 1, 2, 3], [4, 5, 6, 7]]
+    assert plan_worker_cpus(4, numa_nodes) == [[0, 1], [4, 5], [2, 3], [6, 7]]
+    assert plan_worker_cpus(3, numa_nodes) == [[0, 1], [4, 5, 6, 7], [2, 3]]
+
+
+def test_plan_worker_cpus_with_more_workers_than_cpus():
+    assert plan_worker_cpus(3, [[0, 1]]) == [[0], [1], [0]]
+
+
+def test_get_numa_nodes_covers_allowed_cpus():
+    numa_nodes = get_numa_nodes()
+    assert numa_nodes
+    assert all(numa_nodes)
@@ -0,0 +1,62 @@
+import os
+import sys
+import tarfile
+import zipfile
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.archive import SongArchive, get_song_path, is_archive
+
+TEST_DATA_PATH = os.path.relpath("tests/data/")
+TEST_FILES = ["tide.ogg", "tide.txt"]
+
+
+def build_archive(archive_path: str) -> str:
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path, "w") as zip_file:
+            zip_file.write(
+                os.path.join(TEST_DATA_PATH, TEST_FILES[0]),
+                "pack/tide/" + TEST_FILES[0],
+                compress_type=zipfile.ZIP_STORED,
+            )
+            zip_file.write(
+                os.path.join(TEST_DATA_PATH, TEST_FILES[1]),
+                "pack/tide/" + TEST_FILES[1],
+                compress_type=zipfile.ZIP_DEFLATED,
+            )
+    else:
+        with tarfile.open(archive_path, "w:gz" if archive_path.endswith(".gz") else "w") as tar_file:
+            for file_name in TEST_FILES:
+                tar_file.add(os.path.join(TEST_DATA_PATH, file_name), "pack/tide/" + file_name)
+    return archive_path
+
+
+@pytest.mark.parametrize("archive_name", ["pack.zip", "pack.tar", "pack.tar.gz"])
+def test_archive_members_match_files(tmp_path, archive_name):
+    archive_path = build_archive(os.path.join(tmp_path, archive_name))
+    assert is_archive(archive_path)
+    song_archive = get_song_path(archive_path)
+    assert isinstance(song_archive, SongArchive)
+    assert sorted(song_archive.get_filenames()) == TEST_FILES
+    for file_name in TEST_FILES:
+        with song_archive.open(file_name) as member, open(os.path.join(TEST_DATA_PATH, file_name), "rb") as file:
+            assert member.read() == file.read()
+
+
+def test_audio_read_from_archive(tmp_path):
+    song_archive = SongArchive(build_archive(os.path.join(tmp_path, "pack.zip")))
+    expected_audio_data, expected_sample_rate = sf.read(os.path.join(TEST_DATA_PATH, TEST_FILES[0]))
+    with song_archive.open(TEST_FILES[0]) as member:
+        audio_data, sample_rate = sf.read(member)
+    assert sample_rate == expected_sample_rate
+    assert np.array_equal(audio_data, expected_audio_data)
+
+
+def test_directory_is_not_archive():
+    assert not is_archive(TEST_DATA_PATH)
+    assert get_song_path(TEST_DATA_PATH) == TEST_DATA_PATH
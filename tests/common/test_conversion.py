@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.conversion import convert_dataset, verify_conversion
+from stepcovnet.dataset import DistributedModelDataset, ModelDataset
+from stepcovnet.sharded_dataset import ShardedModelDataset
+from stepcovnet.utils import get_dataset_path
+from test_dataset import TEST_SONGS, assert_song_equal, build_dataset, build_song_data
+
+
+@pytest.mark.parametrize("cores", [1, 2])
+def test_convert_distributed_dataset_to_single_dataset(tmp_path, cores):
+    source_path = os.path.join(tmp_path, "source")
+    target_path = os.path.join(tmp_path, "target")
+    build_dataset(DistributedModelDataset, source_path, TEST_SONGS)
+    with ModelDataset(target_path, overwrite=True, label_layout="compact", chunk_rows=16) as target_dataset:
+        convert_dataset(DistributedModelDataset, source_path, target_dataset, cores=cores)
+    with ModelDataset(target_path) as target_dataset:
+        assert target_dataset.label_layout == "compact"
+        assert target_dataset.h5py_file["features"].chunks[0] == 16
+        assert target_dataset.file_names == ["song_a", "song_b", "song_c"]
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(target_dataset.read_song(song_index), expected_song_data)
+
+
+def test_convert_to_quantized_features(tmp_path):
+    source_path = os.path.join(tmp_path, "source")
+    target_path = os.path.join(tmp_path, "target")
+    build_dataset(ModelDataset, source_path, TEST_SONGS, label_layout="sparse")
+    with DistributedModelDataset(target_path, overwrite=True, feature_encoding="uint8") as target_dataset:
+        convert_dataset(ModelDataset, source_path, target_dataset)
+    with DistributedModelDataset(target_path) as target_dataset, ModelDataset(source_path) as source_dataset:
+        assert target_dataset.feature_encoding == "uint8"
+        assert np.abs(target_dataset.features[:] - source_dataset.features[:]).max() < 1 / 255
+        assert np.array_equal(target_dataset.labels[:], source_dataset.labels[:])
+
+
+def test_convert_single_dataset_to_sharded_dataset(tmp_path):
+    source_path = os.path.join(tmp_path, "source")
+    target_path = os.path.join(tmp_path, "target")
+    build_dataset(ModelDataset, source_path, TEST_SONGS)
+    with ShardedModelDataset(target_path, overwrite=True, label_layout="sparse") as target_dataset:
+        convert_dataset(ModelDataset, source_path, target_dataset, cores=2)
+    with ShardedModelDataset(target_path) as target_dataset:
+        assert target_dataset.label_layout == "sparse"
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(target_dataset.read_song(song_index), expected_song_data)
+
+
+def test_verify_conversion(tmp_path):
+    source_path = os.path.join(tmp_path, "source")
+    target_path = os.path.join(tmp_path, "target")
+    build_dataset(ModelDataset, source_path, TEST_SONGS)
+    build_dataset(ModelDataset, target_path, TEST_SONGS[:2] + [build_song_data("song_c", 40, ["hard"], seed=3)])
+    file_names = [song_data["file_names"] for song_data in TEST_SONGS]
+    with ModelDataset(source_path) as source_dataset, ModelDataset(target_path) as target_dataset:
+        # Same rows and songs but different labels
+        with pytest.raises(ValueError):
+            verify_conversion(source_dataset, target_dataset, file_names)
+    build_dataset(ModelDataset, target_path, TEST_SONGS[:2])
+    with ModelDataset(source_path) as source_dataset, ModelDataset(target_path) as target_dataset:
+        with pytest.raises(ValueError):
+            verify_conversion(source_dataset, target_dataset, file_names)
+
+
+def write_collected_dataset(input_path: str, dataset_type, type_name: str) -> dict:
+    # Training data path laid out like the output of training_data_collection
+    metadata = {"dataset_name": "stepcovnet", "dataset_type": type_name, "config": {}}
+    os.makedirs(input_path)
+    build_dataset(dataset_type, get_dataset_path(input_path, metadata), TEST_SONGS)
+    with open(os.path.join(input_path, "metadata.json"), "w") as json_file:
+        json.dump(metadata, json_file)
+    return metadata
+
+
+def test_dataset_converter_reads_collected_dataset(tmp_path):
+    # The data module needs transformers, which only the training environment has
+    dataset_converter = pytest.importorskip("dataset_converter")
+    input_path = os.path.join(tmp_path, "stepcovnet_distributed_dataset")
+    output_path = os.path.join(tmp_path, "converted")
+    assert get_dataset_path(
+        input_path, write_collected_dataset(input_path, DistributedModelDataset, "DISTRIBUTED_DATASET")
+    ) == os.path.join(input_path, "stepcovnet_distributed_dataset")
+    dataset_converter.dataset_converter(input_path, output_path, type_name="SHARDED_DATASET")
+    with open(os.path.join(output_path, "metadata.json")) as json_file:
+        metadata = json.load(json_file)
+    assert metadata["dataset_type"] == "SHARDED_DATASET"
+    with ShardedModelDataset(get_dataset_path(output_path, metadata)) as target_dataset:
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(target_dataset.read_song(song_index), expected_song_data)
+
+
+def test_dataset_converter_does_not_create_target_of_missing_source(tmp_path):
+    dataset_converter = pytest.importorskip("dataset_converter")
+    input_path = os.path.join(tmp_path, "stepcovnet_dataset")
+    output_path = os.path.join(tmp_path, "converted")
+    os.makedirs(input_path)
+    with open(os.path.join(input_path, "metadata.json"), "w") as json_file:
+        json.dump({"dataset_name": "stepcovnet", "dataset_type": "SINGULAR_DATASET", "config": {}}, json_file)
+    with pytest.raises(FileNotFoundError):
+        dataset_converter.dataset_converter(input_path, output_path, type_name="SHARDED_DATASET")
+    assert not os.path.exists(output_path)
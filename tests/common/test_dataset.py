@@ -0,0 +1,748 @@
+import os
+import subprocess
+import sys
+
+import h5py
+import numpy as np
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet import utils
+from stepcovnet.dataset import (
+    DIFFICULTIES,
+    ModelDataset,
+    DistributedModelDataset,
+    coalesce_rows,
+    quantize_features,
+    dequantize_features,
+)
+from stepcovnet.constants import ALL_ARROW_COMBS, NUM_ARROW_COMBS
+from stepcovnet.sharded_dataset import ShardedModelDataset
+
+
+def build_song_data(file_name: str, num_frames: int, difficulties: list[str], seed: int = 0) -> dict:
+    rng = np.random.default_rng(seed)
+    song_data = {
+        "features": rng.random((num_frames, 15, 80, 1)).astype("float16"),
+        "file_names": file_name,
+        "labels": {},
+        "sample_weights": {},
+        "arrows": {},
+        "label_encoded_arrows": {},
+        "binary_encoded_arrows": {},
+        "string_arrows": {},
+        "onehot_encoded_arrows": {},
+    }
+    for difficulty in difficulties:
+        codes = np.where(rng.random(num_frames) < 0.1, rng.integers(1, NUM_ARROW_COMBS, num_frames), 0)
+        string_arrows = ALL_ARROW_COMBS[codes]
+        arrows = np.array([list(arrow) for arrow in string_arrows], dtype=int)
+        binary_encoded_arrows = np.zeros((num_frames, 16))
+        for i in range(4):
+            binary_encoded_arrows[np.arange(num_frames), i * 4 + arrows[:, i]] = 1
+        song_data["labels"][difficulty] = (codes > 0).astype("int8")
+        song_data["sample_weights"][difficulty] = np.ones(num_frames, dtype="float16")
+        song_data["arrows"][difficulty] = arrows.astype("int8")
+        song_data["label_encoded_arrows"][difficulty] = codes.astype("int16")
+        song_data["binary_encoded_arrows"][difficulty] = binary_encoded_arrows.astype("int8")
+        song_data["string_arrows"][difficulty] = string_arrows.astype("S4")
+        song_data["onehot_encoded_arrows"][difficulty] = np.eye(NUM_ARROW_COMBS, dtype="int8")[codes]
+    return song_data
+
+
+def build_dataset(dataset_type, dataset_path: str, songs: list[dict], **kwargs):
+    with dataset_type(dataset_path, overwrite=True, **kwargs) as model_dataset:
+        for song_data in songs:
+            model_dataset.dump(**song_data)
+
+
+TEST_SONGS = [
+    build_song_data("song_a", 50, ["challenge", "hard", "medium", "easy", "beginner"], seed=0),
+    build_song_data("song_b", 30, ["challenge", "easy"], seed=1),
+    build_song_data("song_c", 40, ["hard"], seed=2),
+]
+
+
+def assert_song_equal(song_data: dict, expected_song_data: dict):
+    assert song_data["file_names"] == expected_song_data["file_names"]
+    assert np.array_equal(song_data["features"], expected_song_data["features"])
+    for dataset_name, data in expected_song_data.items():
+        if isinstance(data, dict):
+            assert set(song_data[dataset_name]) == set(data)
+            for difficulty, value in data.items():
+                assert np.array_equal(song_data[dataset_name][difficulty], value)
+
+
+def test_read_song_round_trip(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS)
+    with ModelDataset(dataset_path) as model_dataset:
+        assert len(model_dataset) == 120
+        assert model_dataset.file_names == ["song_a", "song_b", "song_c"]
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), expected_song_data)
+
+
+def test_distributed_read_song_round_trip(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(DistributedModelDataset, dataset_path, TEST_SONGS)
+    with DistributedModelDataset(dataset_path) as model_dataset:
+        assert len(model_dataset) == 120
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), expected_song_data)
+
+
+@pytest.mark.parametrize("label_layout", ["dense", "sparse"])
+def test_distributed_dataset_is_extended_incrementally(tmp_path, label_layout):
+    expected_path = os.path.join(tmp_path, "expected")
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(DistributedModelDataset, expected_path, TEST_SONGS, label_layout=label_layout)
+    build_dataset(DistributedModelDataset, dataset_path, TEST_SONGS[:2], label_layout=label_layout)
+    distributed_dataset = DistributedModelDataset(dataset_path)
+    distributed_dataset.mode = "a"
+    with distributed_dataset as model_dataset:
+        model_dataset.dump(**TEST_SONGS[2])
+        # Sizes are read from the records without rebuilding the virtual datasets
+        assert model_dataset.virtual_dataset_outdated
+        assert len(model_dataset) == 120
+        assert model_dataset.file_names == [dataset_path + "_" + song_data["file_names"] for song_data in TEST_SONGS]
+        assert model_dataset.virtual_dataset_outdated
+        assert model_dataset.get_song_index("song_c") == 2
+        assert not model_dataset.virtual_dataset_outdated
+    with DistributedModelDataset(dataset_path) as model_dataset, DistributedModelDataset(
+        expected_path
+    ) as expected_dataset:
+        assert len(model_dataset.h5py_file["features"].virtual_sources()) == 3
+        for dataset_name in expected_dataset.h5py_file:
+            assert dict(model_dataset.h5py_file[dataset_name].attrs) == dict(
+                expected_dataset.h5py_file[dataset_name].attrs
+            )
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert model_dataset.get_song_index(expected_song_data["file_names"]) == song_index
+            assert_song_equal(model_dataset.read_song(song_index), expected_song_data)
+
+
+def test_song_indexes(tmp_path):
+    for dataset_type in [ModelDataset, DistributedModelDataset]:
+        dataset_path = os.path.join(tmp_path, dataset_type.__name__)
+        build_dataset(dataset_type, dataset_path, TEST_SONGS)
+        with dataset_type(dataset_path) as model_dataset:
+            for song_index, song_data in enumerate(TEST_SONGS):
+                assert model_dataset.get_song_index(song_data["file_names"]) == song_index
+            with pytest.raises(KeyError):
+                model_dataset.get_song_index("missing_song")
+
+
+def test_legacy_file_names_are_converted_when_extended(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS[:2])
+    # Layout of datasets created before song names were appendable
+    with h5py.File(ModelDataset.append_file_type(dataset_path), "a") as h5py_file:
+        del h5py_file["file_names"]
+        del h5py_file["song_indexes"]
+        h5py_file.create_dataset(
+            "file_names", data=np.array(["song_a", "song_b"], dtype="S1024"), compression="lzf", dtype="S1024"
+        )
+    with ModelDataset(dataset_path) as model_dataset:
+        assert model_dataset.get_song_index("song_b") == 1
+    legacy_dataset = ModelDataset(dataset_path)
+    legacy_dataset.mode = "a"
+    with legacy_dataset as model_dataset:
+        model_dataset.dump(**TEST_SONGS[2])
+        assert model_dataset.h5py_file["file_names"].maxshape == (None,)
+        assert model_dataset.file_names == ["song_a", "song_b", "song_c"]
+        assert model_dataset.get_song_index("song_c") == 2
+        assert_song_equal(model_dataset.read_song(2), TEST_SONGS[2])
+
+
+@pytest.mark.parametrize(
+    "layout",
+    [
+        {"compression": "lzf"},
+        {"compression": "gzip", "compression_level": 9, "shuffle": True},
+        {"compression": "none", "chunk_rows": 16},
+    ],
+)
+def test_dataset_layout(tmp_path, layout):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS, **layout)
+    with ModelDataset(dataset_path) as model_dataset:
+        features = model_dataset.h5py_file["features"]
+        assert features.compression == (None if layout["compression"] == "none" else layout["compression"])
+        assert features.compression_opts == layout.get("compression_level")
+        assert features.shuffle == layout.get("shuffle", False)
+        if "chunk_rows" in layout:
+            assert features.chunks == (layout["chunk_rows"],) + features.shape[1:]
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), expected_song_data)
+
+
+def test_invalid_dataset_layout(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    with pytest.raises(ValueError):
+        ModelDataset(dataset_path, overwrite=True, compression="zstd")
+    with pytest.raises(ValueError):
+        ModelDataset(dataset_path, overwrite=True, compression="lzf", compression_level=4)
+    with pytest.raises(ValueError):
+        ModelDataset(dataset_path, overwrite=True, chunk_rows=0)
+    with pytest.raises(ValueError):
+        ModelDataset(dataset_path, overwrite=True, label_layout="bitmap")
+
+
+LABEL_DATASET_NAMES = [
+    "labels",
+    "sample_weights",
+    "arrows",
+    "label_encoded_arrows",
+    "binary_encoded_arrows",
+    "string_arrows",
+    "onehot_encoded_arrows",
+]
+
+
+@pytest.mark.parametrize("label_layout", ["sparse", "compact"])
+@pytest.mark.parametrize("dataset_type", [ModelDataset, DistributedModelDataset])
+def test_label_layout(tmp_path, dataset_type, label_layout):
+    dense_path = os.path.join(tmp_path, "dense")
+    sparse_path = os.path.join(tmp_path, label_layout)
+    build_dataset(dataset_type, dense_path, TEST_SONGS)
+    build_dataset(dataset_type, sparse_path, TEST_SONGS, label_layout=label_layout)
+    with dataset_type(sparse_path) as model_dataset:
+        assert model_dataset.label_layout == label_layout
+        assert "labels_challenge" not in model_dataset.h5py_file
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), expected_song_data)
+    for difficulty in ["challenge", "hard", "beginner"]:
+        with dataset_type(dense_path, difficulty=difficulty) as dense_dataset, dataset_type(
+            sparse_path, difficulty=difficulty
+        ) as sparse_dataset:
+            assert sparse_dataset.num_valid_samples == dense_dataset.num_valid_samples
+            assert sparse_dataset.pos_samples == dense_dataset.pos_samples
+            assert sparse_dataset.neg_samples == dense_dataset.neg_samples
+            for dataset_name in LABEL_DATASET_NAMES:
+                dense_data = getattr(dense_dataset, dataset_name)
+                sparse_data = getattr(sparse_dataset, dataset_name)
+                # Slices spanning songs with and without the difficulty
+                for item in [slice(None), slice(45, 95), slice(100, 120), slice(10, 10)]:
+                    assert sparse_data[item].dtype == dense_data[item].dtype
+                    assert np.array_equal(sparse_data[item], dense_data[item])
+                assert np.array_equal(sparse_data[-1], dense_data[-1])
+
+
+def test_coalesce_rows():
+    rows = np.array([9, 3, 4, 4, 20, 5, 10])
+    starts, stops, positions = coalesce_rows(rows)
+    assert starts.tolist() == [3, 9, 20]
+    assert stops.tolist() == [6, 11, 21]
+    assert np.array_equal(np.concatenate([np.arange(*bounds) for bounds in zip(starts, stops)])[positions], rows)
+    starts, stops, positions = coalesce_rows(rows, max_gap=3)
+    assert starts.tolist() == [3, 20]
+    assert stops.tolist() == [11, 21]
+    assert np.array_equal(np.concatenate([np.arange(3, 11), [20]])[positions], rows)
+    assert [len(bounds) for bounds in coalesce_rows([])] == [0, 0, 0]
+
+
+@pytest.mark.parametrize("layout", [{}, {"label_layout": "sparse"}, {"label_layout": "compact", "feature_encoding": "uint8"}])
+@pytest.mark.parametrize("dataset_type", [ModelDataset, DistributedModelDataset])
+def test_read_projected_rows(tmp_path, dataset_type, layout):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(dataset_type, dataset_path, TEST_SONGS, **layout)
+    with dataset_type(dataset_path, difficulty="hard") as model_dataset:
+        all_rows = model_dataset.read(slice(None))
+        assert list(all_rows) == ["features"] + LABEL_DATASET_NAMES
+        assert [len(data) for data in all_rows.values()] == [120] * 8
+        # Unsorted and repeated rows across songs with and without the difficulty
+        rows = [119, 3, 4, 60, 4, 0, 75, -1]
+        for max_gap in [0, 100]:
+            data = model_dataset.read(rows, columns=["labels", "features"], max_gap=max_gap)
+            assert list(data) == ["labels", "features"]
+            for column, column_data in data.items():
+                assert np.array_equal(column_data, all_rows[column][rows])
+        data = model_dataset.read(7, columns=["string_arrows"])
+        assert data["string_arrows"] == all_rows["string_arrows"][7]
+        data = model_dataset.read(slice(100, 10, -3), columns=["arrows"])
+        assert np.array_equal(data["arrows"], all_rows["arrows"][100:10:-3])
+        assert model_dataset.read([], columns=["onehot_encoded_arrows"])["onehot_encoded_arrows"].shape == (
+            0,
+            all_rows["onehot_encoded_arrows"].shape[1],
+        )
+        for item in [5, slice(40, 60)]:
+            for data, expected_data in zip(model_dataset[item], all_rows.values()):
+                assert np.array_equal(data, expected_data[item])
+        with pytest.raises(IndexError):
+            model_dataset.read([3, 120])
+        with pytest.raises(ValueError):
+            model_dataset.read([3], columns=["file_names"])
+
+
+@pytest.mark.parametrize("label_layout", ["sparse", "compact"])
+def test_label_layout_requires_unit_sample_weights(tmp_path, label_layout):
+    song_data = build_song_data("song_a", 20, ["challenge"])
+    song_data["sample_weights"]["challenge"] = np.full(20, 0.5, dtype="float16")
+    with ModelDataset(os.path.join(tmp_path, "dataset"), overwrite=True, label_layout=label_layout) as model_dataset:
+        with pytest.raises(ValueError):
+            model_dataset.dump(**song_data)
+
+
+def test_compact_label_layout_requires_arrows_at_onsets(tmp_path):
+    song_data = build_song_data("song_a", 20, ["challenge"])
+    song_data["labels"]["challenge"][0] = 1
+    song_data["label_encoded_arrows"]["challenge"][0] = 0
+    with ModelDataset(os.path.join(tmp_path, "dataset"), overwrite=True, label_layout="compact") as model_dataset:
+        with pytest.raises(ValueError):
+            model_dataset.dump(**song_data)
+
+
+def test_missing_difficulties_are_not_stored(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    songs = [
+        build_song_data("song_x", 2000, ["hard"], seed=3),
+        build_song_data("song_y", 1000, ["challenge", "hard"], seed=4),
+    ]
+    build_dataset(ModelDataset, dataset_path, songs)
+    with ModelDataset(dataset_path) as model_dataset:
+        assert model_dataset.get_available_difficulties(0) == ["hard"]
+        assert model_dataset.get_available_difficulties(1) == ["challenge", "hard"]
+        for song_index, expected_song_data in enumerate(songs):
+            assert_song_equal(model_dataset.read_song(song_index), expected_song_data)
+        assert (model_dataset.labels[:2000] == -1).all()
+        assert (model_dataset.string_arrows[:2000] == b"0000").all()
+        assert model_dataset.num_valid_samples == 1000
+        for dataset_name in LABEL_DATASET_NAMES:
+            assert model_dataset.h5py_file[dataset_name + "_beginner"].id.get_storage_size() == 0
+
+
+def test_legacy_datasets_keep_storing_missing_difficulties(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS[:2])
+    # Layout of datasets created before availability masks were added
+    with h5py.File(ModelDataset.append_file_type(dataset_path), "a") as h5py_file:
+        del h5py_file["available_difficulties"]
+        del h5py_file.attrs["label_layout"]
+    legacy_dataset = ModelDataset(dataset_path)
+    legacy_dataset.mode = "a"
+    with legacy_dataset as model_dataset:
+        model_dataset.dump(**TEST_SONGS[2])
+        assert "available_difficulties" not in model_dataset.h5py_file
+        assert model_dataset.get_available_difficulties(2) == ["hard"]
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), expected_song_data)
+
+
+def test_quantize_features():
+    rng = np.random.default_rng(5)
+    features = (rng.normal(size=(200, 15, 80, 2)) * np.linspace(0.1, 10, 80)[:, None]).astype("float16")
+    features[:, :, 0, 1] = 3
+    quantized, scales, offsets = quantize_features(features)
+    assert quantized.dtype == np.uint8 and quantized.shape == features.shape
+    assert scales.shape == offsets.shape == (80, 2)
+    errors = np.abs(dequantize_features(quantized, scales, offsets) - features.astype(np.float32))
+    assert (errors <= scales / 2 + 1e-5).all()
+    assert (errors[:, :, 0, 1] < 1e-5).all()
+
+
+@pytest.mark.parametrize("dataset_type", [ModelDataset, DistributedModelDataset])
+def test_uint8_feature_encoding(tmp_path, dataset_type):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(dataset_type, dataset_path, TEST_SONGS, feature_encoding="uint8")
+    all_features = np.concatenate([song_data["features"] for song_data in TEST_SONGS]).astype(np.float64)
+    scalers = utils.get_channel_scalers(all_features)
+    with dataset_type(dataset_path) as model_dataset:
+        assert model_dataset.feature_encoding == "uint8"
+        assert model_dataset.h5py_file["features"].dtype == np.uint8
+        features = model_dataset.features[:]
+        assert features.dtype == np.float16
+        assert np.abs(features - all_features).max() < 1 / 255
+        for song_index, song_data in enumerate(TEST_SONGS):
+            assert np.abs(model_dataset.read_song(song_index)["features"] - song_data["features"]).max() < 1 / 255
+        # Rows of several songs dequantized and scaled in one pass
+        scaled_features = model_dataset.read_features(45, 95, scalers=scalers)
+        expected_features = utils.apply_scalers(
+            dequantize_features(
+                model_dataset.h5py_file["features"][45:95],
+                np.repeat(model_dataset.h5py_file["feature_scales"][:], [5, 30, 15], axis=0)[:, None],
+                np.repeat(model_dataset.h5py_file["feature_offsets"][:], [5, 30, 15], axis=0)[:, None],
+            ).astype(np.float64),
+            scalers,
+        )
+        assert np.allclose(scaled_features, expected_features, atol=1e-5)
+
+
+@pytest.mark.parametrize("label_layout", ["dense", "compact"])
+def test_read_cache(tmp_path, label_layout):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS, label_layout=label_layout)
+    song_feature_bytes = TEST_SONGS[0]["features"].nbytes
+    with ModelDataset(dataset_path) as dataset, ModelDataset(
+        dataset_path, read_cache_bytes=song_feature_bytes * 2
+    ) as cached_dataset:
+        for item in [slice(45, 95), slice(0, 10), slice(10, 20), slice(100, 120), slice(None)]:
+            assert np.array_equal(cached_dataset.features[item], dataset.features[item])
+            for dataset_name in LABEL_DATASET_NAMES:
+                assert np.array_equal(getattr(cached_dataset, dataset_name)[item], getattr(dataset, dataset_name)[item])
+        assert np.array_equal(cached_dataset.features[-1], dataset.features[-1])
+        # Songs fitting in the budget are only read once
+        cached_dataset.cache_hits = cached_dataset.cache_misses = 0
+        cached_dataset.features[0:10]
+        cached_dataset.features[10:20]
+        assert (cached_dataset.cache_hits, cached_dataset.cache_misses) == (1, 1)
+        assert cached_dataset.read_cache_used_bytes <= song_feature_bytes * 2
+        # Cached rows are copied so callers cannot modify them
+        cached_dataset.features[0:10][:] = 0
+        assert np.array_equal(cached_dataset.features[0:10], dataset.features[0:10])
+
+
+def test_read_cache_eviction(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS)
+    cached_dataset = ModelDataset(dataset_path, read_cache_bytes=TEST_SONGS[0]["features"].nbytes)
+    cached_dataset.mode = "a"
+    with cached_dataset as model_dataset:
+        model_dataset.features[0:50]
+        model_dataset.features[50:80]
+        # The least recently used song is evicted to fit the budget
+        assert list(model_dataset.read_cache) == [("features", 1)]
+        model_dataset.features[0:50]
+        assert list(model_dataset.read_cache) == [("features", 0)]
+        assert (model_dataset.cache_hits, model_dataset.cache_misses) == (0, 3)
+        # The cache is cleared when songs are added
+        model_dataset.dump(**build_song_data("song_d", 10, ["challenge"]))
+        assert len(model_dataset.read_cache) == 0
+        assert model_dataset.read_cache_used_bytes == 0
+
+
+def test_chunk_cache(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS)
+    with ModelDataset(dataset_path, rdcc_nbytes=64 * 1024**2, rdcc_nslots=10007) as model_dataset:
+        _, nslots, nbytes, _ = model_dataset.h5py_file.id.get_access_plist().get_cache()
+        assert (nslots, nbytes) == (10007, 64 * 1024**2)
+    with pytest.raises(ValueError):
+        ModelDataset(dataset_path, rdcc_nbytes=0)
+    with pytest.raises(ValueError):
+        ModelDataset(dataset_path, read_cache_bytes=-1)
+
+
+def wait_for_read_ahead(model_dataset: ModelDataset, song_index: int, cache_key: str):
+    with model_dataset.song_read_ahead.condition:
+        assert model_dataset.song_read_ahead.condition.wait_for(
+            lambda: cache_key in model_dataset.song_read_ahead.songs.get(song_index, {}), timeout=10
+        )
+
+
+@pytest.mark.parametrize("read_cache_bytes", [0, 1 << 20])
+@pytest.mark.parametrize("layout", [{}, {"label_layout": "sparse"}, {"label_layout": "compact", "feature_encoding": "uint8"}])
+@pytest.mark.parametrize("dataset_type", [ModelDataset, DistributedModelDataset])
+def test_read_ahead(tmp_path, dataset_type, layout, read_cache_bytes):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(dataset_type, dataset_path, TEST_SONGS, **layout)
+    with dataset_type(dataset_path) as dataset, dataset_type(
+        dataset_path, read_ahead_songs=1, read_cache_bytes=read_cache_bytes
+    ) as read_ahead_dataset:
+        # Songs are read in batches of 16 rows in the read order, wrapping around once
+        read_order = [2, 0, 1]
+        read_ahead_dataset.set_read_order(read_order)
+        for song_index in read_order + read_order[:1]:
+            song_start_index, song_end_index = dataset.song_index_ranges[song_index]
+            for start in range(song_start_index, song_end_index, 16):
+                stop = min(start + 16, song_end_index)
+                assert np.array_equal(read_ahead_dataset.read_features(start, stop), dataset.read_features(start, stop))
+                for dataset_name in LABEL_DATASET_NAMES:
+                    assert np.array_equal(
+                        getattr(read_ahead_dataset, dataset_name)[start:stop], getattr(dataset, dataset_name)[start:stop]
+                    )
+            # The next song is read while the current one is
+            next_song_index = read_order[(read_order.index(song_index) + 1) % len(read_order)]
+            wait_for_read_ahead(read_ahead_dataset, next_song_index, "features")
+            assert set(read_ahead_dataset.song_read_ahead.songs) <= {song_index, next_song_index}
+        # The first song is read before the features are known to be read, and every other song is read ahead
+        assert read_ahead_dataset.song_read_ahead.hits >= len(LABEL_DATASET_NAMES) + 1
+        thread = read_ahead_dataset.song_read_ahead.thread
+        assert thread.is_alive()
+    assert not thread.is_alive()
+    with pytest.raises(ValueError):
+        ModelDataset(dataset_path, read_ahead_songs=-1)
+
+
+def test_read_ahead_of_sharded_dataset(tmp_path):
+    dataset_path = os.path.join(tmp_path, "sharded")
+    with ShardedModelDataset(dataset_path, overwrite=True, shard_name="a") as sharded_dataset:
+        for song_data in TEST_SONGS[:2]:
+            sharded_dataset.dump(**song_data)
+        sharded_dataset.shard_name = "b"
+        sharded_dataset.dump(**TEST_SONGS[2])
+    with ShardedModelDataset(dataset_path, read_ahead_songs=1) as sharded_dataset:
+        sharded_dataset.set_read_order([2, 1, 0])
+        assert [shard.song_read_ahead.read_order for shard in sharded_dataset.shards] == [[1, 0], [0]]
+        # Song 0 of the first shard is read ahead once song 1 is read
+        assert np.array_equal(sharded_dataset.features[50:60], TEST_SONGS[1]["features"][:10])
+        wait_for_read_ahead(sharded_dataset.shards[0], 0, "features")
+        assert np.array_equal(sharded_dataset.features[0:10], TEST_SONGS[0]["features"][:10])
+        assert sharded_dataset.shards[0].song_read_ahead.hits >= 1
+
+
+@pytest.mark.parametrize("feature_encoding", ["float16", "uint8"])
+@pytest.mark.parametrize("dataset_type", [ModelDataset, DistributedModelDataset])
+def test_song_stats(tmp_path, dataset_type, feature_encoding):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(dataset_type, dataset_path, TEST_SONGS, feature_encoding=feature_encoding)
+    with dataset_type(dataset_path) as model_dataset:
+        song_stats = model_dataset.get_song_stats()
+        assert song_stats["song_pos_samples"].shape == (3, 5)
+        for song_index, song_data in enumerate(TEST_SONGS):
+            for difficulty_index, difficulty in enumerate(DIFFICULTIES):
+                expected_pos_samples = song_data["labels"][difficulty].sum() if difficulty in song_data["labels"] else 0
+                assert song_stats["song_pos_samples"][song_index, difficulty_index] == expected_pos_samples
+        # Scalers from the moments of each song match the ones fit on the features as they are read back
+        song_index_ranges = model_dataset.song_index_ranges[:]
+        scalers = utils.get_channel_scalers_from_moments(
+            song_index_ranges[:, 1] - song_index_ranges[:, 0],
+            song_stats["feature_means"],
+            song_stats["feature_variances"],
+        )
+        expected_scalers = utils.get_channel_scalers(model_dataset.features[:].astype(np.float64))
+        for scaler, expected_scaler in zip(scalers, expected_scalers):
+            assert np.allclose(scaler.mean_, expected_scaler.mean_)
+            assert np.allclose(scaler.var_, expected_scaler.var_)
+            assert np.allclose(scaler.scale_, expected_scaler.scale_)
+            assert scaler.n_samples_seen_ == expected_scaler.n_samples_seen_
+
+
+def test_legacy_datasets_have_no_song_stats(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS[:2])
+    with h5py.File(ModelDataset.append_file_type(dataset_path), "a") as h5py_file:
+        for dataset_name in ["song_pos_samples", "feature_means", "feature_variances"]:
+            del h5py_file[dataset_name]
+    legacy_dataset = ModelDataset(dataset_path)
+    legacy_dataset.mode = "a"
+    with legacy_dataset as model_dataset:
+        model_dataset.dump(**TEST_SONGS[2])
+        assert model_dataset.get_song_stats() is None
+        assert "feature_means" not in model_dataset.h5py_file
+
+
+@pytest.mark.parametrize("flush_policy", [{"flush_songs": 2}, {"flush_songs": None, "flush_seconds": 1e-9}])
+def test_counters_are_written_on_flush(tmp_path, flush_policy):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    with ModelDataset(dataset_path, overwrite=True, **flush_policy) as model_dataset:
+        model_dataset.dump(**TEST_SONGS[0])
+        flushed = "num_songs" in model_dataset.h5py_file.attrs
+        assert flushed == (flush_policy.get("flush_songs") != 2)
+        # Counters kept in memory are read before they are written
+        assert len(model_dataset) == 50
+        model_dataset.dump(**TEST_SONGS[1])
+        assert model_dataset.h5py_file.attrs["num_songs"] == 2
+        assert model_dataset.h5py_file["features"].attrs["num_samples"] == 80
+        model_dataset.dump(**TEST_SONGS[2])
+    with ModelDataset(dataset_path) as model_dataset:
+        assert len(model_dataset) == 120
+        assert model_dataset.h5py_file.attrs["num_songs"] == 3
+        model_dataset.set_difficulty("hard")
+        assert model_dataset.num_valid_samples == 90
+        assert model_dataset.pos_samples == TEST_SONGS[0]["labels"]["hard"].sum() + TEST_SONGS[2]["labels"]["hard"].sum()
+
+
+@pytest.mark.parametrize("label_layout", ["dense", "sparse", "compact"])
+def test_songs_dumped_after_the_last_flush_are_removed(tmp_path, label_layout):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    model_dataset = ModelDataset(dataset_path, overwrite=True, flush_songs=None, label_layout=label_layout).__enter__()
+    model_dataset.dump(**TEST_SONGS[0])
+    model_dataset.flush()
+    model_dataset.dump(**TEST_SONGS[1])
+    model_dataset.dump(**TEST_SONGS[2])
+    # Closed without writing the counters of the last songs, like after a failed dump
+    model_dataset.h5py_file.close()
+    with ModelDataset(dataset_path) as model_dataset:
+        assert len(model_dataset) == 50
+        assert model_dataset.file_names == ["song_a"]
+        assert len(model_dataset.song_index_ranges) == 1
+        assert_song_equal(model_dataset.read_song(0), TEST_SONGS[0])
+        with pytest.raises(KeyError):
+            model_dataset.get_song_index("song_b")
+        # Readers only hide the songs
+        assert model_dataset.h5py_file["features"].shape[0] == 120
+    appended_dataset = ModelDataset(dataset_path)
+    appended_dataset.mode = "a"
+    with appended_dataset as model_dataset:
+        for song_data in TEST_SONGS[1:]:
+            model_dataset.dump(**song_data)
+        for song_index, song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), song_data)
+        model_dataset.set_difficulty("challenge")
+        assert model_dataset.num_valid_samples == 80
+
+
+def test_reader_does_not_remove_songs_of_open_writer(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    with ModelDataset(dataset_path, overwrite=True, flush_songs=None) as writer:
+        writer.dump(**TEST_SONGS[0])
+        writer.flush()
+        writer.dump(**TEST_SONGS[1])
+        with ModelDataset(dataset_path) as reader:
+            assert len(reader) == 50
+            assert reader.file_names == ["song_a"]
+            assert reader.get_song_index("song_a") == 0
+            with pytest.raises(KeyError):
+                reader.get_song_index("song_b")
+        writer.dump(**TEST_SONGS[2])
+    with ModelDataset(dataset_path) as model_dataset:
+        assert len(model_dataset) == 120
+        assert model_dataset.file_names == ["song_a", "song_b", "song_c"]
+        for song_index, song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), song_data)
+
+
+EXITING_WRITER = """
+import os
+import sys
+from stepcovnet.dataset import ModelDataset
+from test_dataset import TEST_SONGS
+model_dataset = ModelDataset(sys.argv[1], overwrite=True, flush_songs=None).__enter__()
+model_dataset.dump(**TEST_SONGS[0])
+model_dataset.flush()
+model_dataset.dump(**TEST_SONGS[1])
+model_dataset.h5py_file.flush()
+os._exit(0)
+"""
+
+
+def test_dataset_of_exited_writer_is_recovered(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    subprocess.run(
+        [sys.executable, "-c", EXITING_WRITER, dataset_path],
+        check=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(myPath, "../.."), myPath] + sys.path)),
+    )
+    with ModelDataset(dataset_path) as model_dataset:
+        assert model_dataset.file_names == ["song_a"]
+        assert len(model_dataset) == 50
+        assert_song_equal(model_dataset.read_song(0), TEST_SONGS[0])
+    appended_dataset = ModelDataset(dataset_path)
+    appended_dataset.mode = "a"
+    with appended_dataset as model_dataset:
+        assert model_dataset.removed_songs == 1
+        model_dataset.dump(**TEST_SONGS[2])
+    with ModelDataset(dataset_path) as model_dataset:
+        assert model_dataset.file_names == ["song_a", "song_c"]
+        assert_song_equal(model_dataset.read_song(1), TEST_SONGS[2])
+
+
+SWMR_WRITER = """
+import sys
+from stepcovnet.dataset import ModelDataset
+from test_dataset import TEST_SONGS
+with ModelDataset(sys.argv[1], overwrite=True, swmr=True, label_layout=sys.argv[2]) as model_dataset:
+    for song_data in TEST_SONGS:
+        model_dataset.dump(**song_data)
+        print(model_dataset.h5py_file.swmr_mode, flush=True)
+        sys.stdin.readline()
+print(model_dataset.counters_deferred, flush=True)
+"""
+
+
+@pytest.mark.parametrize("label_layout", ["dense", "sparse", "compact"])
+def test_swmr_reader_follows_writer(tmp_path, label_layout):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    expected_path = os.path.join(tmp_path, "expected")
+    build_dataset(ModelDataset, expected_path, TEST_SONGS, label_layout=label_layout)
+    # HDF5 files cannot be opened twice by a process, so the writer is another process
+    writer = subprocess.Popen(
+        [sys.executable, "-c", SWMR_WRITER, dataset_path, label_layout],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(myPath, "../.."), myPath] + sys.path)),
+    )
+    assert writer.stdout.readline().strip() == "True"
+    with ModelDataset(dataset_path, swmr=True) as model_dataset, ModelDataset(expected_path) as expected_dataset:
+        assert model_dataset.file_names == ["song_a"]
+        assert len(model_dataset) == 50
+        writer.stdin.write("\n")
+        writer.stdin.flush()
+        assert writer.stdout.readline().strip() == "True"
+        # Songs written after the reader opened the dataset are read after a refresh
+        assert len(model_dataset) == 50
+        model_dataset.refresh()
+        assert model_dataset.file_names == ["song_a", "song_b"]
+        assert len(model_dataset) == 80
+        assert model_dataset.get_song_index("song_b") == 1
+        assert_song_equal(model_dataset.read_song(1), TEST_SONGS[1])
+        writer.stdin.write("\n\n")
+        writer.stdin.flush()
+        assert writer.stdout.readline().strip() == "True"
+        # The reader still has the file open when the writer closes it
+        assert writer.stdout.readline().strip() == "True"
+        assert writer.wait(timeout=60) == 0
+        model_dataset.refresh()
+        assert np.array_equal(model_dataset.song_index_ranges, expected_dataset.song_index_ranges[:])
+        for difficulty in DIFFICULTIES:
+            model_dataset.set_difficulty(difficulty)
+            expected_dataset.set_difficulty(difficulty)
+            assert model_dataset.num_valid_samples == expected_dataset.num_valid_samples
+            assert model_dataset.pos_samples == expected_dataset.pos_samples
+            assert np.array_equal(model_dataset.labels[:], expected_dataset.labels[:])
+        for dataset_name, data in expected_dataset.get_song_stats().items():
+            assert np.array_equal(model_dataset.get_song_stats()[dataset_name], data)
+    # Counters and song indexes are written once the dataset is opened to append without readers
+    with ModelDataset(dataset_path) as model_dataset:
+        assert model_dataset.follows_writer
+        assert len(model_dataset) == 120
+    appended_dataset = ModelDataset(dataset_path)
+    appended_dataset.mode = "a"
+    with appended_dataset:
+        pass
+    with ModelDataset(dataset_path) as model_dataset, ModelDataset(expected_path) as expected_dataset:
+        assert not model_dataset.follows_writer
+        assert model_dataset.h5py_file.attrs["num_songs"] == 3
+        assert dict(model_dataset.h5py_file["song_indexes"].attrs) == {"song_a": 0, "song_b": 1, "song_c": 2}
+        for difficulty in DIFFICULTIES:
+            assert model_dataset.get_label_stats(difficulty) == expected_dataset.get_label_stats(difficulty)
+        for song_index, song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), song_data)
+
+
+def test_swmr_writer_without_readers_writes_counters_on_close(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS, swmr=True)
+    with ModelDataset(dataset_path) as model_dataset:
+        assert not model_dataset.follows_writer
+        # Variable-length strings cannot be appended in SWMR mode
+        assert model_dataset.h5py_file["file_names"].dtype == np.dtype("S1024")
+        assert model_dataset.h5py_file.attrs["num_songs"] == 3
+        assert model_dataset.h5py_file["features"].attrs["num_samples"] == 120
+        assert model_dataset.get_song_index("song_c") == 2
+        model_dataset.set_difficulty("hard")
+        assert model_dataset.num_valid_samples == 90
+
+
+def test_swmr_writer_that_stopped_is_recovered(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    model_dataset = ModelDataset(dataset_path, overwrite=True, swmr=True).__enter__()
+    for song_data in TEST_SONGS[:2]:
+        model_dataset.dump(**song_data)
+    # Stop while the rows of the third song are written
+    model_dataset.h5py_file["features"].resize(100, axis=0)
+    model_dataset.h5py_file.close()
+    with ModelDataset(dataset_path, swmr=True) as model_dataset:
+        assert model_dataset.follows_writer
+        assert len(model_dataset) == 80
+    appended_dataset = ModelDataset(dataset_path)
+    appended_dataset.mode = "a"
+    with appended_dataset as model_dataset:
+        assert len(model_dataset) == 80
+        assert model_dataset.h5py_file["features"].shape[0] == 80
+        assert "swmr_start_songs" not in model_dataset.h5py_file.attrs
+        model_dataset.dump(**TEST_SONGS[2])
+        for song_index, song_data in enumerate(TEST_SONGS):
+            assert model_dataset.get_song_index(song_data["file_names"]) == song_index
+            assert_song_equal(model_dataset.read_song(song_index), song_data)
+        model_dataset.set_difficulty("challenge")
+        assert model_dataset.num_valid_samples == 80
+
+
+def test_swmr_is_only_supported_by_single_file_datasets(tmp_path):
+    with pytest.raises(ValueError):
+        DistributedModelDataset(os.path.join(tmp_path, "dataset"), overwrite=True, swmr=True)
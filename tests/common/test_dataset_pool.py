@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.dataset import ModelDataset
+from stepcovnet.dataset_pool import DatasetPool
+from test_dataset import TEST_SONGS, build_dataset
+
+
+def test_pool_reuses_released_datasets(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS)
+    pool = DatasetPool()
+    with pool.open(ModelDataset, dataset_path) as model_dataset:
+        assert len(model_dataset) == 120
+        assert model_dataset.difficulty == "challenge"
+    with pool.open(ModelDataset, dataset_path, difficulty="hard") as reused_dataset:
+        assert reused_dataset is model_dataset
+        assert reused_dataset.difficulty == "hard"
+        assert pool.get_counters() == {"opened": 1, "reused": 1, "closed": 0, "idle": 0, "held": 1}
+    # Other options open another dataset
+    with pool.open(ModelDataset, dataset_path, read_cache_bytes=1 << 20) as cached_dataset:
+        assert cached_dataset is not model_dataset
+    assert pool.get_counters() == {"opened": 2, "reused": 1, "closed": 0, "idle": 2, "held": 0}
+    pool.close()
+    assert pool.get_counters()["closed"] == 2
+    assert not model_dataset.h5py_file
+    with pool.open(ModelDataset, dataset_path) as reopened_dataset:
+        assert reopened_dataset is not model_dataset
+        assert len(reopened_dataset) == 120
+    pool.close()
+
+
+def test_pool_gives_held_datasets_to_one_holder(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS)
+    pool = DatasetPool(max_idle=1)
+    with pool.open(ModelDataset, dataset_path) as first_dataset, pool.open(
+        ModelDataset, dataset_path, difficulty="hard"
+    ) as second_dataset:
+        assert first_dataset is not second_dataset
+        assert first_dataset.difficulty == "challenge"
+        assert second_dataset.difficulty == "hard"
+        assert pool.references[pool.get_key(ModelDataset, dataset_path)] == 2
+    # Only the last released dataset is kept open
+    assert pool.get_counters() == {"opened": 2, "reused": 0, "closed": 1, "idle": 1, "held": 0}
+    assert not second_dataset.h5py_file
+    assert len(first_dataset) == 120
+    assert not pool.references
+    # Held datasets are closed when released after the pool is closed
+    with pool.open(ModelDataset, dataset_path) as model_dataset:
+        pool.close()
+        assert len(model_dataset) == 120
+    assert not model_dataset.h5py_file
+    assert pool.get_counters() == {"opened": 2, "reused": 1, "closed": 2, "idle": 0, "held": 0}
+
+
+def test_pool_does_not_keep_failed_datasets(tmp_path):
+    pool = DatasetPool()
+    with pytest.raises(FileNotFoundError):
+        with pool.open(ModelDataset, os.path.join(tmp_path, "missing")):
+            pass
+    assert not pool.references
+    assert pool.get_counters() == {"opened": 0, "reused": 0, "closed": 0, "idle": 0, "held": 0}
+    with pytest.raises(ValueError):
+        DatasetPool(max_idle=-1)
+
+
+def test_pool_keeps_idle_datasets_that_are_still_held(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS)
+    pool = DatasetPool(max_idle=1)
+    with pool.open(ModelDataset, dataset_path):
+        with pool.open(ModelDataset, dataset_path) as idle_dataset:
+            pass
+        # Released last, but no one holds the dataset with this option
+        with pool.open(ModelDataset, dataset_path, read_cache_bytes=1 << 20) as cached_dataset:
+            pass
+        assert not cached_dataset.h5py_file
+        assert len(idle_dataset) == 120
+    pool.close()
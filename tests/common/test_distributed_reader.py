@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.dataset import DistributedModelDataset
+from stepcovnet.distributed_reader import DistributedSongReader
+from test_dataset import TEST_SONGS, assert_song_equal, build_dataset
+
+
+@pytest.mark.parametrize(
+    "layout",
+    [
+        {},
+        {"label_layout": "sparse"},
+        {"label_layout": "compact", "feature_encoding": "uint8"},
+    ],
+)
+def test_read_songs_from_song_files(tmp_path, layout):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(DistributedModelDataset, dataset_path, TEST_SONGS, **layout)
+    with DistributedModelDataset(dataset_path) as model_dataset:
+        expected_songs = [model_dataset.read_song(song_index) for song_index in range(len(TEST_SONGS))]
+    with DistributedSongReader(dataset_path, cores=1, max_open_files=2) as reader:
+        assert len(reader) == 3
+        assert list(reader.get_song_indexes(45, 95)) == [0, 1, 2]
+        assert list(reader.get_song_indexes(50, 80)) == [1]
+        songs = reader.read_songs([2, 0, 1, 2])
+        assert len(reader.song_file_cache.song_files) == 2
+    for song_data, song_index in zip(songs, [2, 0, 1, 2]):
+        assert_song_equal(song_data, expected_songs[song_index])
+
+
+def test_read_songs_with_worker_processes(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(DistributedModelDataset, dataset_path, TEST_SONGS, label_layout="sparse")
+    with DistributedSongReader(dataset_path, cores=2, max_open_files=1) as reader:
+        for song_data, expected_song_data in zip(reader.imap_songs(range(3)), TEST_SONGS):
+            assert_song_equal(song_data, expected_song_data)
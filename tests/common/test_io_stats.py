@@ -0,0 +1,89 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.dataset import DistributedModelDataset, ModelDataset
+from stepcovnet.io_stats import IOStats, get_selected_row_chunks
+from test_dataset import TEST_SONGS, assert_song_equal, build_dataset
+
+NUM_ROWS = sum(len(song_data["features"]) for song_data in TEST_SONGS)
+
+
+@pytest.mark.parametrize(
+    "selection, expected_chunks",
+    [
+        (slice(None), [0, 1, 2, 3]),
+        (Ellipsis, [0, 1, 2, 3]),
+        ((slice(10, 11), slice(None)), [1]),
+        (slice(9, 21), [0, 1, 2]),
+        (slice(5, 5), []),
+        (slice(0, 40, 15), [0, 1, 3]),
+        (-1, [3]),
+        (np.array([35, 2, 3]), [0, 3]),
+        ([1, 12], [0, 1]),
+        (np.arange(40) < 2, [0]),
+    ],
+)
+def test_selected_row_chunks(selection, expected_chunks):
+    assert list(get_selected_row_chunks(selection, num_rows=40, chunk_rows=10)) == expected_chunks
+
+
+def test_unknown_selection_has_no_chunks():
+    assert get_selected_row_chunks("features", num_rows=40, chunk_rows=10) is None
+
+
+@pytest.mark.parametrize("dataset_type", [ModelDataset, DistributedModelDataset])
+def test_dataset_io_stats(tmp_path, dataset_type):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    write_stats = IOStats()
+    build_dataset(dataset_type, dataset_path, TEST_SONGS, io_stats=write_stats)
+    write_report = write_stats.report()
+    assert write_report["files_opened"] >= 1
+    assert write_report["totals"]["writes"] > 0
+    assert write_report["totals"]["bytes_written"] >= sum(song_data["features"].nbytes for song_data in TEST_SONGS)
+
+    read_stats = IOStats()
+    with dataset_type(dataset_path, io_stats=read_stats) as model_dataset:
+        read_stats.reset()
+        features = model_dataset.features[0:NUM_ROWS]
+        assert features.shape[0] == NUM_ROWS
+        counters = read_stats.report()["datasets"]["features"]
+        assert counters["selections"] == 1
+        assert counters["bytes_requested"] == features.nbytes
+        assert counters["read_seconds"] > 0
+        assert counters["writes"] == 0
+        # Virtual datasets read the chunks of the song files, which are not modelled
+        assert ("modelled_chunk_cache_hits" in counters) == (dataset_type is ModelDataset)
+        for song_index, song_data in enumerate(TEST_SONGS):
+            assert_song_equal(model_dataset.read_song(song_index), song_data)
+    report = read_stats.report()
+    assert report["datasets"]["features"]["selections"] > 1
+    assert report["totals"]["bytes_requested"] == sum(counters["bytes_requested"] for counters in report["datasets"].values())
+    assert report["totals"]["writes"] == 0
+
+
+def test_chunk_cache_hits(tmp_path):
+    dataset_path = os.path.join(tmp_path, "dataset")
+    build_dataset(ModelDataset, dataset_path, TEST_SONGS, compression="lzf")
+    dataset_stats = IOStats()
+    with ModelDataset(dataset_path, io_stats=dataset_stats) as model_dataset:
+        for _ in range(2):
+            model_dataset.features[0:10]
+        counters = dataset_stats.report()["datasets"]["features"]
+        # The rows of the second read are still in the chunk cache
+        assert counters["selections"] == 2
+        assert counters["modelled_chunks_read"] == 2 * counters["modelled_chunk_cache_hits"] > 0
+        assert counters["modelled_bytes_decompressed"] > 0
+    assert dataset_stats.report()["files_opened"] == 1
+
+    uncompressed_path = os.path.join(tmp_path, "uncompressed")
+    build_dataset(ModelDataset, uncompressed_path, TEST_SONGS, compression="none")
+    dataset_stats.reset()
+    with ModelDataset(uncompressed_path, io_stats=dataset_stats) as model_dataset:
+        model_dataset.features[0:10]
+    assert dataset_stats.report()["totals"]["modelled_bytes_decompressed"] == 0
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.dataset import ModelDataset
+from stepcovnet.memmap_dataset import MemmapModelDataset, convert_dataset
+from test_dataset import LABEL_DATASET_NAMES, TEST_SONGS, assert_song_equal, build_dataset
+
+
+@pytest.mark.parametrize("label_layout", ["dense", "sparse"])
+def test_convert_dataset(tmp_path, label_layout):
+    source_path = os.path.join(tmp_path, "source")
+    memmap_path = os.path.join(tmp_path, "memmap")
+    build_dataset(ModelDataset, source_path, TEST_SONGS, label_layout=label_layout)
+    with ModelDataset(source_path) as source_dataset, MemmapModelDataset(memmap_path, overwrite=True) as memmap_dataset:
+        convert_dataset(source_dataset, memmap_dataset)
+
+    for difficulty in ["challenge", "hard", "beginner"]:
+        with ModelDataset(source_path, difficulty=difficulty) as source_dataset, MemmapModelDataset(
+            memmap_path, difficulty=difficulty
+        ) as memmap_dataset:
+            assert len(memmap_dataset) == len(source_dataset)
+            assert memmap_dataset.file_names == source_dataset.file_names
+            assert np.array_equal(memmap_dataset.song_index_ranges, source_dataset.song_index_ranges[:])
+            assert memmap_dataset.num_valid_samples == source_dataset.num_valid_samples
+            assert memmap_dataset.pos_samples == source_dataset.pos_samples
+            assert memmap_dataset.neg_samples == source_dataset.neg_samples
+            # Slices are views of the memory-mapped files
+            assert isinstance(memmap_dataset.features[10:60], np.memmap)
+            assert np.array_equal(memmap_dataset.features[10:60], source_dataset.features[10:60])
+            for dataset_name in LABEL_DATASET_NAMES:
+                memmap_data = getattr(memmap_dataset, dataset_name)[45:95]
+                source_data = getattr(source_dataset, dataset_name)[45:95]
+                assert memmap_data.dtype == source_data.dtype
+                assert np.array_equal(memmap_data, source_data)
+
+    with MemmapModelDataset(memmap_path) as memmap_dataset:
+        for song_index, expected_song_data in enumerate(TEST_SONGS):
+            assert memmap_dataset.get_song_index(expected_song_data["file_names"]) == song_index
+            assert_song_equal(memmap_dataset.read_song(song_index), expected_song_data)
+
+
+def test_memmap_files_are_npy(tmp_path):
+    memmap_path = os.path.join(tmp_path, "memmap")
+    with MemmapModelDataset(memmap_path, overwrite=True) as memmap_dataset:
+        for song_data in TEST_SONGS:
+            memmap_dataset.dump(**song_data)
+    features = np.load(memmap_path + ".features.npy")
+    assert np.array_equal(features, np.concatenate([song_data["features"] for song_data in TEST_SONGS]))
+    string_arrows = np.load(memmap_path + ".string_arrows_hard.npy")
+    assert string_arrows.shape == (120,)
+    assert (string_arrows[50:80] == b"0000").all()
+
+    # Overwriting removes the files of the previous dataset
+    with MemmapModelDataset(memmap_path, overwrite=True) as memmap_dataset:
+        memmap_dataset.dump(**TEST_SONGS[2])
+        assert len(memmap_dataset) == 40
+    assert len(np.load(memmap_path + ".features.npy")) == 40
@@ -0,0 +1,51 @@
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.memory_monitor import (
+    MemoryBudget,
+    StageMemoryTracker,
+    parse_memory_size,
+)
+
+
+def square(value: int) -> int:
+    return value * value
+
+
+def test_parse_memory_size():
+    assert parse_memory_size("512") == 512
+    assert parse_memory_size("512M") == 512 * 1024**2
+    assert parse_memory_size("1.5g") == int(1.5 * 1024**3)
+    assert parse_memory_size("16GB") == 16 * 1024**3
+    for invalid_memory_size in ["", "0", "-1G", "12X"]:
+        with pytest.raises(ValueError):
+            parse_memory_size(invalid_memory_size)
+
+
+def test_stage_memory_tracker_records_stage_peaks():
+    with StageMemoryTracker() as memory_tracker:
+        memory_tracker.set_stage("small")
+        memory_tracker.set_stage("large")
+        data = np.ones(64 * 1024**2 // 8)
+        memory_tracker.set_stage("done")
+        del data
+    assert set(memory_tracker.stage_peaks) == {"small", "large", "done"}
+    assert memory_tracker.stage_peaks["large"] > memory_tracker.stage_peaks["small"]
+
+
+def test_memory_budget_imap_keeps_order_and_progresses():
+    # A budget this small never allows more than one song in flight, but must not stall the collection
+    memory_budget = MemoryBudget(memory_budget=1, max_concurrency=2)
+    with multiprocessing.Pool(2) as pool:
+        assert list(memory_budget.imap(pool, square, range(10))) == [
+            value * value for value in range(10)
+        ]
+    assert memory_budget.concurrency == 1
+    assert memory_budget.peak_total_rss > 0
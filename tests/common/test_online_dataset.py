@@ -0,0 +1,115 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet import sample_collection_helper
+from stepcovnet.dataset import DIFFICULTIES
+from stepcovnet.online_dataset import OnlineModelDataset
+from stepcovnet.parameters import CONFIG
+
+TEST_DATA_PATH = os.path.relpath("tests/data/")
+TEST_CONFIG = dict(CONFIG, NUM_CHANNELS=1)
+
+
+def build_song_files(tmp_path) -> tuple[str, str]:
+    wavs_path = os.path.join(tmp_path, "wavs")
+    timings_path = os.path.join(tmp_path, "timings")
+    os.makedirs(wavs_path)
+    os.makedirs(timings_path)
+    audio_data, sample_rate = sf.read(os.path.join(TEST_DATA_PATH, "tide.ogg"))
+    # Different sample rates and lengths to check the frame counts computed without decoding the audio
+    sf.write(os.path.join(wavs_path, "tide.wav"), audio_data[20 * sample_rate : 24 * sample_rate], sample_rate)
+    sf.write(os.path.join(wavs_path, "tide_short.wav"), audio_data[20 * sample_rate : 23 * sample_rate : 2], sample_rate // 2)
+    # Only keep the notes of the audio excerpt since parsing timings is slow
+    timings = []
+    with open(os.path.join(TEST_DATA_PATH, "tide.txt")) as timings_file:
+        for line in timings_file.read().splitlines():
+            if line[:1].isdigit():
+                arrows, timing = line.split(" ")[0:2]
+                if 20 <= float(timing) < 24:
+                    timings.append("%s %f" % (arrows, float(timing) - 20))
+            else:
+                timings.append(line)
+    timings = "\n".join(timings) + "\n"
+    with open(os.path.join(timings_path, "tide.txt"), "w") as timings_file:
+        timings_file.write(timings)
+    with open(os.path.join(timings_path, "tide_short.txt"), "w") as timings_file:
+        timings_file.write(timings[: timings.index("DIFFICULTY Hard")])
+    return wavs_path, timings_path
+
+
+@pytest.mark.parametrize("sample_rate", [44100, 22050, 16000])
+def test_num_audio_features_matches_log_mels(sample_rate):
+    rng = np.random.default_rng(sample_rate)
+    for num_audio_samples in rng.integers(sample_rate // 10, sample_rate, 3):
+        log_mels = sample_collection_helper.get_log_mels(rng.random((num_audio_samples, 1)), sample_rate, TEST_CONFIG)
+        assert sample_collection_helper.get_num_audio_features(num_audio_samples, sample_rate, TEST_CONFIG) == len(log_mels)
+
+
+@pytest.mark.parametrize("cores", [1, 2])
+def test_online_dataset_matches_collected_songs(tmp_path, cores):
+    wavs_path, timings_path = build_song_files(tmp_path)
+    dataset_path = os.path.join(tmp_path, "dataset")
+    with OnlineModelDataset(dataset_path, overwrite=True, cores=cores) as model_dataset:
+        model_dataset.build(wavs_path, timings_path, TEST_CONFIG, ["tide", "tide_short"])
+    expected_songs = []
+    for file_name in ["tide", "tide_short"]:
+        log_mel, onsets, *arrows = sample_collection_helper.get_features_and_labels(
+            wavs_path, timings_path, file_name, TEST_CONFIG
+        )
+        expected_songs.append(
+            sample_collection_helper.feature_onset_phrase_label_sample_weights(onsets, log_mel, *arrows)
+        )
+    with OnlineModelDataset(dataset_path, cores=cores, cache_size=1) as model_dataset:
+        model_dataset.set_read_order([1, 0])
+        assert model_dataset.file_names == ["tide", "tide_short"]
+        assert model_dataset.song_index_ranges.tolist() == [
+            [0, len(expected_songs[0][0])],
+            [len(expected_songs[0][0]), len(expected_songs[0][0]) + len(expected_songs[1][0])],
+        ]
+        assert model_dataset.num_valid_samples == len(model_dataset)
+        assert model_dataset.pos_samples > 0
+        assert model_dataset.pos_samples == sum(song[1]["challenge"].sum() for song in expected_songs)
+        for song_index in [1, 0]:
+            song_start_index, song_end_index = model_dataset.song_index_ranges[song_index]
+            features, labels, _, _, label_encoded_arrows, _, string_arrows, onehot_encoded_arrows = expected_songs[song_index]
+            assert np.array_equal(model_dataset.labels[song_start_index:song_end_index], labels["challenge"])
+            assert np.array_equal(model_dataset.features[song_start_index:song_end_index], features.astype("float16"))
+            assert np.array_equal(
+                model_dataset.label_encoded_arrows[song_start_index:song_end_index], label_encoded_arrows["challenge"]
+            )
+            assert np.array_equal(model_dataset.string_arrows[song_start_index:song_end_index], string_arrows["challenge"])
+            assert np.array_equal(
+                model_dataset.onehot_encoded_arrows[song_start_index:song_end_index], onehot_encoded_arrows["challenge"]
+            )
+        # The training split and bias come from the manifest, but the scalers need the features
+        song_stats = model_dataset.get_song_stats()
+        assert list(song_stats) == ["song_pos_samples"]
+        for song_index, (features, labels, *_) in enumerate(expected_songs):
+            assert song_stats["song_pos_samples"][song_index].tolist() == [
+                int(labels[difficulty].sum()) if difficulty in labels else 0 for difficulty in DIFFICULTIES
+            ]
+        with pytest.raises(ValueError):
+            model_dataset.dump()
+        # Slices spanning several songs are read like a single dataset
+        song_boundary = model_dataset.song_index_ranges[1][0]
+        assert np.array_equal(
+            model_dataset.labels[song_boundary - 5 : song_boundary + 5],
+            np.concatenate([expected_songs[0][1]["challenge"][-5:], expected_songs[1][1]["challenge"][:5]]),
+        )
+        assert model_dataset.labels[song_boundary] == expected_songs[1][1]["challenge"][0]
+
+        model_dataset.set_difficulty("hard")
+        assert model_dataset.num_valid_samples == song_boundary
+        assert (model_dataset.labels[song_boundary:] == -1).all()
+        assert (model_dataset.string_arrows[song_boundary:] == b"0000").all()
+        assert np.array_equal(model_dataset.labels[:song_boundary], expected_songs[0][1]["hard"])
+        assert model_dataset.cache_hits > 0
+        # Songs are only computed ahead of time by worker processes when using several cores
+        assert (model_dataset.pool is not None) == (cores > 1)
@@ -0,0 +1,111 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet import utils
+from stepcovnet.dataset import ModelDataset
+from stepcovnet.sharded_dataset import ShardedModelDataset, open_shard
+from test_dataset import LABEL_DATASET_NAMES, TEST_SONGS, assert_song_equal, build_dataset, build_song_data
+
+SHARD_SONGS = {
+    "a": TEST_SONGS[:2],
+    "b": [build_song_data("song_d", 25, ["challenge", "medium"], seed=3)],
+    "c": TEST_SONGS[2:],
+}
+ALL_SONGS = SHARD_SONGS["a"] + SHARD_SONGS["b"] + SHARD_SONGS["c"]
+
+
+def build_sharded_dataset(dataset_path: str, **kwargs):
+    # Shards are written by separate writers while the sharded dataset is open, as when collecting
+    with ShardedModelDataset(dataset_path, overwrite=True, **kwargs):
+        for shard_name in ["c", "a", "b"]:
+            with open_shard(dataset_path, shard_name, **kwargs) as shard:
+                for song_data in SHARD_SONGS[shard_name]:
+                    shard.dump(**song_data)
+
+
+@pytest.mark.parametrize(
+    "layout", [{}, {"label_layout": "sparse"}, {"label_layout": "compact", "feature_encoding": "uint8"}]
+)
+def test_sharded_dataset_reads_like_one_dataset(tmp_path, layout):
+    sharded_path = os.path.join(tmp_path, "sharded")
+    single_path = os.path.join(tmp_path, "single")
+    build_sharded_dataset(sharded_path, **layout)
+    build_dataset(ModelDataset, single_path, ALL_SONGS, **layout)
+    assert sorted(os.listdir(tmp_path)) == [
+        "sharded.shard-a.hdf5",
+        "sharded.shard-b.hdf5",
+        "sharded.shard-c.hdf5",
+        "sharded.shards.json",
+        "single.hdf5",
+    ]
+    scalers = utils.get_channel_scalers(np.concatenate([song_data["features"] for song_data in ALL_SONGS]))
+    for difficulty in ["challenge", "hard", "medium"]:
+        with ShardedModelDataset(sharded_path, difficulty=difficulty) as sharded_dataset, ModelDataset(
+            single_path, difficulty=difficulty
+        ) as single_dataset:
+            assert sharded_dataset.layout == single_dataset.layout
+            assert len(sharded_dataset) == len(single_dataset) == 145
+            assert sharded_dataset.file_names == single_dataset.file_names
+            assert np.array_equal(sharded_dataset.song_index_ranges, single_dataset.song_index_ranges[:])
+            assert sharded_dataset.num_valid_samples == single_dataset.num_valid_samples
+            assert sharded_dataset.pos_samples == single_dataset.pos_samples
+            for song_index, song_data in enumerate(ALL_SONGS):
+                assert sharded_dataset.get_song_index(song_data["file_names"]) == song_index
+                assert sharded_dataset.get_available_difficulties(
+                    song_index
+                ) == single_dataset.get_available_difficulties(song_index)
+            # Rows within a shard and across the shard boundaries at rows 80 and 105
+            for start, stop in [(10, 40), (60, 120), (0, 145), (90, 90)]:
+                assert np.array_equal(sharded_dataset.features[start:stop], single_dataset.features[start:stop])
+                if start < stop:
+                    assert np.allclose(
+                        sharded_dataset.read_features(start, stop, scalers=scalers),
+                        single_dataset.read_features(start, stop, scalers=scalers),
+                    )
+                for dataset_name in LABEL_DATASET_NAMES:
+                    assert np.array_equal(
+                        getattr(sharded_dataset, dataset_name)[start:stop],
+                        getattr(single_dataset, dataset_name)[start:stop],
+                    )
+            sharded_stats = sharded_dataset.get_song_stats()
+            for dataset_name, data in single_dataset.get_song_stats().items():
+                assert np.array_equal(sharded_stats[dataset_name], data)
+    with ShardedModelDataset(sharded_path) as sharded_dataset:
+        for song_index, song_data in enumerate(ALL_SONGS):
+            read_song_data = sharded_dataset.read_song(song_index)
+            if layout.get("feature_encoding") == "uint8":
+                read_song_data["features"] = song_data["features"]
+            assert_song_equal(read_song_data, song_data)
+        with pytest.raises(KeyError):
+            sharded_dataset.get_song_index("song_z")
+
+
+def test_dump_to_sharded_dataset(tmp_path):
+    dataset_path = os.path.join(tmp_path, "sharded")
+    with ShardedModelDataset(dataset_path, overwrite=True, shard_name="main") as sharded_dataset:
+        for song_data in TEST_SONGS:
+            sharded_dataset.dump(**song_data)
+        assert len(sharded_dataset) == 120
+        assert_song_equal(sharded_dataset.read_song(1), TEST_SONGS[1])
+    assert os.path.isfile(dataset_path + ".shard-main.hdf5")
+    with ShardedModelDataset(dataset_path) as sharded_dataset:
+        assert sharded_dataset.file_names == ["song_a", "song_b", "song_c"]
+        with pytest.raises(ValueError):
+            sharded_dataset.dump(**TEST_SONGS[0])
+
+
+def test_shards_are_found_without_index(tmp_path):
+    dataset_path = os.path.join(tmp_path, "sharded")
+    build_sharded_dataset(dataset_path)
+    os.remove(ShardedModelDataset.append_file_type(dataset_path))
+    with ShardedModelDataset(dataset_path) as sharded_dataset:
+        assert sharded_dataset.file_names == [song_data["file_names"] for song_data in ALL_SONGS]
+    with pytest.raises(FileNotFoundError):
+        with ShardedModelDataset(os.path.join(tmp_path, "missing")):
+            pass
@@ -0,0 +1,114 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet import utils
+from stepcovnet.dataset import DistributedModelDataset, ModelDataset
+from stepcovnet.union_dataset import UnionModelDataset, create_union
+from test_dataset import LABEL_DATASET_NAMES, TEST_SONGS, assert_song_equal, build_dataset, build_song_data
+
+PACK_SONGS = {
+    "pack_a": TEST_SONGS[:2],
+    "pack_b": [build_song_data("song_d", 25, ["challenge", "medium"], seed=3)],
+    "pack_c": TEST_SONGS[2:],
+}
+ALL_SONGS = PACK_SONGS["pack_a"] + PACK_SONGS["pack_b"] + PACK_SONGS["pack_c"]
+
+
+def build_packs(tmp_path) -> list[tuple[str, str]]:
+    # Packs of different types and layouts, listed out of name order
+    members = [
+        ("SINGULAR_DATASET", os.path.join(tmp_path, "pack_a")),
+        ("DISTRIBUTED_DATASET", os.path.join(tmp_path, "pack_b")),
+        ("SINGULAR_DATASET", os.path.join(tmp_path, "pack_c")),
+    ]
+    build_dataset(ModelDataset, members[0][1], PACK_SONGS["pack_a"])
+    build_dataset(DistributedModelDataset, members[1][1], PACK_SONGS["pack_b"], label_layout="sparse")
+    build_dataset(ModelDataset, members[2][1], PACK_SONGS["pack_c"], label_layout="compact")
+    return members
+
+
+def test_union_dataset_reads_like_one_dataset(tmp_path):
+    members = build_packs(tmp_path)
+    union_path = os.path.join(tmp_path, "union", "all_packs")
+    os.makedirs(os.path.dirname(union_path))
+    create_union(union_path, members)
+    # Members are found relative to the index
+    with open(UnionModelDataset.append_file_type(union_path)) as index_file:
+        assert json.load(index_file)["members"][0] == {
+            "dataset_type": "SINGULAR_DATASET",
+            "dataset_name": os.path.join("..", "pack_a"),
+        }
+    single_path = os.path.join(tmp_path, "single")
+    build_dataset(ModelDataset, single_path, ALL_SONGS)
+    for difficulty in ["challenge", "hard", "medium"]:
+        with UnionModelDataset(union_path, difficulty=difficulty) as union_dataset, ModelDataset(
+            single_path, difficulty=difficulty
+        ) as single_dataset:
+            assert len(union_dataset) == len(single_dataset) == 145
+            assert union_dataset.file_names[0] == "song_a"
+            assert np.array_equal(union_dataset.song_index_ranges, single_dataset.song_index_ranges[:])
+            assert union_dataset.num_valid_samples == single_dataset.num_valid_samples
+            assert union_dataset.pos_samples == single_dataset.pos_samples
+            for song_index in range(len(ALL_SONGS)):
+                assert union_dataset.get_available_difficulties(
+                    song_index
+                ) == single_dataset.get_available_difficulties(song_index)
+            # Rows within a member and across the member boundaries at rows 80 and 105
+            for start, stop in [(10, 40), (60, 120), (0, 145), (90, 90)]:
+                assert np.array_equal(union_dataset.features[start:stop], single_dataset.features[start:stop])
+                for dataset_name in LABEL_DATASET_NAMES:
+                    assert np.array_equal(
+                        getattr(union_dataset, dataset_name)[start:stop],
+                        getattr(single_dataset, dataset_name)[start:stop],
+                    )
+            union_stats = union_dataset.get_song_stats()
+            for dataset_name, data in single_dataset.get_song_stats().items():
+                assert np.allclose(union_stats[dataset_name], data)
+    with UnionModelDataset(union_path) as union_dataset:
+        for song_index, song_data in enumerate(ALL_SONGS):
+            assert_song_equal(union_dataset.read_song(song_index), song_data)
+        assert union_dataset.get_song_index("song_c") == 3
+        with pytest.raises(ValueError):
+            union_dataset.dump(**TEST_SONGS[0])
+
+
+def test_invalid_union_dataset(tmp_path):
+    members = build_packs(tmp_path)
+    union_path = os.path.join(tmp_path, "union")
+    with pytest.raises(ValueError):
+        create_union(union_path, members + [("ONLINE_DATASET", os.path.join(tmp_path, "pack_a"))])
+    with pytest.raises(FileNotFoundError):
+        create_union(union_path, members + [("SINGULAR_DATASET", os.path.join(tmp_path, "missing"))])
+    with pytest.raises(FileNotFoundError):
+        with UnionModelDataset(union_path):
+            pass
+    with pytest.raises(ValueError):
+        UnionModelDataset(union_path, overwrite=True)
+    other_shape_song = build_song_data("song_e", 10, ["challenge"])
+    other_shape_song["features"] = other_shape_song["features"][:, :5]
+    build_dataset(ModelDataset, os.path.join(tmp_path, "pack_d"), [other_shape_song])
+    create_union(union_path, members + [("SINGULAR_DATASET", os.path.join(tmp_path, "pack_d"))])
+    with pytest.raises(ValueError):
+        with UnionModelDataset(union_path):
+            pass
+
+
+def test_merged_scalers_match_scalers_of_all_packs():
+    pack_features = [np.concatenate([song_data["features"] for song_data in songs]) for songs in PACK_SONGS.values()]
+    merged_scalers = utils.merge_channel_scalers(
+        [utils.get_channel_scalers(features) for features in pack_features]
+    )
+    expected_scalers = utils.get_channel_scalers(np.concatenate(pack_features))
+    for merged_scaler, expected_scaler in zip(merged_scalers, expected_scalers):
+        assert np.allclose(merged_scaler.mean_, expected_scaler.mean_)
+        assert np.allclose(merged_scaler.var_, expected_scaler.var_)
+        assert np.allclose(merged_scaler.scale_, expected_scaler.scale_)
+        assert merged_scaler.n_samples_seen_ == expected_scaler.n_samples_seen_
+    assert utils.merge_channel_scalers([]) is None
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import sys
+import time
+
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(myPath + "/../../"))
+
+from stepcovnet.dataset import ModelDataset
+from stepcovnet.work_queue import SharedWorkQueue
+from test_dataset import TEST_SONGS, assert_song_equal
+
+TEST_JOB_NAMES = ["song_%d" % i for i in range(40)]
+
+
+def run_collector(job_dir: str, worker_id: str):
+    job_queue = SharedWorkQueue(job_dir, worker_id=worker_id)
+    job_queue.initialize(TEST_JOB_NAMES)
+    with job_queue:
+        while not job_queue.is_finished():
+            job = job_queue.claim()
+            if job is None:
+                time.sleep(0.01)
+                continue
+            job_index, job_name = job
+            with open(os.path.join(job_dir, "collected_%s" % worker_id), "a") as file:
+                file.write(job_name + "\n")
+            job_queue.complete(job_index, worker_id)
+
+
+def test_collectors_claim_each_song_once(tmp_path):
+    job_dir = str(tmp_path)
+    collectors = [
+        multiprocessing.Process(target=run_collector, args=(job_dir, "worker_%d" % i))
+        for i in range(4)
+    ]
+    for collector in collectors:
+        collector.start()
+    for collector in collectors:
+        collector.join(timeout=60)
+        assert collector.exitcode == 0
+
+    collected = []
+    for file_name in os.listdir(job_dir):
+        if file_name.startswith("collected_"):
+            with open(os.path.join(job_dir, file_name)) as file:
+                collected += file.read().split()
+    assert sorted(collected) == sorted(TEST_JOB_NAMES)
+
+    completed_jobs = SharedWorkQueue(job_dir).completed_jobs()
+    assert [done["name"] for done in completed_jobs.values()] == TEST_JOB_NAMES
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    crashed_queue = SharedWorkQueue(str(tmp_path), worker_id="crashed", lease_seconds=5)
+    crashed_queue.initialize(TEST_JOB_NAMES[:1])
+    assert crashed_queue.claim() == (0, TEST_JOB_NAMES[0])
+
+    job_queue = SharedWorkQueue(str(tmp_path), worker_id="alive", lease_seconds=5)
+    job_queue.initialize(TEST_JOB_NAMES[:1])
+    assert job_queue.claim() is None
+
+    expired_time = time.time() - 10
+    os.utime(job_queue.get_lease_path(0), (expired_time, expired_time))
+    assert job_queue.claim() == (0, TEST_JOB_NAMES[0])
+    assert crashed_queue.renew() == [0]
+    assert job_queue.complete(0, "alive")
+    assert not crashed_queue.complete(0, "crashed")
+    assert job_queue.is_finished()
+
+
+def run_shard_collector(
+    job_dir: str, worker_id: str, crash_after_jobs: int | None = None
+):
+    # Writes the shard like collect_data_cooperatively, and exits without closing it after crash_after_jobs
+    songs = {song_data["file_names"]: song_data for song_data in TEST_SONGS}
+    job_queue = SharedWorkQueue(job_dir, worker_id=worker_id)
+    job_queue.initialize(list(songs))
+    shard_name = job_queue.new_shard_name()
+    completed_jobs = 0
+    with job_queue, ModelDataset(
+        job_queue.get_shard_path(shard_name), overwrite=True, swmr=True
+    ) as model_dataset:
+        while not job_queue.is_finished():
+            job = job_queue.claim()
+            if job is None:
+                time.sleep(0.01)
+                continue
+            job_index, job_name = job
+            model_dataset.dump(**songs[job_name])
+            model_dataset.flush()
+            job_queue.complete(job_index, shard_name)
+            completed_jobs += 1
+            if completed_jobs == crash_after_jobs:
+                os._exit(0)
+
+
+def test_shards_of_crashed_collector_are_merged(tmp_path):
+    job_dir = str(tmp_path)
+    for worker_id, crash_after_jobs in [("crashed", 2), ("alive", None)]:
+        collector = multiprocessing.Process(
+            target=run_shard_collector, args=(job_dir, worker_id, crash_after_jobs)
+        )
+        collector.start()
+        collector.join(timeout=60)
+        assert collector.exitcode == 0
+
+    # Songs are read from the shards recorded by the done markers, like merge_collected_shards
+    job_queue = SharedWorkQueue(job_dir)
+    completed_jobs = job_queue.completed_jobs()
+    assert [done["shard"].split("_")[0] for done in completed_jobs.values()] == [
+        "crashed",
+        "crashed",
+        "alive",
+    ]
+    for job_index, done in completed_jobs.items():
+        with ModelDataset(job_queue.get_shard_path(done["shard"])) as shard_dataset:
+            assert_song_equal(
+                shard_dataset.read_song(shard_dataset.get_song_index(done["name"])),
+                TEST_SONGS[job_index],
+            )
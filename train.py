@@ -5,18 +5,36 @@ import os
 import joblib
 from sklearn import preprocessing
 
-from stepcovnet import config, data, executor, inputs, training, model, dataset
+from stepcovnet import (
+    config,
+    data,
+    executor,
+    inputs,
+    training,
+    model,
+    dataset,
+    dataset_pool,
+    io_stats,
+    sharded_dataset,
+    union_dataset,
+    memory_monitor,
+    utils,
+)
 
 
 def load_training_data(
     input_path: str,
-) -> tuple[str, type[dataset.ModelDataset], list[preprocessing.StandardScaler], dict]:
+) -> tuple[
+    str, type[dataset.ModelDataset], list[preprocessing.StandardScaler] | None, dict
+]:
     metadata = json.load(open(os.path.join(input_path, "metadata.json"), "r"))
     dataset_name = metadata["dataset_name"]
     dataset_type = data.ModelDatasetTypes[metadata["dataset_type"]].value
-    dataset_path = os.path.join(input_path, dataset_name + "_dataset")
-    scalers = joblib.load(
-        open(os.path.join(input_path, dataset_name + "_scaler.pkl"), "rb")
+    dataset_path = utils.get_dataset_path(input_path, metadata)
+    scaler_path = os.path.join(input_path, dataset_name + "_scaler.pkl")
+    # Online datasets have no scalers saved since their features are only computed during training
+    scalers = (
+        joblib.load(open(scaler_path, "rb")) if os.path.isfile(scaler_path) else None
     )
     dataset_config = metadata["config"]
     return dataset_path, dataset_type, scalers, dataset_config
@@ -30,8 +48,45 @@ def run_training(
     lookback: int,
     difficulty: str,
     log_path: str,
+    read_cache_bytes: int = 0,
+    chunk_cache_bytes: int | None = None,
+    swmr: bool = False,
+    read_ahead_songs: int = 0,
+    count_io: bool = False,
+    scaler_songs: int | None = 16,
 ):
     dataset_path, dataset_type, scalers, dataset_config = load_training_data(input_path)
+    dataset_kwargs = {}
+    if (
+        read_cache_bytes
+        or chunk_cache_bytes is not None
+        or read_ahead_songs
+        or count_io
+    ):
+        if dataset_type not in (
+            dataset.ModelDataset,
+            dataset.DistributedModelDataset,
+            sharded_dataset.ShardedModelDataset,
+            union_dataset.UnionModelDataset,
+        ):
+            raise ValueError(
+                "Read caches, chunk caches, read-ahead and I/O counters are only supported by HDF5 datasets, not %s"
+                % dataset_type.__name__
+            )
+        dataset_kwargs = dict(
+            read_cache_bytes=read_cache_bytes,
+            rdcc_nbytes=chunk_cache_bytes,
+            read_ahead_songs=read_ahead_songs,
+        )
+        if count_io:
+            dataset_kwargs["io_stats"] = io_stats.IO_STATS
+    if swmr:
+        if dataset_type is not dataset.ModelDataset:
+            raise ValueError(
+                "Only single file datasets can be read while they are collected, not %s"
+                % dataset_type.__name__
+            )
+        dataset_kwargs["swmr"] = True
 
     hyperparameters = training.TrainingHyperparameters(log_path=log_path)
     training_config = config.TrainingConfig(
@@ -44,6 +99,8 @@ def run_training(
         lookback=lookback,
         difficulty=difficulty,
         tokenizer_name=data.Tokenizers.GPT2.name,
+        dataset_kwargs=dataset_kwargs,
+        scaler_songs=scaler_songs,
     )
     training_input = inputs.TrainingInput(training_config)
 
@@ -58,9 +115,18 @@ def run_training(
         model=classifier_model.model,
     )
 
-    executor.TrainingExecutor(stepcovnet_model=stepcovnet_model).execute(
-        input_data=training_input
-    )
+    try:
+        executor.TrainingExecutor(stepcovnet_model=stepcovnet_model).execute(
+            input_data=training_input
+        )
+    finally:
+        dataset_pool.DATASET_POOL.close()
+        print(
+            "Dataset handles: %(opened)d opened, %(reused)d reused, %(closed)d closed"
+            % dataset_pool.DATASET_POOL.get_counters()
+        )
+        if count_io:
+            io_stats.IO_STATS.print_report()
 
 
 def train(
@@ -71,6 +137,12 @@ def train(
     limit: int,
     name: str,
     log_path: str,
+    read_cache: str | None = None,
+    chunk_cache: str | None = None,
+    swmr_int: int = 0,
+    read_ahead: int = 0,
+    io_stats_int: int = 0,
+    scaler_songs: int = 16,
 ):
     if not os.path.isdir(input_path):
         raise NotADirectoryError(
@@ -87,9 +159,15 @@ def train(
     if limit == 0:
         raise ValueError("Limit cannot be = 0")
 
+    if swmr_int == 1 and limit > 0:
+        raise ValueError("Songs collected while training cannot be added with a limit")
+
     if name is not None and not name:
         raise ValueError("Model name cannot be empty")
 
+    if scaler_songs < 0:
+        raise ValueError("Number of songs to fit the scalers on must be >= 0")
+
     if log_path is not None and not os.path.isdir(log_path):
         print("Log output path not found. Creating directory...")
         os.makedirs(log_path, exist_ok=True)
@@ -99,6 +177,13 @@ def train(
             log_path, "tensorboard", datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
         )
 
+    read_cache_bytes = (
+        0 if read_cache is None else memory_monitor.parse_memory_size(read_cache)
+    )
+    chunk_cache_bytes = (
+        None if chunk_cache is None else memory_monitor.parse_memory_size(chunk_cache)
+    )
+
     difficulty = ["challenge", "hard", "medium", "easy", "beginner"][difficulty_int]
 
     built_model_name = "time%s_" % lookback if lookback > 1 else ""
@@ -120,6 +205,12 @@ def train(
         lookback=lookback,
         difficulty=difficulty,
         log_path=log_path,
+        read_cache_bytes=read_cache_bytes,
+        chunk_cache_bytes=chunk_cache_bytes,
+        swmr=swmr_int == 1,
+        read_ahead_songs=read_ahead,
+        count_io=io_stats_int == 1,
+        scaler_songs=scaler_songs if scaler_songs > 0 else None,
     )
 
 
@@ -161,6 +252,48 @@ if __name__ == "__main__":
     parser.add_argument(
         "--log", type=str, default=None, help="Output log data path for tensorboard"
     )
+    parser.add_argument(
+        "--read-cache",
+        type=str,
+        default=None,
+        help="Memory for decoded songs kept across reads of HDF5 datasets, e.g. 2G: default no cache",
+    )
+    parser.add_argument(
+        "--chunk-cache",
+        type=str,
+        default=None,
+        help="HDF5 chunk cache size of each dataset, e.g. 64M: default h5py size of 1M",
+    )
+    parser.add_argument(
+        "--swmr",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to start training while the dataset is collected with --swmr 1, adding the songs collected "
+        "since to the training songs between epochs: 0 - collected songs only, 1 - follow the collection",
+    )
+    parser.add_argument(
+        "--read-ahead",
+        type=int,
+        default=0,
+        help="Number of songs of HDF5 datasets read on a background thread ahead of the song being trained on: "
+        "0 - no read-ahead",
+    )
+    parser.add_argument(
+        "--io-stats",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to count the reads of HDF5 datasets by dataset name, printed when training ends and logged to "
+        "tensorboard with --log: 0 - no counters, 1 - count reads",
+    )
+    parser.add_argument(
+        "--scaler-songs",
+        type=int,
+        default=16,
+        help="Number of songs the scalers are fitted on when the dataset has no feature moments, like online "
+        "datasets decoding the audio while training: 0 - every song",
+    )
     args = parser.parse_args()
 
     train(
@@ -171,4 +304,10 @@ if __name__ == "__main__":
         limit=args.limit,
         name=args.name,
         log_path=args.log,
+        read_cache=args.read_cache,
+        chunk_cache=args.chunk_cache,
+        swmr_int=args.swmr,
+        read_ahead=args.read_ahead,
+        io_stats_int=args.io_stats,
+        scaler_songs=args.scaler_songs,
     )
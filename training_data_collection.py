@@ -1,5 +1,7 @@
+import contextlib
 import json
 import multiprocessing
+import multiprocessing.util
 import os
 import time
 from datetime import datetime
@@ -9,7 +11,22 @@ from os.path import join
 import joblib
 import psutil
 
-from stepcovnet import utils, data, sample_collection_helper, parameters, dataset
+from stepcovnet import (
+    affinity,
+    archive,
+    utils,
+    data,
+    sample_collection_helper,
+    parameters,
+    dataset,
+    memory_monitor,
+    online_dataset,
+    sharded_dataset,
+    work_queue,
+)
+
+# Shard of the sharded dataset written by each worker process of a sharded collection
+WORKER_SHARD_DATASET: dataset.ModelDataset | None = None
 
 
 def build_all_metadata(**kwargs) -> dict:
@@ -30,43 +47,59 @@ def update_all_metadata(all_metadata: dict, metadata: dict) -> dict:
 
 
 def collect_features(
-    wav_path: str, timing_path: str, config: dict, cores: int, file_name: str
+    wav_path: str | archive.SongArchive,
+    timing_path: str | archive.SongArchive,
+    config: dict,
+    cores: int,
+    track_memory: bool,
+    file_name: str,
 ) -> list | None:
     try:
         print("Feature collecting: %s" % file_name)
-        (
-            log_mel,
-            onsets,
-            arrows,
-            label_encoded_arrows,
-            binary_encoded_arrows,
-            string_arrows,
-            onehot_encoded_arrows,
-        ) = sample_collection_helper.get_features_and_labels(
-            wav_path, timing_path, file_name, config
-        )
-        (
-            feature,
-            label_dict,
-            sample_weights_dict,
-            arrows_dict,
-            label_encoded_arrows_dict,
-            binary_encoded_arrows_dict,
-            string_arrows_dict,
-            onehot_encoded_arrows_dict,
-        ) = sample_collection_helper.feature_onset_phrase_label_sample_weights(
-            onsets,
-            log_mel,
-            arrows,
-            label_encoded_arrows,
-            binary_encoded_arrows,
-            string_arrows,
-            onehot_encoded_arrows,
-            config["NUM_ARROW_TYPES"],
-        )
+        # Stage peaks are only recorded for the memory budget, since the tracker samples the RSS in a thread
+        with (
+            memory_monitor.StageMemoryTracker()
+            if track_memory
+            else contextlib.nullcontext()
+        ) as memory_tracker:
+            if memory_tracker is not None:
+                memory_tracker.set_stage("features_and_labels")
+            (
+                log_mel,
+                onsets,
+                arrows,
+                label_encoded_arrows,
+                binary_encoded_arrows,
+                string_arrows,
+                onehot_encoded_arrows,
+            ) = sample_collection_helper.get_features_and_labels(
+                wav_path, timing_path, file_name, config
+            )
+            if memory_tracker is not None:
+                memory_tracker.set_stage("frame_labels")
+            (
+                feature,
+                label_dict,
+                sample_weights_dict,
+                arrows_dict,
+                label_encoded_arrows_dict,
+                binary_encoded_arrows_dict,
+                string_arrows_dict,
+                onehot_encoded_arrows_dict,
+            ) = sample_collection_helper.feature_onset_phrase_label_sample_weights(
+                onsets,
+                log_mel,
+                arrows,
+                label_encoded_arrows,
+                binary_encoded_arrows,
+                string_arrows,
+                onehot_encoded_arrows,
+                config["NUM_ARROW_TYPES"],
+            )
         # Sleep for 2 seconds per core to prevent high RAM usage since this function is much faster than the main loop.
         # TODO: Figure out how to block this function call when collected features for each core
-        if cores > 1:
+        # The memory budget throttles dispatch instead.
+        if cores > 1 and not track_memory:
             time.sleep(cores * 2)
         # type casting features to float16 to save disk space.
         return [
@@ -79,6 +112,7 @@ def collect_features(
             binary_encoded_arrows_dict,
             string_arrows_dict,
             onehot_encoded_arrows_dict,
+            memory_tracker.report() if memory_tracker is not None else None,
         ]
     except Exception as ex:
         print("Error collecting features for %s: %r" % (file_name, ex))
@@ -96,57 +130,71 @@ def collect_data(
     multi: bool = False,
     limit: int = -1,
     cores: int = 1,
+    memory_budget: memory_monitor.MemoryBudget | None = None,
+    pool_kwargs: dict | None = None,
 ):
     scalers = None
     config["NUM_CHANNELS"] = config["NUM_MULTI_CHANNELS"] if multi else 1
     all_metadata = build_all_metadata(
-        dataset_name=name_prefix, dataset_type=dataset_type.name, config=config
+        dataset_name=name_prefix,
+        dataset_type=dataset_type.name,
+        config=config,
+        layout=training_dataset.layout,
+    )
+    timings_song_path = archive.get_song_path(timings_path)
+    func = partial(
+        collect_features,
+        archive.get_song_path(wavs_path),
+        timings_song_path,
+        config,
+        cores,
+        memory_budget is not None,
     )
-    func = partial(collect_features, wavs_path, timings_path, config, cores)
     file_names = [
         utils.get_filename(file_name, with_ext=False)
-        for file_name in utils.get_filenames_from_folder(timings_path)
+        for file_name in archive.get_filenames(timings_song_path)
     ]
 
-    with training_dataset as model_dataset:
-        with multiprocessing.Pool(cores) as pool:
+    # Stage peaks of the parent are only recorded in the memory report of a budget
+    with training_dataset as model_dataset, (
+        memory_monitor.StageMemoryTracker(poll_seconds=0.1)
+        if memory_budget is not None
+        else contextlib.nullcontext()
+    ) as parent_memory_tracker:
+        with multiprocessing.Pool(cores, **(pool_kwargs or {})) as pool:
             song_count = 0
-            for i, result in enumerate(pool.imap(func, file_names)):
+            results = (
+                pool.imap(func, file_names)
+                if memory_budget is None
+                else memory_budget.imap(pool, func, file_names)
+            )
+            for i, result in enumerate(results):
                 if result is None:
                     continue
-                (
-                    file_name,
-                    features,
-                    labels,
-                    weights,
-                    arrows,
-                    label_encoded_arrows,
-                    binary_encoded_arrows,
-                    string_arrows,
-                    onehot_encoded_arrows,
-                ) = result
+                file_name, features = result[0], result[1]
+                if memory_budget is not None:
+                    memory_budget.record_song(file_name, result[-1])
                 print(
                     "[%d/%d] Dumping to dataset: %s"
                     % (i + 1, len(file_names), file_name)
                 )
-                model_dataset.dump(
-                    features=features,
-                    labels=labels,
-                    sample_weights=weights,
-                    arrows=arrows,
-                    label_encoded_arrows=label_encoded_arrows,
-                    binary_encoded_arrows=binary_encoded_arrows,
-                    string_arrows=string_arrows,
-                    onehot_encoded_arrows=onehot_encoded_arrows,
-                    file_names=file_name,
-                )
+                if parent_memory_tracker is not None:
+                    parent_memory_tracker.set_stage("dump")
+                dump_collected_features(model_dataset, result)
                 all_metadata = update_all_metadata(
                     all_metadata, {"file_name": [file_name]}
                 )
+                if model_dataset.swmr and len(all_metadata["file_name"]) == 1:
+                    # Training can start reading the dataset once the metadata is saved
+                    save_metadata(output_path, all_metadata)
                 print(
                     "[%d/%d] Creating scalers: %s" % (i + 1, len(file_names), file_name)
                 )
+                if parent_memory_tracker is not None:
+                    parent_memory_tracker.set_stage("scalers")
                 scalers = utils.get_channel_scalers(features, existing_scalers=scalers)
+                if parent_memory_tracker is not None:
+                    parent_memory_tracker.set_stage("wait")
                 if limit > 0:
                     song_count += 1
                     print(
@@ -156,13 +204,377 @@ def collect_data(
                     if model_dataset.num_samples >= limit:
                         print("Limit reached after %d songs. Breaking..." % song_count)
                         break
+    if training_dataset.counters_deferred:
+        print(
+            "Counters of %s are written the next time it is opened to append, since readers still have it open"
+            % training_dataset.dataset_path
+        )
+    save_scalers_and_metadata(output_path, name_prefix, scalers, all_metadata)
+    if memory_budget is not None:
+        memory_budget.record_stages(parent_memory_tracker.stage_peaks)
+        save_memory_report(output_path, memory_budget)
+
+
+def collect_online_dataset(
+    wavs_path: str,
+    timings_path: str,
+    output_path: str,
+    name_prefix: str,
+    config: dict,
+    training_dataset: online_dataset.OnlineModelDataset,
+    dataset_type: data.ModelDatasetTypes,
+    multi: bool = False,
+    limit: int = -1,
+    pool_kwargs: dict | None = None,
+):
+    config["NUM_CHANNELS"] = config["NUM_MULTI_CHANNELS"] if multi else 1
+    all_metadata = build_all_metadata(
+        dataset_name=name_prefix, dataset_type=dataset_type.name, config=config
+    )
+    file_names = [
+        utils.get_filename(file_name, with_ext=False)
+        for file_name in archive.get_filenames(archive.get_song_path(timings_path))
+    ]
+    print("Reading song info of %d songs" % len(file_names))
+    with training_dataset as model_dataset:
+        model_dataset.build(
+            wavs_path=wavs_path,
+            timings_path=timings_path,
+            config=config,
+            file_names=file_names,
+            limit=limit,
+            pool_kwargs=pool_kwargs,
+        )
+        all_metadata = update_all_metadata(
+            all_metadata, {"file_name": model_dataset.file_names}
+        )
+        print(
+            "%d songs and %d frames added to the online dataset"
+            % (len(model_dataset.file_names), model_dataset.num_samples)
+        )
+    # Scalers are computed from the training songs when training since features are not computed here
+    print("Saving metadata")
+    with open(join(output_path, "metadata.json"), "w") as json_file:
+        json_file.write(json.dumps(all_metadata))
+
+
+def save_memory_report(output_path: str, memory_budget: memory_monitor.MemoryBudget):
+    memory_budget.print_report()
+    print("Saving memory report")
+    with open(join(output_path, "memory_report.json"), "w") as json_file:
+        json_file.write(json.dumps(memory_budget.report()))
+
+
+def save_scalers_and_metadata(
+    output_path: str, name_prefix: str, scalers: list | None, all_metadata: dict
+):
     print("Saving scalers")
     joblib.dump(scalers, open(join(output_path, name_prefix + "_scaler.pkl"), "wb"))
+    save_metadata(output_path, all_metadata)
+
+
+def save_metadata(output_path: str, all_metadata: dict):
     print("Saving metadata")
     with open(join(output_path, "metadata.json"), "w") as json_file:
         json_file.write(json.dumps(all_metadata))
 
 
+def dump_collected_features(model_dataset: dataset.ModelDataset, result: list):
+    (
+        file_name,
+        features,
+        labels,
+        weights,
+        arrows,
+        label_encoded_arrows,
+        binary_encoded_arrows,
+        string_arrows,
+        onehot_encoded_arrows,
+        _,
+    ) = result
+    model_dataset.dump(
+        features=features,
+        labels=labels,
+        sample_weights=weights,
+        arrows=arrows,
+        label_encoded_arrows=label_encoded_arrows,
+        binary_encoded_arrows=binary_encoded_arrows,
+        string_arrows=string_arrows,
+        onehot_encoded_arrows=onehot_encoded_arrows,
+        file_names=file_name,
+    )
+
+
+def close_worker_shard():
+    global WORKER_SHARD_DATASET
+    if WORKER_SHARD_DATASET is not None:
+        WORKER_SHARD_DATASET.close()
+        WORKER_SHARD_DATASET = None
+
+
+def collect_features_to_shard(
+    wav_path: str | archive.SongArchive,
+    timing_path: str | archive.SongArchive,
+    config: dict,
+    dataset_name: str,
+    dataset_kwargs: dict,
+    track_memory: bool,
+    file_name: str,
+) -> list | None:
+    global WORKER_SHARD_DATASET
+    result = collect_features(wav_path, timing_path, config, 1, track_memory, file_name)
+    if result is None:
+        return None
+    if WORKER_SHARD_DATASET is None:
+        WORKER_SHARD_DATASET = sharded_dataset.open_shard(
+            dataset_name, "worker-%d" % os.getpid(), **dataset_kwargs
+        ).__enter__()
+        # Pool workers run finalizers when they exit after the pool is closed
+        multiprocessing.util.Finalize(None, close_worker_shard, exitpriority=10)
+    print("[%d] Dumping to shard: %s" % (os.getpid(), file_name))
+    dump_collected_features(WORKER_SHARD_DATASET, result)
+    # Only the song size goes back to the parent, the features stay in the shard
+    return [file_name, len(result[1]), result[-1]]
+
+
+def collect_sharded_data(
+    wavs_path: str,
+    timings_path: str,
+    output_path: str,
+    name_prefix: str,
+    config: dict,
+    training_dataset: sharded_dataset.ShardedModelDataset,
+    dataset_kwargs: dict,
+    multi: bool = False,
+    limit: int = -1,
+    cores: int = 1,
+    memory_budget: memory_monitor.MemoryBudget | None = None,
+    pool_kwargs: dict | None = None,
+):
+    config["NUM_CHANNELS"] = config["NUM_MULTI_CHANNELS"] if multi else 1
+    all_metadata = build_all_metadata(
+        dataset_name=name_prefix,
+        dataset_type=data.ModelDatasetTypes.SHARDED_DATASET.name,
+        config=config,
+        layout=training_dataset.layout,
+    )
+    timings_song_path = archive.get_song_path(timings_path)
+    func = partial(
+        collect_features_to_shard,
+        archive.get_song_path(wavs_path),
+        timings_song_path,
+        config,
+        training_dataset.dataset_name,
+        dataset_kwargs,
+        memory_budget is not None,
+    )
+    file_names = [
+        utils.get_filename(file_name, with_ext=False)
+        for file_name in archive.get_filenames(timings_song_path)
+    ]
+
+    # Closing the sharded dataset after the workers closed their shards adds the shards to its index
+    with training_dataset:
+        with multiprocessing.Pool(cores, **(pool_kwargs or {})) as pool:
+            num_samples = 0
+            next_song = 0
+            pending_results = []
+            while pending_results or (
+                next_song < len(file_names) and not 0 < limit <= num_samples
+            ):
+                # Songs are dispatched a few at a time so no more songs are started once the limit is reached
+                while (
+                    next_song < len(file_names)
+                    and len(pending_results) < cores
+                    and not 0 < limit <= num_samples
+                    and (
+                        memory_budget is None
+                        or not pending_results
+                        or memory_budget.can_dispatch(len(pending_results))
+                    )
+                ):
+                    pending_results.append(
+                        pool.apply_async(func, (file_names[next_song],))
+                    )
+                    next_song += 1
+                result = pending_results.pop(0).get()
+                if result is None:
+                    continue
+                file_name, num_frames, memory_report = result
+                if memory_budget is not None:
+                    memory_budget.record_song(file_name, memory_report)
+                num_samples += num_frames
+                if limit > 0:
+                    print(
+                        "[%d/%d] Features collected: %s"
+                        % (num_samples, limit, file_name)
+                    )
+            # Workers close their shards when they exit
+            pool.close()
+            pool.join()
+
+    with sharded_dataset.ShardedModelDataset(
+        training_dataset.dataset_name
+    ) as model_dataset:
+        all_metadata = update_all_metadata(
+            all_metadata, {"file_name": model_dataset.file_names}
+        )
+        # Features are not sent back by the workers, so the scalers are built from the moments of each song
+        song_index_ranges = model_dataset.song_index_ranges
+        song_stats = model_dataset.get_song_stats()
+        scalers = (
+            None
+            if song_stats is None
+            else utils.get_channel_scalers_from_moments(
+                song_index_ranges[:, 1] - song_index_ranges[:, 0],
+                song_stats["feature_means"],
+                song_stats["feature_variances"],
+            )
+        )
+        print(
+            "%d songs and %d frames written to %d shards"
+            % (
+                len(model_dataset.file_names),
+                model_dataset.num_samples,
+                len(model_dataset.shards),
+            )
+        )
+    save_scalers_and_metadata(output_path, name_prefix, scalers, all_metadata)
+    if memory_budget is not None:
+        save_memory_report(output_path, memory_budget)
+
+
+def collect_data_cooperatively(
+    wavs_path: str,
+    timings_path: str,
+    config: dict,
+    job_queue: work_queue.SharedWorkQueue,
+    multi: bool = False,
+    cores: int = 1,
+    memory_budget: memory_monitor.MemoryBudget | None = None,
+    pool_kwargs: dict | None = None,
+    poll_seconds: float = 10.0,
+):
+    config["NUM_CHANNELS"] = config["NUM_MULTI_CHANNELS"] if multi else 1
+    # Dispatch is bounded by the number of claimed songs, so the RAM throttling sleep is not needed here.
+    timings_song_path = archive.get_song_path(timings_path)
+    func = partial(
+        collect_features,
+        archive.get_song_path(wavs_path),
+        timings_song_path,
+        config,
+        1,
+        memory_budget is not None,
+    )
+    job_queue.initialize(
+        [
+            utils.get_filename(file_name, with_ext=False)
+            for file_name in archive.get_filenames(timings_song_path)
+        ]
+    )
+    shard_name = job_queue.new_shard_name()
+    # Shards are written in SWMR mode, so the songs flushed before a collector crashed are still read when merging
+    shard_dataset = dataset.ModelDataset(
+        job_queue.get_shard_path(shard_name), overwrite=True, swmr=True
+    )
+    with job_queue, shard_dataset as model_dataset:
+        with multiprocessing.Pool(cores, **(pool_kwargs or {})) as pool:
+            pending_results = {}
+            while True:
+                while len(pending_results) < cores and (
+                    memory_budget is None
+                    or not pending_results
+                    or memory_budget.can_dispatch(len(pending_results))
+                ):
+                    job = job_queue.claim()
+                    if job is None:
+                        break
+                    job_index, file_name = job
+                    pending_results[job_index] = pool.apply_async(func, (file_name,))
+                if not pending_results:
+                    if job_queue.is_finished():
+                        break
+                    # Remaining songs are leased by other collectors. Wait in case their leases expire.
+                    time.sleep(poll_seconds)
+                    continue
+                job_index = next(iter(pending_results))
+                result = pending_results.pop(job_index).get()
+                if result is not None:
+                    if memory_budget is not None:
+                        memory_budget.record_song(result[0], result[-1])
+                    print(
+                        "[%s] Dumping to shard: %s"
+                        % (job_queue.worker_id, job_queue.job_names[job_index])
+                    )
+                    dump_collected_features(model_dataset, result)
+                    # The song must be in the shard before it is marked as done
+                    model_dataset.flush()
+                job_queue.complete(
+                    job_index, shard_name if result is not None else None
+                )
+    if memory_budget is not None:
+        memory_budget.print_report()
+
+
+def merge_collected_shards(
+    output_path: str,
+    name_prefix: str,
+    config: dict,
+    job_queue: work_queue.SharedWorkQueue,
+    training_dataset: dataset.ModelDataset,
+    dataset_type: data.ModelDatasetTypes,
+    multi: bool = False,
+    limit: int = -1,
+    poll_seconds: float = 10.0,
+):
+    config["NUM_CHANNELS"] = config["NUM_MULTI_CHANNELS"] if multi else 1
+    job_queue.load()
+    while not job_queue.is_finished():
+        print("Waiting for other collectors to finish...")
+        time.sleep(poll_seconds)
+    scalers = None
+    all_metadata = build_all_metadata(
+        dataset_name=name_prefix,
+        dataset_type=dataset_type.name,
+        config=config,
+        layout=training_dataset.layout,
+    )
+    shard_datasets = {}
+    try:
+        with training_dataset as model_dataset:
+            for job_index, done in job_queue.completed_jobs().items():
+                shard_name = done["shard"]
+                if shard_name is None:
+                    continue
+                if shard_name not in shard_datasets:
+                    shard_datasets[shard_name] = dataset.ModelDataset(
+                        job_queue.get_shard_path(shard_name)
+                    ).__enter__()
+                # A song can be in several shards if a lease expired while it was being collected.
+                # Only the copy recorded by the done marker is merged.
+                song_data = shard_datasets[shard_name].read_song(
+                    shard_datasets[shard_name].get_song_index(done["name"])
+                )
+                print(
+                    "[%d/%d] Merging to dataset: %s"
+                    % (job_index + 1, len(job_queue.job_names), done["name"])
+                )
+                model_dataset.dump(**song_data)
+                all_metadata = update_all_metadata(
+                    all_metadata, {"file_name": [done["name"]]}
+                )
+                scalers = utils.get_channel_scalers(
+                    song_data["features"], existing_scalers=scalers
+                )
+                if 0 < limit <= model_dataset.num_samples:
+                    print("Limit reached after merging %s. Breaking..." % done["name"])
+                    break
+    finally:
+        for shard_dataset in shard_datasets.values():
+            shard_dataset.close()
+    save_scalers_and_metadata(output_path, name_prefix, scalers, all_metadata)
+
+
 def training_data_collection(
     wavs_path: str,
     timings_path: str,
@@ -173,11 +585,29 @@ def training_data_collection(
     cores: int = 1,
     name: str | None = None,
     distributed_int: int = 0,
+    sharded_int: int = 0,
+    job_dir: str | None = None,
+    worker_id: str | None = None,
+    lease_seconds: float = 600.0,
+    merge_int: int = 0,
+    memory_budget: str | None = None,
+    pin_workers_int: int = 0,
+    blas_threads: int | None = None,
+    online_int: int = 0,
+    compression: str = "lzf",
+    compression_level: int | None = None,
+    shuffle_int: int = 0,
+    chunk_rows: int | None = None,
+    label_layout: str = "dense",
+    feature_encoding: str = "float16",
+    flush_songs: int = 1,
+    flush_seconds: float | None = None,
+    swmr_int: int = 0,
 ):
-    if not os.path.isdir(wavs_path):
+    if not os.path.isdir(wavs_path) and not archive.is_archive(wavs_path):
         raise NotADirectoryError("Audio path %s not found" % os.path.abspath(wavs_path))
 
-    if not os.path.isdir(timings_path):
+    if not os.path.isdir(timings_path) and not archive.is_archive(timings_path):
         raise NotADirectoryError(
             "Annotation path %s not found" % os.path.abspath(timings_path)
         )
@@ -194,29 +624,163 @@ def training_data_collection(
             % os.cpu_count()
         )
 
+    if blas_threads is not None and blas_threads <= 0:
+        raise ValueError("Number of BLAS threads per worker must be > 0")
+
+    if flush_songs < 0:
+        raise ValueError("Number of songs between flushes must be >= 0")
+
+    if merge_int == 1 and job_dir is None:
+        raise ValueError("A job directory is required to merge collected shards")
+
+    if sharded_int == 1 and (
+        distributed_int == 1 or online_int == 1 or job_dir is not None
+    ):
+        raise ValueError(
+            "Sharded datasets cannot be distributed, online or collected cooperatively"
+        )
+
+    if swmr_int == 1 and (
+        distributed_int == 1
+        or sharded_int == 1
+        or online_int == 1
+        or job_dir is not None
+    ):
+        raise ValueError("Only single writer collections can be read while collecting")
+
+    if online_int == 1 and (distributed_int == 1 or job_dir is not None):
+        raise ValueError(
+            "Online datasets cannot be distributed or collected cooperatively"
+        )
+
     multi = True if multi_int == 1 else False
     config = parameters.VGGISH_CONFIG if type_int == 1 else parameters.CONFIG
     limit = max(-1, limit)  # defaulting negative inputs to -1
     cores = psutil.cpu_count(logical=False) if cores < 0 else cores
     distributed = True if distributed_int == 1 else False
+    memory_budget = (
+        None
+        if memory_budget is None
+        else memory_monitor.MemoryBudget(
+            memory_monitor.parse_memory_size(memory_budget), max_concurrency=cores
+        )
+    )
+    layout = {
+        "compression": compression,
+        "compression_level": compression_level,
+        "shuffle": shuffle_int == 1,
+        "chunk_rows": chunk_rows,
+        "label_layout": label_layout,
+        "feature_encoding": feature_encoding,
+    }
+    # Not part of the layout, since it only affects writing the dataset
+    flush_policy = {
+        "flush_songs": flush_songs if flush_songs > 0 else None,
+        "flush_seconds": flush_seconds,
+    }
+    pool_kwargs = affinity.get_pool_kwargs(
+        cores, pin_workers=pin_workers_int == 1, blas_threads=blas_threads
+    )
 
     prefix = "multi_%d_channel_" % config["NUM_MULTI_CHANNELS"] if multi else ""
     name_prefix = name if name is not None else prefix + "stepcovnet"
-    name_postfix = "" if distributed is False else "_distributed"
-    name_postfix += "_dataset"
+    if online_int == 1:
+        dataset_type = data.ModelDatasetTypes.ONLINE_DATASET
+    elif distributed:
+        dataset_type = data.ModelDatasetTypes.DISTRIBUTED_DATASET
+    elif sharded_int == 1:
+        dataset_type = data.ModelDatasetTypes.SHARDED_DATASET
+    else:
+        dataset_type = data.ModelDatasetTypes.SINGULAR_DATASET
+    # Readers of the training data find the dataset from the type saved in its metadata
+    dataset_name = utils.get_dataset_name(name_prefix, dataset_type.name)
+
+    output_path = os.path.join(output_path, dataset_name)
+
+    start_time = time.time()
+    if job_dir is not None:
+        job_queue = work_queue.SharedWorkQueue(
+            job_dir, worker_id=worker_id, lease_seconds=lease_seconds
+        )
+        collect_data_cooperatively(
+            wavs_path=wavs_path,
+            timings_path=timings_path,
+            config=config,
+            job_queue=job_queue,
+            multi=multi,
+            cores=cores,
+            memory_budget=memory_budget,
+            pool_kwargs=pool_kwargs,
+        )
+        if merge_int == 1:
+            os.makedirs(output_path, exist_ok=True)
+            merge_collected_shards(
+                output_path=output_path,
+                name_prefix=name_prefix,
+                config=config,
+                job_queue=job_queue,
+                training_dataset=dataset_type.value(
+                    os.path.join(output_path, dataset_name),
+                    overwrite=True,
+                    **layout,
+                    **flush_policy,
+                ),
+                dataset_type=dataset_type,
+                multi=multi,
+                limit=limit,
+            )
+        end_time = time.time()
+        print("\nElapsed time was %g seconds" % (end_time - start_time))
+        return
 
-    output_path = os.path.join(output_path, name_prefix + name_postfix)
     os.makedirs(output_path, exist_ok=True)
-    dataset_type = (
-        data.ModelDatasetTypes.DISTRIBUTED_DATASET
-        if distributed
-        else data.ModelDatasetTypes.SINGULAR_DATASET
-    )
+    if online_int == 1:
+        collect_online_dataset(
+            wavs_path=wavs_path,
+            timings_path=timings_path,
+            output_path=output_path,
+            name_prefix=name_prefix,
+            config=config,
+            training_dataset=dataset_type.value(
+                os.path.join(output_path, dataset_name),
+                overwrite=True,
+                cores=cores,
+            ),
+            dataset_type=dataset_type,
+            multi=multi,
+            limit=limit,
+            pool_kwargs=pool_kwargs,
+        )
+        end_time = time.time()
+        print("\nElapsed time was %g seconds" % (end_time - start_time))
+        return
+
     training_dataset = dataset_type.value(
-        os.path.join(output_path, name_prefix + name_postfix), overwrite=True
+        os.path.join(output_path, dataset_name),
+        overwrite=True,
+        **layout,
+        **flush_policy,
+        swmr=swmr_int == 1,
     )
+    if sharded_int == 1:
+        collect_sharded_data(
+            wavs_path=wavs_path,
+            timings_path=timings_path,
+            output_path=output_path,
+            name_prefix=name_prefix,
+            config=config,
+            training_dataset=training_dataset,
+            dataset_kwargs=dict(layout, **flush_policy),
+            multi=multi,
+            limit=limit,
+            cores=cores,
+            memory_budget=memory_budget,
+            pool_kwargs=pool_kwargs,
+        )
+        end_time = time.time()
+        print("\nElapsed time was %g seconds" % (end_time - start_time))
+        return
 
-    start_time = time.time()
     collect_data(
         wavs_path=wavs_path,
         timings_path=timings_path,
@@ -228,6 +792,8 @@ def training_data_collection(
         cores=cores,
         training_dataset=training_dataset,
         dataset_type=dataset_type,
+        memory_budget=memory_budget,
+        pool_kwargs=pool_kwargs,
     )
     end_time = time.time()
 
@@ -240,9 +806,11 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Collect audio and timings data to create training dataset"
     )
-    parser.add_argument("-w", "--wav", type=str, required=True, help="Input wavs path")
     parser.add_argument(
-        "-t", "--timing", type=str, required=True, help="Input timings path"
+        "-w", "--wav", type=str, required=True, help="Input wavs path or archive"
+    )
+    parser.add_argument(
+        "-t", "--timing", type=str, required=True, help="Input timings path or archive"
     )
     parser.add_argument(
         "-o", "--output", type=str, required=True, help="Output collected data path"
@@ -284,6 +852,131 @@ if __name__ == "__main__":
         choices=[0, 1],
         help="Whether to create a single dataset or a distributed dataset: 0 - single, 1 - distributed",
     )
+    parser.add_argument(
+        "--sharded",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether each worker writes its songs to its own shard of a sharded dataset instead of sending them to "
+        "a single writer: 0 - single writer, 1 - sharded",
+    )
+    parser.add_argument(
+        "--job-dir",
+        type=str,
+        default=None,
+        help="Shared job directory to collect cooperatively with other collectors on this or other hosts",
+    )
+    parser.add_argument(
+        "--worker-id",
+        type=str,
+        default=None,
+        help="Unique name of this collector in the shared job directory: defaults to <hostname>_<pid>",
+    )
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=600.0,
+        help="Seconds without a heartbeat before a claimed song is given to another collector",
+    )
+    parser.add_argument(
+        "--merge",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to merge the shards of the job directory into the output dataset once all songs are "
+        "collected: 0 - no merge, 1 - merge",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=str,
+        default=None,
+        help="Maximum memory used by the collector and its workers, e.g. 8G or 512M: dispatch is throttled and "
+        "concurrency reduced when close to the budget",
+    )
+    parser.add_argument(
+        "--pin-workers",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to pin each worker to its own cpus spread across NUMA nodes: 0 - no pinning, 1 - pinning",
+    )
+    parser.add_argument(
+        "--blas-threads",
+        type=int,
+        default=None,
+        help="Maximum BLAS/OpenMP threads per worker: defaults to the number of cpus of the worker when pinning",
+    )
+    parser.add_argument(
+        "--online",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to store features and labels or compute them on demand during training from the source "
+        "files: 0 - stored, 1 - computed on demand",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default="lzf",
+        choices=dataset.COMPRESSION_TYPES,
+        help="Compression of the datasets",
+    )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=None,
+        choices=range(10),
+        help="Compression level of gzip: defaults to 4",
+    )
+    parser.add_argument(
+        "--shuffle",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to apply the shuffle filter before compression: 0 - no shuffle, 1 - shuffle",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        default=None,
+        help="Number of rows per chunk: defaults to the chunk shape guessed by h5py",
+    )
+    parser.add_argument(
+        "--label-layout",
+        type=str,
+        default="dense",
+        choices=dataset.LABEL_LAYOUTS,
+        help="How labels are stored: dense - every label encoding of every frame, sparse - only the onsets and "
+        "their arrow codes, compact - the arrow code of every frame",
+    )
+    parser.add_argument(
+        "--feature-encoding",
+        type=str,
+        default="float16",
+        choices=dataset.FEATURE_ENCODINGS,
+        help="How features are stored: float16 - as computed, uint8 - quantized per song and frequency band",
+    )
+    parser.add_argument(
+        "--flush-songs",
+        type=int,
+        default=1,
+        help="Number of songs dumped between writes of the dataset counters to disk: 0 - only when the dataset is "
+        "closed",
+    )
+    parser.add_argument(
+        "--flush-seconds",
+        type=float,
+        default=None,
+        help="Maximum seconds between writes of the dataset counters to disk: defaults to no time limit",
+    )
+    parser.add_argument(
+        "--swmr",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to write the dataset in HDF5 SWMR mode, so training with --swmr 1 can start after the first "
+        "song: 0 - no SWMR, 1 - SWMR",
+    )
     args = parser.parse_args()
 
     training_data_collection(
@@ -296,4 +989,22 @@ if __name__ == "__main__":
         cores=args.cores,
         name=args.name,
         distributed_int=args.distributed,
+        sharded_int=args.sharded,
+        job_dir=args.job_dir,
+        worker_id=args.worker_id,
+        lease_seconds=args.lease,
+        merge_int=args.merge,
+        memory_budget=args.memory_budget,
+        pin_workers_int=args.pin_workers,
+        blas_threads=args.blas_threads,
+        online_int=args.online,
+        compression=args.compression,
+        compression_level=args.compression_level,
+        shuffle_int=args.shuffle,
+        chunk_rows=args.chunk_rows,
+        label_layout=args.label_layout,
+        feature_encoding=args.feature_encoding,
+        flush_songs=args.flush_songs,
+        flush_seconds=args.flush_seconds,
+        swmr_int=args.swmr,
     )
@@ -9,11 +9,11 @@ import psutil
 import resampy
 import soundfile as sf
 
-from stepcovnet import utils
+from stepcovnet import affinity, archive, sample_collection_helper, utils
 
 
 def convert_file(
-    input_path: str,
+    input_path: str | archive.SongArchive,
     output_path: str,
     sample_frequency: int,
     verbose: bool,
@@ -23,9 +23,12 @@ def convert_file(
         new_file_name = utils.standardize_filename(utils.get_filename(file_name, False))
         if verbose:
             print("Converting " + file_name)
-        file_input_path = join(input_path, file_name)
         file_output_path = join(output_path, new_file_name + ".wav")
-        input_audio_data, input_audio_sample_rate = sf.read(file_input_path)
+        input_audio_data, input_audio_sample_rate = (
+            sample_collection_helper.get_audio_data(
+                archive.open_song_file(input_path, file_name)
+            )
+        )
         if input_audio_data.shape[1] > 1:
             input_audio_data = np.mean(input_audio_data, axis=1)
         else:
@@ -43,9 +46,21 @@ def convert_file(
 
 
 def run_process(
-    input_path: str, output_path: str, sample_frequency: int, cores: int, verbose: bool
+    input_path: str,
+    output_path: str,
+    sample_frequency: int,
+    cores: int,
+    verbose: bool,
+    pool_kwargs: dict | None = None,
 ):
-    if os.path.isfile(input_path):
+    if archive.is_archive(input_path):
+        song_archive = archive.SongArchive(input_path)
+        func = partial(
+            convert_file, song_archive, output_path, sample_frequency, verbose
+        )
+        with multiprocessing.Pool(cores, **(pool_kwargs or {})) as pool:
+            pool.map_async(func, song_archive.get_filenames()).get()
+    elif os.path.isfile(input_path):
         convert_file(
             os.path.dirname(input_path),
             output_path,
@@ -56,7 +71,7 @@ def run_process(
     else:
         file_names = utils.get_filenames_from_folder(input_path)
         func = partial(convert_file, input_path, output_path, sample_frequency, verbose)
-        with multiprocessing.Pool(cores) as pool:
+        with multiprocessing.Pool(cores, **(pool_kwargs or {})) as pool:
             pool.map_async(func, file_names).get()
 
 
@@ -66,6 +81,8 @@ def wav_converter(
     sample_frequency: int = 16000,
     cores: int = 1,
     verbose_int: int = 0,
+    pin_workers_int: int = 0,
+    blas_threads: int | None = None,
 ):
     start_time = time.time()
     if verbose_int not in [0, 1]:
@@ -85,12 +102,20 @@ def wav_converter(
             % os.cpu_count()
         )
 
+    if blas_threads is not None and blas_threads <= 0:
+        raise ValueError("Number of BLAS threads per worker must be > 0")
+
     cores = psutil.cpu_count(logical=False) if cores < 0 else cores
+    pool_kwargs = affinity.get_pool_kwargs(
+        cores, pin_workers=pin_workers_int == 1, blas_threads=blas_threads
+    )
 
     if os.path.isfile(input_path) or os.path.isdir(input_path):
         if verbose:
             print("Starting .wav conversion\n-----------------------------------------")
-        run_process(input_path, output_path, sample_frequency, cores, verbose)
+        run_process(
+            input_path, output_path, sample_frequency, cores, verbose, pool_kwargs
+        )
     else:
         raise FileNotFoundError(
             "Audio file(s) path %s not found" % os.path.abspath(input_path)
@@ -105,7 +130,11 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Convert audio files to .wav format")
     parser.add_argument(
-        "-i", "--input", type=str, required=True, help="Input audio file/directory path"
+        "-i",
+        "--input",
+        type=str,
+        required=True,
+        help="Input audio file/directory/archive path",
     )
     parser.add_argument(
         "-o", "--output", type=str, required=True, help="Output wavs path"
@@ -131,8 +160,27 @@ if __name__ == "__main__":
         choices=[0, 1],
         help="Verbosity: 0 - none, 1 - full",
     )
+    parser.add_argument(
+        "--pin-workers",
+        type=int,
+        default=0,
+        choices=[0, 1],
+        help="Whether to pin each worker to its own cpus spread across NUMA nodes: 0 - no pinning, 1 - pinning",
+    )
+    parser.add_argument(
+        "--blas-threads",
+        type=int,
+        default=None,
+        help="Maximum BLAS/OpenMP threads per worker: defaults to the number of cpus of the worker when pinning",
+    )
     args = parser.parse_args()
 
     wav_converter(
-        args.input, args.output, args.sample_frequency, args.cores, args.verbose
+        args.input,
+        args.output,
+        args.sample_frequency,
+        args.cores,
+        args.verbose,
+        args.pin_workers,
+        args.blas_threads,
     )